@@ -204,7 +204,7 @@ log_dict = {'WARNING': logging.WARNING,
 def setup_logging():
     """ Method to setup the logging options. """
     global debug, info, warning, critical, error, root_logger, set_level,\
-           setLevel, filename, level
+           setLevel, filename, level, _filtered
 
     level = log_dict.get(config.get_parameter('brisa', 'logging'),
                          logging.DEBUG)
@@ -222,25 +222,100 @@ def setup_logging():
         root_logger.setLevel(level)
         
         root_logger.findCaller = findCaller
+        _filtered = True
         
         
 
     def set_level(level):
         """ Real implementation of the set level function. """
         root_logger.setLevel(log_dict.get(level))
+        _update_levels()
 
     def setLevel(level):
         """ Method to set the log level. """
         set_level(level)
 
 
+# Module names of the calling code files, as in LogRecord.module
+_module_names = {}
+
+# Whether records are dropped by consoleFilter unless their module is
+# enabled in modcheck
+_filtered = False
+
+# Debug calls are no-ops when running optimized (python -O) or when the
+# brisa parameter debug_calls is off
+_debug_calls = __debug__ and config.get_parameter('brisa', 'debug_calls') \
+               not in ['off', 'no', '0', 'False', False]
+
+
+def _caller_module(frame):
+    filename = frame.f_code.co_filename
+    name = _module_names.get(filename, None)
+    if name is None:
+        name = os.path.splitext(os.path.basename(filename))[0]
+        _module_names[filename] = name
+    return name
+
+
+def _noop(msg, *args, **kwargs):
+    pass
+
+
+def _make_level_function(levelno, method):
+    """ Returns a function logging at levelno through method. The level and
+    module checks are done before the record or the message are built, so
+    a call for a disabled level or module costs a few lookups as long as
+    the arguments are passed separately from the message.
+    """
+    def log_function(msg, *args, **kwargs):
+        if levelno < _threshold:
+            return
+        if _filtered and 'all' not in modcheck and \
+           modcheck.get(_caller_module(sys._getframe(1)), False) != True:
+            return
+        method(msg, *args, **kwargs)
+    return log_function
+
+
+def is_enabled(levelno=logging.DEBUG):
+    """ Returns True if a message at levelno from the calling module would be
+    logged. Use it to guard arguments that are expensive to build.
+
+    @param levelno: logging level, defaults to logging.DEBUG
+    @type levelno: integer
+
+    @rtype: boolean
+    """
+    if levelno < _threshold:
+        return False
+    if levelno == logging.DEBUG and not _debug_calls:
+        return False
+    if _filtered and 'all' not in modcheck and \
+       modcheck.get(_caller_module(sys._getframe(1)), False) != True:
+        return False
+    return True
+
+
+def _update_levels():
+    """ Caches the effective level of the root logger and rebinds the level
+    functions. Called on setup and whenever the level changes.
+    """
+    global debug, info, warning, critical, error, _threshold
+    _threshold = root_logger.getEffectiveLevel()
+    if _debug_calls and _threshold <= logging.DEBUG:
+        debug = _make_level_function(logging.DEBUG, root_logger.debug)
+    else:
+        debug = _noop
+    info = _make_level_function(logging.INFO, root_logger.info)
+    warning = _make_level_function(logging.WARNING, root_logger.warning)
+    critical = _make_level_function(logging.CRITICAL, root_logger.critical)
+    error = _make_level_function(logging.ERROR, root_logger.error)
+
+
 root_logger = getLogger()
 
 if __enable_logging__:
     setup_logging()
 
-debug = root_logger.debug
-info = root_logger.info
-warning = root_logger.warning
-critical = root_logger.critical
-error = root_logger.error
+_update_levels()
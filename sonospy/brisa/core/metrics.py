@@ -0,0 +1,207 @@
+# Licensed under the MIT license
+# http://opensource.org/licenses/mit-license.php or see LICENSE file.
+# Copyright 2007-2008 Brisa Team <brisa-develop@garage.maemo.org>
+
+""" Process wide latency histograms, counters and gauges.
+
+Values are keyed on a metric name and a set of labels, e.g.
+
+    start = time()
+    ...
+    metrics.observe('upnp_action_seconds', time() - start, action='Browse')
+    metrics.add('bytes_served', len(body), kind='art')
+
+and exported by render() in the Prometheus text format, which is what
+webserver.MetricsResource serves.
+"""
+
+__all__ = ('observe', 'add', 'add_gauge', 'get_histogram', 'get_counter',
+           'reset', 'render')
+
+import threading
+
+from bisect import bisect_left
+
+from brisa.core.threaded_call import get_metrics as get_queue_metrics
+
+
+# Upper bounds of the histogram buckets, in seconds
+buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+           2.5, 5.0, 10.0)
+
+
+class Histogram(object):
+    """ Latency histogram with fixed buckets.
+    """
+
+    def __init__(self):
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+
+_histograms = {}
+_counters = {}
+_gauges = {}
+_lock = threading.Lock()
+
+
+def _key(name, labels):
+    if labels:
+        return (name, tuple(sorted(labels.iteritems())))
+    return (name, ())
+
+
+def observe(name, value, **labels):
+    """ Records a value (usually seconds) in the histogram for name and
+    labels.
+
+    @param name: metric name
+    @param value: value to record
+
+    @type name: string
+    @type value: float
+    """
+    key = _key(name, labels)
+    _lock.acquire()
+    try:
+        h = _histograms.get(key, None)
+        if h is None:
+            h = _histograms[key] = Histogram()
+        h.observe(value)
+    finally:
+        _lock.release()
+
+
+def add(name, amount=1, **labels):
+    """ Adds amount to the counter for name and labels.
+
+    @param name: metric name
+    @param amount: amount to add
+
+    @type name: string
+    @type amount: integer
+    """
+    key = _key(name, labels)
+    _lock.acquire()
+    try:
+        _counters[key] = _counters.get(key, 0) + amount
+    finally:
+        _lock.release()
+
+
+def add_gauge(name, function, **labels):
+    """ Registers a gauge, exported with the value returned by function at
+    render time. Registering the same name and labels again replaces it.
+
+    @param name: metric name
+    @param function: callable returning a number
+
+    @type name: string
+    @type function: callable
+    """
+    _gauges[_key(name, labels)] = function
+
+
+def get_histogram(name, **labels):
+    """ Returns the histogram for name and labels, or None.
+
+    @rtype: Histogram
+    """
+    return _histograms.get(_key(name, labels), None)
+
+
+def get_counter(name, **labels):
+    """ Returns the counter for name and labels, 0 if never added to.
+
+    @rtype: integer
+    """
+    return _counters.get(_key(name, labels), 0)
+
+
+def reset():
+    """ Clears the histograms and counters. Gauges are kept.
+    """
+    _lock.acquire()
+    try:
+        _histograms.clear()
+        _counters.clear()
+    finally:
+        _lock.release()
+
+
+def _format_labels(labels, extra=()):
+    labels = list(labels) + list(extra)
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(['%s="%s"' % (k, str(v).replace('\\', '\\\\').
+                                           replace('"', '\\"'))
+                              for k, v in labels])
+
+
+def render():
+    """ Returns all metrics in the Prometheus text format.
+
+    @rtype: string
+    """
+    _lock.acquire()
+    try:
+        histograms = [(key, list(h.counts), h.count, h.sum, h.max)
+                      for key, h in _histograms.iteritems()]
+        counters = _counters.items()
+    finally:
+        _lock.release()
+
+    lines = []
+    typed = set()
+    for (name, labels), counts, count, total, maximum in sorted(histograms):
+        if name not in typed:
+            lines.append('# TYPE %s histogram' % name)
+            typed.add(name)
+        cumulative = 0
+        for bound, n in zip(buckets, counts):
+            cumulative += n
+            lines.append('%s_bucket%s %d' % (name,
+                         _format_labels(labels, [('le', bound)]), cumulative))
+        lines.append('%s_bucket%s %d' % (name,
+                     _format_labels(labels, [('le', '+Inf')]), count))
+        lines.append('%s_sum%s %f' % (name, _format_labels(labels), total))
+        lines.append('%s_count%s %d' % (name, _format_labels(labels), count))
+        lines.append('%s_max%s %f' % (name, _format_labels(labels), maximum))
+
+    for (name, labels), value in sorted(counters):
+        if name not in typed:
+            lines.append('# TYPE %s counter' % name)
+            typed.add(name)
+        lines.append('%s%s %s' % (name, _format_labels(labels), value))
+
+    gauges = []
+    for (name, labels), function in _gauges.items():
+        try:
+            gauges.append(((name, labels), function()))
+        except Exception:
+            pass
+    for queue, values in get_queue_metrics().iteritems():
+        if not isinstance(values, dict):
+            # delayed calls and thread count
+            name = {'delayed': 'delayed_calls'}.get(queue, queue)
+            gauges.append(((name, ()), values))
+            continue
+        for k, v in values.iteritems():
+            gauges.append((('call_queue_%s' % k, (('queue', queue), )), v))
+    for (name, labels), value in sorted(gauges):
+        if name not in typed:
+            lines.append('# TYPE %s gauge' % name)
+            typed.add(name)
+        lines.append('%s%s %s' % (name, _format_labels(labels), value))
+
+    lines.append('')
+    return '\n'.join(lines)
@@ -253,16 +253,16 @@ def parse_http_response(data):
     @return: (cmd, headers) for the given data
     @rtype: tuple
     """
-    
-#    print "data: " + str(data)
-    
-    header, payload = data.split('\r\n\r\n')
-    lines = header.split('\r\n')
+    end = data.find('\r\n\r\n')
+    if end < 0:
+        raise ValueError('HTTP header terminator not found')
+    lines = data[:end].split('\r\n')
     cmd = lines[0].split(' ')
-    lines = map(lambda x: x.replace(': ', ':', 1), lines[1:])
-    lines = filter(lambda x: len(x) > 0, lines)
-    headers = [x.split(':', 1) for x in lines]
-    headers = dict(map(lambda x: (x[0].lower(), x[1]), headers))
+    headers = {}
+    for line in lines[1:]:
+        name, sep, value = line.partition(':')
+        if sep:
+            headers[name.lower()] = value.strip()
 
     return cmd, headers
 
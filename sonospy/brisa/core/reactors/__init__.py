@@ -5,10 +5,16 @@
 """ Bult-in reactors.
 """
 
+import sys
+import select
+
 #from brisa.core.reactors.gtk2 import *
 #from brisa.core.reactors.glib2 import *
 #from brisa.core.reactors._ecore import *
 from brisa.core.reactors._select import *
+from brisa.core.reactors._epoll import *
 
 def install_default_reactor():
+    if sys.platform.startswith('linux') and hasattr(select, 'epoll'):
+        return EpollReactor()
     return SelectReactor()
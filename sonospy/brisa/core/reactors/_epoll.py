@@ -0,0 +1,428 @@
+# Licensed under the MIT license
+# http://opensource.org/licenses/mit-license.php or see LICENSE file.
+# Copyright 2007-2008 Brisa Team <brisa-develop@garage.maemo.org>
+
+""" epoll-based reactor with a heap-scheduled timer queue. Linux only.
+"""
+
+__all__ = ('EpollReactor', )
+
+import os
+import time
+import heapq
+import select
+import signal
+import itertools
+import threading
+
+from errno import EINTR
+
+from brisa.core import log
+from brisa.core.ireactor import *
+
+
+class Timer(object):
+    """ Timer class.
+    """
+
+    def __init__(self, callback, interval, threshold):
+        """ Constructor for the Timer class
+
+        @param callback: function to be called
+        @param interval: seconds to sleep between calls
+        @param threshold: lower acceptable bound for the call precision
+        """
+        self.callback = callback
+        self.interval = interval
+        self.threshold = threshold
+
+    def __call__(self):
+        """ Performs the callback.
+        """
+        self.callback()
+
+    def __str__(self):
+        """ String representation of the class.
+        """
+        return '<Timer callback=%s, interval=%s, threshold=%s>' % \
+               (str(self.callback), str(self.interval), str(self.threshold))
+
+
+class EpollReactor(ReactorInterface):
+    """ Reactor using select.epoll for fd events. Timers are kept on a heap
+    ordered by their next deadline, so each loop iteration only looks at the
+    timers that are due.
+    """
+
+    state = REACTOR_STATE_STOPPED
+
+    def __init__(self, *args, **kwargs):
+        ReactorInterface.__init__(self, *args, **kwargs)
+        self._epoll = select.epoll()
+        # fileno -> [fd, read callback, write callback, exception callback]
+        self._fds = {}
+        self._timers = {}
+        self._timer_heap = []
+        self._timer_ids = itertools.count(1)
+        self._timer_lock = threading.Lock()
+        self._stop_funcs = []
+        self._start_funcs = []
+        self._loop_thread = None
+
+        # Wakes the loop when a timer is added from another thread or when
+        # main_quit() is called
+        self._wake_r, self._wake_w = os.pipe()
+        self._epoll.register(self._wake_r, select.EPOLLIN)
+
+        signal.signal(signal.SIGTERM, self._main_sig_quit)
+        signal.signal(signal.SIGINT, self._main_sig_quit)
+
+    def add_timer(self, interval, callback, threshold=0.01):
+        """ Adds a timer.
+
+        @param interval: interval to sleep between calls
+        @param callback: function to be called
+        @param threshold: lower bound for the time precision
+
+        @type interval: integer
+        @type callback: callable
+        @type threshold: float
+
+        @return: unique ID for the callback
+        @rtype: integer
+        """
+        self._timer_lock.acquire()
+        try:
+            id = self._timer_ids.next()
+            timer = Timer(callback, interval, threshold)
+            self._timers[id] = timer
+            heapq.heappush(self._timer_heap,
+                           (time.time() + interval, id, timer))
+        finally:
+            self._timer_lock.release()
+
+        if self._loop_thread is not threading.currentThread():
+            self._wake()
+        return id
+
+    def rem_timer(self, id):
+        """ Removes a timed callback given its id.
+
+        @param id: unique ID returned by add_timer()
+        @type id: integer
+        """
+        if not id: return
+        self._timer_lock.acquire()
+        try:
+            # The heap entry is discarded when it reaches the top
+            self._timers.pop(id)
+        except KeyError:
+            raise KeyError('No such timeout callback registered with id %d' %
+                           id)
+        finally:
+            self._timer_lock.release()
+
+    def add_fd(self, fd, evt_callback, evt_type, data=None):
+        """ Adds a fd for watch.
+
+        @param fd: file descriptor
+        @param evt_callback: callback to be called
+        @param evt_type: event type to be watched on this fd. An OR combination
+                         of EVENT_TYPE_* flags.
+        @param data: data to be forwarded to the callback
+
+        @type fd: file
+        @type evt_callback: callable
+        @type evt_type: integer
+        @type data: any
+        """
+        fileno = self._fileno(fd)
+        entry = self._fds.get(fileno, None)
+        registered = entry is not None
+        if not registered:
+            entry = self._fds[fileno] = [fd, None, None, None]
+
+        if evt_type & EVENT_TYPE_READ:
+            log.debug('Added fd %s watch for READ events', fd)
+            entry[1] = evt_callback
+        if evt_type & EVENT_TYPE_WRITE:
+            log.debug('Added fd %s watch for WRITE events', fd)
+            entry[2] = evt_callback
+        if evt_type & EVENT_TYPE_EXCEPTION:
+            log.debug('Added fd %s watch for EXCEPTION events', fd)
+            entry[3] = evt_callback
+
+        if registered:
+            self._epoll.modify(fileno, self._event_mask(entry))
+        else:
+            self._epoll.register(fileno, self._event_mask(entry))
+
+        return fd
+
+    def rem_fd(self, fd):
+        """ Removes a fd from being watched.
+
+        @param fd: file descriptor to be removed
+
+        @type fd: file
+        """
+        try:
+            fileno = self._fileno(fd)
+        except (ValueError, IOError, OSError):
+            # Already closed, look it up by object
+            fileno = None
+            for k, entry in self._fds.items():
+                if entry[0] is fd:
+                    fileno = k
+                    break
+        self._unregister(fileno)
+
+    def add_after_stop_func(self, func):
+        """ Registers a function to be called before entering the STOPPED
+        state.
+
+        @param func: function
+        @type func: callable
+        """
+        if func not in self._stop_funcs:
+            self._stop_funcs.append(func)
+
+    def rem_after_stop_func(self, func):
+        """ Removes a registered function.
+
+        @param func: function
+        @type func: callable
+        """
+        if func in self._stop_funcs:
+            self._stop_funcs.remove(func)
+
+    def add_before_start_func(self, func):
+        """ Registers a function to be called before entering the RUNNING
+        state.
+
+        @param func: function
+        @type func: callable
+        """
+        if func not in self._start_funcs:
+            self._start_funcs.append(func)
+
+    def rem_before_start_func(self, func):
+        """ Removes a registered function.
+
+        @param func: function
+        @type func: callable
+        """
+        if func in self._start_funcs:
+            self._start_funcs.remove(func)
+
+    def main(self):
+        """ Enters the RUNNING state by running the main loop until
+        main_quit() is called.
+        """
+        if self.state != REACTOR_STATE_STOPPED:
+            raise ReactorAlreadyRunningException('main() called twice or '\
+                'together with main_loop_iterate()')
+
+        self.state = REACTOR_STATE_RUNNING
+        self._loop_thread = threading.currentThread()
+        log.info('Preparing main loop')
+        self._main_call_before_start_funcs()
+        log.info('Entering main loop')
+        while self.state == REACTOR_STATE_RUNNING:
+            try:
+                if not self.main_loop_iterate():
+                    break
+            except:
+                break
+        log.info('Preparing to exit main loop')
+        self._main_call_before_stop_funcs()
+        log.info('Exited main loop')
+
+    def main_quit(self):
+        """ Terminates the main loop.
+        """
+        self.state = REACTOR_STATE_STOPPED
+        self._wake()
+        log.debug('Waking main loop for exit')
+
+    def main_loop_iterate(self):
+        """ Runs a single iteration of the main loop. Reactor enters the
+        RUNNING state while this method executes.
+        """
+        if not self._main_poll():
+            self._main_trigger_timers()
+            return False
+        if not self._main_trigger_timers():
+            return False
+        return True
+
+    def is_running(self):
+        return bool(self.state)
+
+    def _fileno(self, fd):
+        if isinstance(fd, (int, long)):
+            return fd
+        return fd.fileno()
+
+    def _event_mask(self, entry):
+        mask = 0
+        if entry[1]:
+            mask |= select.EPOLLIN
+        if entry[2]:
+            mask |= select.EPOLLOUT
+        if entry[3]:
+            mask |= select.EPOLLPRI
+        return mask
+
+    def _unregister(self, fileno):
+        if fileno is None or self._fds.pop(fileno, None) is None:
+            return
+        try:
+            self._epoll.unregister(fileno)
+        except (IOError, OSError, ValueError):
+            pass
+
+    def _remove_callback(self, fileno, index):
+        """ Removes one of the callbacks of a fd, unregistering the fd when
+        none is left.
+        """
+        entry = self._fds.get(fileno, None)
+        if entry is None:
+            return
+        entry[index] = None
+        if not (entry[1] or entry[2] or entry[3]):
+            self._unregister(fileno)
+            return
+        try:
+            self._epoll.modify(fileno, self._event_mask(entry))
+        except (IOError, OSError, ValueError):
+            self._unregister(fileno)
+
+    def _wake(self):
+        try:
+            os.write(self._wake_w, 'x')
+        except OSError:
+            pass
+
+    def _get_timeout(self):
+        """ Returns the time in seconds until the next timer is due, or -1
+        if there are no timers.
+        """
+        self._timer_lock.acquire()
+        try:
+            while self._timer_heap and \
+                  self._timer_heap[0][1] not in self._timers:
+                heapq.heappop(self._timer_heap)
+            if not self._timer_heap:
+                return -1
+            deadline, id, timer = self._timer_heap[0]
+        finally:
+            self._timer_lock.release()
+        return max(0, deadline - timer.threshold - time.time())
+
+    def _main_poll(self):
+        """ Polls and process events.
+
+        @return: False if the loop should exit, otherwise True
+        @rtype: boolean
+        """
+        try:
+            events = self._epoll.poll(self._get_timeout())
+        except (IOError, OSError, select.error), e:
+            if e.args[0] == EINTR:
+                return True
+            raise
+        except KeyboardInterrupt:
+            return False
+
+        for fileno, mask in events:
+            if fileno == self._wake_r:
+                try:
+                    os.read(self._wake_r, 4096)
+                except OSError:
+                    pass
+                if self.state != REACTOR_STATE_RUNNING:
+                    log.debug('Wake pipe read, exiting')
+                    return False
+                continue
+            self._main_process_event(fileno, mask)
+        return True
+
+    def _main_process_event(self, fileno, mask):
+        entry = self._fds.get(fileno, None)
+        if entry is None:
+            return
+
+        handlers = []
+        if mask & (select.EPOLLIN | select.EPOLLHUP | select.EPOLLERR):
+            handlers.append((1, EVENT_TYPE_READ))
+        if mask & select.EPOLLOUT:
+            handlers.append((2, EVENT_TYPE_WRITE))
+        if mask & (select.EPOLLPRI | select.EPOLLERR):
+            handlers.append((3, EVENT_TYPE_EXCEPTION))
+
+        for index, evt_type in handlers:
+            callback = entry[index]
+            if not callback:
+                continue
+            try:
+                log.debug('Event %d on %s, calling %s', evt_type, entry[0],
+                          callback)
+                if not callback(entry[0], evt_type):
+                    # Returned False, remove it
+                    self._remove_callback(fileno, index)
+            except Exception, e:
+                log.debug('Exception %s raised when handling event %d'\
+                          ' on file %s', e, evt_type, entry[0])
+
+    def _main_trigger_timers(self):
+        """ Triggers the timers that are ready.
+        """
+        now = time.time()
+        due = []
+        self._timer_lock.acquire()
+        try:
+            while self._timer_heap:
+                deadline, id, timer = self._timer_heap[0]
+                if self._timers.get(id, None) is not timer:
+                    # Removed
+                    heapq.heappop(self._timer_heap)
+                    continue
+                if deadline - timer.threshold >= now:
+                    break
+                heapq.heappop(self._timer_heap)
+                due.append((id, timer))
+        finally:
+            self._timer_lock.release()
+
+        for id, timer in due:
+            log.debug('Callback ready: %s', timer)
+            if self.is_running():
+                try:
+                    timer()
+                except KeyboardInterrupt, k:
+                    # Ctrl-C would be ignored
+                    return False
+                except:
+                    log.error('Error while processing timer %s' % str(timer))
+
+            # Reschedule anyways, unless removed meanwhile
+            self._timer_lock.acquire()
+            try:
+                if self._timers.get(id, None) is timer:
+                    heapq.heappush(self._timer_heap,
+                                   (time.time() + timer.interval, id, timer))
+            finally:
+                self._timer_lock.release()
+        return True
+
+    def _main_call_before_stop_funcs(self):
+        for cb in self._stop_funcs:
+            cb()
+
+    def _main_call_before_start_funcs(self):
+        for cb in self._start_funcs:
+            cb()
+
+    def _main_sig_quit(self, sig, frame):
+        self.main_quit()
@@ -8,15 +8,233 @@ callbacks.
 
 import sys, traceback
 
+import heapq
 import thread
 import threading
+import Queue
 
+from time import time
 
-from brisa.core import log
+from brisa.core import log, config
 from brisa.utils.safe_sleep import safe_sleep
 
 
-def run_async_function(f, param_tuple=(), delay=0):
+# Default number of workers for the named queues. Other queue names get
+# default_workers. Can be overridden with the brisa section parameter
+# threads_<queue name> (e.g. threads_events = 2).
+default_workers = 8
+queue_workers = {'default': 8,
+                 'events': 4,
+                 'browse': 4,
+                 'device-build': 4,
+                 'art': 1}
+
+
+class ThreadPool(object):
+    """ Bounded pool of worker threads serving a queue of calls. Workers are
+    created on demand, up to the configured maximum, and then reused.
+    """
+
+    def __init__(self, name, workers):
+        """ Constructor for the ThreadPool class.
+
+        @param name: pool (queue) name
+        @param workers: maximum number of worker threads
+
+        @type name: string
+        @type workers: integer
+        """
+        self.name = name
+        self.workers = workers
+        self._queue = Queue.Queue()
+        self._lock = threading.Lock()
+        self._threads = 0
+        self._idle = 0
+        self._completed = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._run_total = 0.0
+
+    def submit(self, f, param_tuple=(), kwargs={}):
+        """ Queues a call to f(*param_tuple, **kwargs).
+        """
+        self._lock.acquire()
+        try:
+            self._queue.put((time(), f, param_tuple, kwargs))
+            if self._idle < self._queue.qsize() and \
+               self._threads < self.workers:
+                self._threads += 1
+                self._idle += 1
+                t = threading.Thread(target=self._worker,
+                                     name='%s-%d' % (self.name, self._threads))
+                t.setDaemon(True)
+                t.start()
+        finally:
+            self._lock.release()
+
+    def get_metrics(self):
+        """ Returns the pool metrics: queue length, thread count, busy
+        threads, completed tasks and queue latency/run time in seconds.
+
+        @rtype: dict
+        """
+        self._lock.acquire()
+        try:
+            completed = self._completed
+            return {'queue_length': self._queue.qsize(),
+                    'threads': self._threads,
+                    'busy': self._threads - self._idle,
+                    'max_threads': self.workers,
+                    'completed': completed,
+                    'latency_avg': completed and self._wait_total / completed,
+                    'latency_max': self._wait_max,
+                    'run_time_avg': completed and self._run_total / completed}
+        finally:
+            self._lock.release()
+
+    def _worker(self):
+        while True:
+            queued, f, param_tuple, kwargs = self._queue.get()
+            started = time()
+            self._lock.acquire()
+            self._idle -= 1
+            self._lock.release()
+
+            try:
+                f(*param_tuple, **kwargs)
+            except Exception, e:
+                log.error('Error in %s queue call %s: %s', self.name, f, e)
+                log.debug('%s', traceback.format_exc())
+
+            finished = time()
+            self._lock.acquire()
+            self._idle += 1
+            self._completed += 1
+            self._wait_total += started - queued
+            self._wait_max = max(self._wait_max, started - queued)
+            self._run_total += finished - started
+            self._lock.release()
+
+
+class DelayedScheduler(object):
+    """ Single timer thread that hands delayed calls to their queue when
+    they are due.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._count = 0
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def schedule(self, delay, queue, f, param_tuple=(), kwargs={}):
+        """ Queues f(*param_tuple, **kwargs) on the named queue after delay
+        seconds.
+        """
+        self._condition.acquire()
+        try:
+            self._count += 1
+            heapq.heappush(self._heap, (time() + delay, self._count, queue,
+                                        f, param_tuple, kwargs))
+            if not self._thread:
+                self._thread = threading.Thread(target=self._run,
+                                                name='delayed-scheduler')
+                self._thread.setDaemon(True)
+                self._thread.start()
+            self._condition.notify()
+        finally:
+            self._condition.release()
+
+    def pending(self):
+        """ Returns the number of calls waiting for their delay.
+        """
+        return len(self._heap)
+
+    def _run(self):
+        while True:
+            self._condition.acquire()
+            try:
+                while not self._heap or self._heap[0][0] > time():
+                    if self._heap:
+                        self._condition.wait(self._heap[0][0] - time())
+                    else:
+                        self._condition.wait()
+                due, count, queue, f, param_tuple, kwargs = \
+                    heapq.heappop(self._heap)
+            finally:
+                self._condition.release()
+            get_pool(queue).submit(f, param_tuple, kwargs)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+_scheduler = DelayedScheduler()
+
+
+def get_pool(name='default'):
+    """ Returns the ThreadPool serving the named queue, creating it on the
+    first call.
+
+    @param name: queue name
+    @type name: string
+
+    @rtype: ThreadPool
+    """
+    pool = _pools.get(name, None)
+    if pool:
+        return pool
+
+    _pools_lock.acquire()
+    try:
+        if name not in _pools:
+            workers = queue_workers.get(name, default_workers)
+            try:
+                workers = int(config.get_parameter('brisa', 'threads_%s' % name))
+            except:
+                pass
+            _pools[name] = ThreadPool(name, max(1, workers))
+        return _pools[name]
+    finally:
+        _pools_lock.release()
+
+
+def set_pool_size(name, workers):
+    """ Sets the maximum number of workers of a queue. Extra workers of a
+    running pool are not stopped.
+
+    @param name: queue name
+    @param workers: maximum number of worker threads
+
+    @type name: string
+    @type workers: integer
+    """
+    queue_workers[name] = workers
+    get_pool(name).workers = max(1, workers)
+
+
+def get_metrics():
+    """ Returns the metrics of every queue keyed by queue name, plus the
+    number of delayed calls ('delayed') and the process thread count
+    ('threads').
+
+    @rtype: dict
+    """
+    metrics = {}
+    for name, pool in _pools.items():
+        metrics[name] = pool.get_metrics()
+    metrics['delayed'] = _scheduler.pending()
+    metrics['threads'] = threading.activeCount()
+    return metrics
+
+
+def _dispatch(f, param_tuple=(), kwargs={}, delay=0, queue='default'):
+    if delay > 0:
+        _scheduler.schedule(delay, queue, f, param_tuple, kwargs)
+    else:
+        get_pool(queue).submit(f, param_tuple, kwargs)
+
+
+def run_async_function(f, param_tuple=(), delay=0, queue='default'):
     """ Calls a function passing a parameters tuple. Note that this
     function returns nothing. If you want an asynchronous call with a
     monitor object, see brisa.core.threaded_call.run_async_call and
@@ -25,20 +243,19 @@ def run_async_function(f, param_tuple=(), delay=0):
     @param f: function to be called
     @param param_tuple: tuple param for the function
     @param delay: wait time before calling the function
+    @param queue: name of the queue that runs the call. If None, the call
+                  runs on its own thread (use for calls that never return)
     """
-
-#    print "########### run_async_function f: " + str(f) + "  active count: " + str(threading.active_count())
-#    print "########### run_async_function param_tuple: " + str(param_tuple)
-#    print "########### run_async_function delay: " + str(delay)
-#    print "########### run_async_function threads: " + str(threading.enumerate())
-
-    if delay > 0:
-        # If delay is valid, schedule a timer for that call
-        t = threading.Timer(delay, f, args=list(param_tuple))
-        t.start()
+    if queue is None:
+        if delay > 0:
+            # If delay is valid, schedule a timer for that call
+            t = threading.Timer(delay, f, args=list(param_tuple))
+            t.start()
+        else:
+            # Instant call
+            thread.start_new_thread(f, param_tuple)
     else:
-        # Instant call
-        thread.start_new_thread(f, param_tuple)
+        _dispatch(f, param_tuple, delay=delay, queue=queue)
 
 def run_async_call(function, success_callback=None, error_callback=None,
                    success_callback_cargo=None, error_callback_cargo=None,
@@ -52,7 +269,9 @@ def run_async_call(function, success_callback=None, error_callback=None,
     @param error_callback_cargo: error callback additional parameters
     @param delay: time to be wait before performing the call
     @param args: arguments to the function
-    @param kwargs: arguments to the function
+    @param kwargs: arguments to the function. The keyword async_queue, if
+                   present, is not forwarded and names the queue that runs
+                   the call
 
     @type function: callable
     @type success_callback: callable
@@ -62,16 +281,6 @@ def run_async_call(function, success_callback=None, error_callback=None,
     @return: object for monitoring the call
     @rtype: ThreadedCall
     """
-#    print function.__name__
-#    if function.__name__ == 'url_fetch':
-#        import traceback        
-#        traceback.print_stack()
-        
-    
-#    print "########### run_async_call function: " + str(function) + "  active count: " + str(threading.active_count())
-#    print "########### run_async_call delay: " + str(delay)
-#    print "########### run_async_call threads: " + str(threading.enumerate())
-
     tcall = ThreadedCall(function, success_callback, error_callback,
                                  success_callback_cargo, error_callback_cargo,
                                  delay, *args, **kwargs)
@@ -85,7 +294,9 @@ class ThreadedCall(threading.Thread):
     to specified callbacks.
 
     One can instantiate this class directly or use the run_async_call function
-    located at package brisa.core.threaded_call.
+    located at package brisa.core.threaded_call. Calling start() queues the
+    call on a shared ThreadPool (after the delay, if any) instead of starting
+    a new thread.
 
     @param function: function to be called passing *args and **kwargs
     @param success_callback: called in case of success, receives call result
@@ -114,6 +325,7 @@ class ThreadedCall(threading.Thread):
         log.debug('++ %s ++ kwargs: %s' % (self.instance, str(kwargs)))
         threading.Thread.__init__(self)
         self.setDaemon(True)
+        self.queue = kwargs.pop('async_queue', 'default')
         self.function = function
         self.args = args
         self.kwargs = kwargs
@@ -139,6 +351,11 @@ class ThreadedCall(threading.Thread):
     def is_cancelled(self):
         return self.cancelled
 
+    def start(self):
+        """ Queues the call.
+        """
+        _dispatch(self._call, delay=self.delay or 0, queue=self.queue)
+
     def run(self):
         """ Implementation of the call procedure.
         """
@@ -146,7 +363,9 @@ class ThreadedCall(threading.Thread):
             # This runs in a thread. We can sleep here instead using time
             safe_sleep(self.delay)
             log.debug('sleeping for %d' % self.delay)
+        self._call()
 
+    def _call(self):
         if self.is_cancelled():
             self.cleanup()
             return
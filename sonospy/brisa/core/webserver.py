@@ -13,11 +13,13 @@ can be passed to the WebServer, e.g. WebServer(adapter=some_adapter) where
 some_adapter was retrieved with get_available_adapters().
 """
 
-__all__ = ('Resource', 'CustomResource', 'WebServer', 'StaticFile', 'adapters',
+__all__ = ('Resource', 'CustomResource', 'MetricsResource', 'WebServer',
+           'StaticFile', 'adapters',
            'get_available_adapters', 'AdapterInterface', 'CherrypyAdapter',
            'PasteAdapter', 'CircuitsWebAdapter')
 
 import transcode
+import scaledart
 
 import os
 import random
@@ -36,8 +38,10 @@ import StringIO
 import gzip
 import cStringIO
 
+from time import time
+
 from brisa import __enable_webserver_logging__, __enable_offline_mode__
-from brisa.core import log, config, threaded_call
+from brisa.core import log, config, threaded_call, metrics
 from brisa.core.network import parse_url, get_active_ifaces, get_ip_address
 
 
@@ -225,7 +229,7 @@ class Response(object):
             raise ValueError('Status code not set for a HTTP response.')
         status_msg = '%d %s' % (self.status, http_codes[self.status])
 
-        log.debug("_respond headers: \n%s", str(self.headers))
+        log.debug("_respond headers: \n%s", self.headers)
 
         if not 'Content-type' in self.headers:
             self.headers['Content-type'] = 'text/html; charset="utf-8"'
@@ -248,14 +252,14 @@ def get_byte_ranges(r, clen):
     @param clen: content length
     """
     # Byte unit supported by us (HTTP1.1) is "bytes". Get the ranges string.
-    log.debug('Range: %s, %d' % (r, clen))
+    log.debug('Range: %s, %d', r, clen)
 
     if not r:
         return None
 
     bunit, branges = r.split('=', 1)
 
-    log.debug('Bunit, branges: %s %s' % (bunit, branges))
+    log.debug('Bunit, branges: %s %s', bunit, branges)
 
     if bunit != 'bytes':
         # Ignore any other kind of units
@@ -267,7 +271,7 @@ def get_byte_ranges(r, clen):
 
     for br in branges.split(','):
         start, stop = [b.strip() for b in br.split('-', 1)]
-        log.debug('%s %s' % (start, stop))
+        log.debug('%s %s', start, stop)
 
         if not start:
             # If the first number is missing, should return the last n bytes
@@ -277,7 +281,7 @@ def get_byte_ranges(r, clen):
                 return None
             # Last n bytes
             ranges.append((clen - int(stop), clen))
-            log.debug('Ranges: %s' % ranges)
+            log.debug('Ranges: %s', ranges)
         else:
             # Start is present
             if not stop:
@@ -290,10 +294,10 @@ def get_byte_ranges(r, clen):
             if int(stop) < int(start):
                 return None
             ranges.append((int(start), int(stop) + 1))
-            log.debug('Ranges: %s' % ranges)
+            log.debug('Ranges: %s', ranges)
 
 
-    log.debug('Ranges: %s' % ranges)
+    log.debug('Ranges: %s', ranges)
     return ranges
 
 
@@ -380,7 +384,7 @@ class StaticFile(object):
         @note: path supplied must exist and point to a file
         """
 
-        log.info('name: %s   path: %s' % (name, path))
+        log.info('name: %s   path: %s', name, path)
         
         if not os.path.exists(path):
             warnings.warn(invalid_path_exists)
@@ -398,7 +402,7 @@ class StaticFile(object):
         if not self._content_type:
             self._guess_content_type()
 
-        log.debug('name: %s   path: %s   _content_type: %s   _disposition: %s' % (name, path, self._content_type, self._disposition))
+        log.debug('name: %s   path: %s   _content_type: %s   _disposition: %s', name, path, self._content_type, self._disposition)
 
 
     def _guess_content_type(self):
@@ -409,7 +413,7 @@ class StaticFile(object):
         self._content_type = mimetypes.types_map.get('.%s' %
                                                      self.path.split('.')[-1],
                                                      'text/plain')
-        log.debug('File %s type %s' % (self.path, self._content_type))
+        log.debug('File %s type %s', self.path, self._content_type)
 
     def application(self, environ, start_response, response=None):
         """ Application wsgi callback that processes a request. Must not be
@@ -421,8 +425,8 @@ class StaticFile(object):
                          start_response must be passed accordingly.
         """
 
-        log.debug('StaticFile application environ %s' % environ)
-        log.debug('StaticFile application response %s' % response)
+        log.debug('StaticFile application environ %s', environ)
+        log.debug('StaticFile application response %s', response)
 
 #        if 'REQUEST_METHOD' in environ:
 #            if environ['REQUEST_METHOD'] == 'GET':
@@ -495,7 +499,7 @@ class StaticFile(object):
             # Lower protocols do not support ranges, whole body
             h['Content-length'] = str(content_length)
 
-        log.debug("headers: %s", str(h))
+        log.debug("headers: %s", h)
 
         if not response:
             # Normal request, not redirected. When redirected, who respond()s is
@@ -537,11 +541,11 @@ class StaticFileSonos(object):
         self._disposition = disposition
 
         if not self._content_type:
-            log.debug('_content_type before: %s' % self._content_type)
+            log.debug('_content_type before: %s', self._content_type)
             self._guess_content_type()
-            log.debug('_content_type after : %s' % self._content_type)
+            log.debug('_content_type after : %s', self._content_type)
 
-        log.debug('dummyname: %s   name: %s   path: %s   _content_type: %s   _disposition: %s' % (dummyname, name, path, self._content_type, self._disposition))
+        log.debug('dummyname: %s   name: %s   path: %s   _content_type: %s   _disposition: %s', dummyname, name, path, self._content_type, self._disposition)
 
 
     def _guess_content_type(self, path=None):
@@ -554,7 +558,7 @@ class StaticFileSonos(object):
         self._content_type = mimetypes.types_map.get('.%s' %
                                                      path.split('.')[-1],
                                                      'text/plain')
-        log.debug('File %s type %s' % (path, self._content_type))
+        log.debug('File %s type %s', path, self._content_type)
 
 
     def application(self, environ, start_response, response=None):
@@ -570,9 +574,9 @@ class StaticFileSonos(object):
 #        import traceback        
 #        traceback.print_stack()
 
-        log.debug('StaticFileSonos application environ %s' % environ)
-        log.debug('StaticFileSonos application start_response %s' % start_response)
-        log.debug('StaticFileSonos application response %s' % response)
+        log.debug('StaticFileSonos application environ %s', environ)
+        log.debug('StaticFileSonos application start_response %s', start_response)
+        log.debug('StaticFileSonos application response %s', response)
 
         req = Request(environ)
 
@@ -586,30 +590,33 @@ class StaticFileSonos(object):
         path = self.path
         albumart = False
         coveroffsets = None
+        content_type = self._content_type
+        artsize = scaledart.get_size(req.params)
 
         log.debug('=========================================')
-        log.debug('qs: %s' % environ['QUERY_STRING'])
-        log.debug('dn: %s' % self.dummyname)
-        log.debug('name: %s' % self.name)
-        log.debug('path: %s' % self.path)
-        log.debug('cover: %s' % self.cover)
-        log.debug('_content_type: %s' % self._content_type)
+        log.debug('qs: %s', environ['QUERY_STRING'])
+        log.debug('dn: %s', self.dummyname)
+        log.debug('name: %s', self.name)
+        log.debug('path: %s', self.path)
+        log.debug('cover: %s', self.cover)
+        log.debug('_content_type: %s', self._content_type)
         log.debug('=========================================')
 
         # Sonos queries for the album art either via a query string, or directly to the art specified
         # if the art is embedded then we need to extract it (it can be in multiple pieces)
-        if environ['QUERY_STRING'] == 'albumArt=true' or self.dummyname.endswith('.coverart'):
+        if req.params.get('albumArt', None) == 'true' or self.dummyname.endswith('.coverart'):
             if self.cover.startswith('EMBEDDED_'):
                 # art is embedded for this file
                 coverparts = self.cover.split('_')
                 coveroffsets = coverparts[1].split(',')
-                log.debug('coveroffsets: %s' % coveroffsets)
+                log.debug('coveroffsets: %s', coveroffsets)
             else:
                 path = self.cover
                 if not path or path == '':
                     return simple_response(404, r.start_response)
                 albumart = True
                 self._guess_content_type(path)
+                content_type = self._content_type
 
         if not os.path.exists(path):
             log.warning('Received request on missing file: %s' % path)
@@ -656,9 +663,25 @@ class StaticFileSonos(object):
             content_length = st.st_size
             r.body = fileoffset
 
+        if artsize and (albumart or coveroffsets) and scaledart.is_available():
+            # serve the scaled variant if it has been generated, otherwise
+            # serve the original and have the variant generated
+            key = (path, self.cover, st.st_mtime, artsize)
+            scaled = scaledart.cache.get(key)
+            if scaled != None:
+                if not coveroffsets:
+                    fileoffset.close()
+                r.body = scaled
+                content_length = len(scaled)
+                content_type = 'image/jpeg'
+            elif coveroffsets:
+                scaledart.cache.generate(key, artsize, data=image)
+            else:
+                scaledart.cache.generate(key, artsize, path=path)
+
         h = r.headers
         h['Last-modified'] = rfc822.formatdate(st.st_mtime)
-        h['Content-type'] = self._content_type
+        h['Content-type'] = content_type
 
         if self._disposition:
             h['Content-disposition'] = '%s; filename="%s"' % \
@@ -698,7 +721,7 @@ class StaticFileSonos(object):
                 else:
                     # Multipart
                     setup_multi_part_response(r, ranges, content_length,
-                                              self._content_type)
+                                              content_type)
 
                     # Recalculate content length
                     s = 0
@@ -706,10 +729,15 @@ class StaticFileSonos(object):
                         s += ra[1] - ra[0] + 1
                     h['Content-length'] = str(s)
 
+        if albumart or coveroffsets:
+            kind = 'art'
+        else:
+            kind = 'file'
+        metrics.add('bytes_served', int(h.get('Content-length') or 0), kind=kind)
 
-        log.debug("headers: %s", str(h))
+        log.debug("headers: %s", h)
         if response:
-            log.debug("headers: %s", str(response.headers))
+            log.debug("headers: %s", response.headers)
 
         if not response:
             # Normal request, not redirected. When redirected, who respond()s is
@@ -768,7 +796,7 @@ class TranscodedFileSonos(object):
         if not self._content_type:
             self._guess_content_type()
 
-        log.debug('dummyname: %s   name: %s   path: %s   _content_type: %s   _disposition: %s' % (dummyname, name, path, self._content_type, self._disposition))
+        log.debug('dummyname: %s   name: %s   path: %s   _content_type: %s   _disposition: %s', dummyname, name, path, self._content_type, self._disposition)
 
 
     def _guess_content_type(self, path=None):
@@ -781,7 +809,7 @@ class TranscodedFileSonos(object):
         self._content_type = mimetypes.types_map.get('.%s' %
                                                      path.split('.')[-1],
                                                      'text/plain')
-        log.debug('File %s type %s' % (path, self._content_type))
+        log.debug('File %s type %s', path, self._content_type)
 
 
     def application(self, environ, start_response, response=None):
@@ -797,9 +825,9 @@ class TranscodedFileSonos(object):
 #        import traceback        
 #        traceback.print_stack()
 
-        log.debug('TranscodedFileSonos application environ %s' % environ)
-        log.debug('TranscodedFileSonos application start_response %s' % start_response)
-        log.debug('TranscodedFileSonos application response %s' % response)
+        log.debug('TranscodedFileSonos application environ %s', environ)
+        log.debug('TranscodedFileSonos application start_response %s', start_response)
+        log.debug('TranscodedFileSonos application response %s', response)
 
         req = Request(environ)
 
@@ -890,9 +918,9 @@ class TranscodedFileSonos(object):
                     h['Content-length'] = str(s)
 
 
-        log.debug("headers: %s", str(h))
+        log.debug("headers: %s", h)
         if response:
-            log.debug("headers: %s", str(response.headers))
+            log.debug("headers: %s", response.headers)
 
         if not response:
             # Normal request, not redirected. When redirected, who respond()s is
@@ -978,7 +1006,7 @@ class Resource(object):
         """ WSGI application callback. May not be called directly by the
         user.
         """
-        log.debug('Resource application environ %s' % environ)
+        log.debug('Resource application environ %s', environ)
         
 #        if 'REQUEST_METHOD' in environ:
 #            if environ['REQUEST_METHOD'] == 'GET':
@@ -1035,17 +1063,17 @@ class Resource(object):
 
             if render != self:
 
-                log.debug('environ %s' % environ)
-                log.debug('oldenviron %s' % oldenviron)
-                log.debug('req.uri %s' % req.uri)
-                log.debug('req.params %s' % req.params)
-                log.debug('req %s' % req)
-                log.debug('resp %s' % resp)
+                log.debug('environ %s', environ)
+                log.debug('oldenviron %s', oldenviron)
+                log.debug('req.uri %s', req.uri)
+                log.debug('req.params %s', req.params)
+                log.debug('req %s', req)
+                log.debug('resp %s', resp)
 
                 proxybody = render.render(oldenviron, start_response)
 
-                log.debug('resp headers %s' % resp.headers)
-                log.debug('resp status %s' % resp.status)
+                log.debug('resp headers %s', resp.headers)
+                log.debug('resp status %s', resp.status)
 
                 if not proxybody and not req.headers:
                         log.error('Body and headers were empty.')
@@ -1079,15 +1107,16 @@ class Resource(object):
                         except zlib.error, e:
                             log.debug(e)
                     '''
-                    log.debug('environ: %s' % environ)
-                    log.debug('req.headers: %s' % req.headers)
+                    log.debug('environ: %s', environ)
+                    log.debug('req.headers: %s', req.headers)
 
                     canzip = req.headers.get('accept-encoding', None)
-                    log.debug('canzip: %s' % canzip)
+                    log.debug('canzip: %s', canzip)
 
-                    if canzip != None:
+                    if canzip != None and 'gzip' in canzip:
 
                         log.debug(len(resp.body))
+                        start = time()
                         try:
                             import gzip
                             import cStringIO
@@ -1103,6 +1132,7 @@ class Resource(object):
                             resp.headers['Content-Length'] = '%d' % len(resp.body)
                             resp.headers['Content-Encoding'] = 'gzip'
                             log.debug(resp.headers)
+                            metrics.observe('gzip_seconds', time() - start)
                             
 #                        except zlib.error, e:
 #                            log.debug(e)
@@ -1131,6 +1161,18 @@ class CustomResource(Resource):
     """
     pass
 
+class MetricsResource(Resource):
+    """ Exports the latency histograms, counters and gauges recorded with
+    brisa.core.metrics in the Prometheus text format.
+    """
+
+    def __init__(self, name='metrics'):
+        Resource.__init__(self, name)
+
+    def render(self, uri, request, response):
+        response.headers['Content-type'] = 'text/plain; version=0.0.4'
+        return metrics.render()
+
 class SonosResource(Resource):
     """
     """
@@ -1143,6 +1185,7 @@ class SonosResource(Resource):
         self.name = name
         self.proxy = proxy
         self._tree = {}
+        self._lazy = {}
 
     def add_static_file(self, file):
         """ Adds a static file to the resource.
@@ -1153,8 +1196,8 @@ class SonosResource(Resource):
         @note: if the file name is already present on the tree, it will get
                overriden
         """
-        log.debug("SonosResource add_static_file file: %s" % file)
-        log.debug("SonosResource add_static_file name: %s" % file.name)
+        log.debug("SonosResource add_static_file file: %s", file)
+        log.debug("SonosResource add_static_file name: %s", file.name)
         
         if not isinstance(file, StaticFileSonos):
             raise ValueError('file must be a StaticFileSonos instance.')
@@ -1171,9 +1214,9 @@ class SonosResource(Resource):
         @note: if the file name is already present on the tree, it will get
                overriden
         """
-        log.debug("SonosResource add_transcoded_file file: %s" % file)
-        log.debug("SonosResource add_transcoded_file name: %s" % file.name)
-        log.debug("SonosResource add_transcoded_file dummyname: %s" % file.dummyname)
+        log.debug("SonosResource add_transcoded_file file: %s", file)
+        log.debug("SonosResource add_transcoded_file name: %s", file.name)
+        log.debug("SonosResource add_transcoded_file dummyname: %s", file.dummyname)
         
         if not isinstance(file, TranscodedFileSonos):
             raise ValueError('file must be a TranscodedFileSonos instance.')
@@ -1181,6 +1224,21 @@ class SonosResource(Resource):
 #            warnings.warn('name override: %s' % file.dummyname)
         self._tree[file.dummyname] = file
 
+    def add_lazy_file(self, factory, dummyname, *args, **kwargs):
+        """ Adds a file to the resource that is only created, by calling
+        factory(dummyname, *args, **kwargs), when it is first requested.
+
+        @param factory: StaticFileSonos or TranscodedFileSonos
+        @param dummyname: file name visible on the webserver
+
+        @note: a file already created for dummyname is kept unless it was
+               added with different arguments
+        """
+        spec = (factory, args, kwargs)
+        if self._lazy.get(dummyname, None) != spec:
+            self._lazy[dummyname] = spec
+            self._tree.pop(dummyname, None)
+
     def add_resource(self, resource):
         """ Adds a resource to the resource.
 
@@ -1200,7 +1258,7 @@ class SonosResource(Resource):
         """ WSGI application callback. May not be called directly by the
         user.
         """
-        log.debug('SonosResource application environ %s' % environ)
+        log.debug('SonosResource application environ %s', environ)
         
         if environ['SCRIPT_NAME'] == '/':
             # HACK - work out why circuits is doing this
@@ -1209,16 +1267,24 @@ class SonosResource(Resource):
             
         path = wsgiref.util.shift_path_info(environ)
 
-        log.debug('SonosResource application path %s' % path)
-        log.debug('SonosResource application tree %s' % self._tree)
+        log.debug('SonosResource application path %s', path)
+        log.debug('SonosResource application tree %s', self._tree)
 
-        if path in self._tree:
+        file = self._tree.get(path, None)
+        if file == None:
+            spec = self._lazy.get(path, None)
+            if spec != None:
+                # Browsed but not requested before, create it now
+                factory, args, kwargs = spec
+                file = self._tree[path] = factory(path, *args, **kwargs)
+
+        if file != None:
             # Path directly available
-            return self._tree[path].application(environ, start_response)
+            return file.application(environ, start_response)
         else:
             # Path not found - may have been called from queue when file has not been browsed
             self.proxy.get_Track(path)
-            log.debug('SonosResource application tree now %s' % self._tree)
+            log.debug('SonosResource application tree now %s', self._tree)
             if path in self._tree:
                 return self._tree[path].application(environ, start_response)
 
@@ -1396,8 +1462,8 @@ def check_port(host, port, timeout=1.0):
 
     Copyright (c) 2002-2008, CherryPy Team (team@cherrypy.org)
     """
-    log.debug('host: %s' % host)
-    log.debug('port: %s' % port)
+    log.debug('host: %s', host)
+    log.debug('port: %s', port)
     if not host:
         raise ValueError("Host values of '' or None are not allowed.")
     host = client_host(host)
@@ -1539,7 +1605,8 @@ class WebServer(Resource):
         if not self.is_running():
             if not self.adapter:
                 raise RuntimeError('Adapter not set.')
-            threaded_call.run_async_function(self.adapter.start)
+            # the adapter blocks while serving, keep it off the shared queues
+            threaded_call.run_async_function(self.adapter.start, queue=None)
             self.running = True
         else:
             log.warning(self.msg_already_started)
@@ -134,6 +134,7 @@ class BaseDevice(object):
         """
         if service.service_type not in self.services:
             self.services[service.service_type] = service
+            service.parent_device = self
 
     def get_service_by_type(self, service_type):
         """ Returns a service given its type.
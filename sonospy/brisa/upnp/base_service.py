@@ -74,6 +74,7 @@ class BaseService(object):
         self.control_url = '/%s/%s' % (id, 'control')
         self.event_sub_url = '/%s/%s' % (id, 'eventSub')
         self.presentation_url = '/%s/%s' % (id, 'presentation')
+        self.parent_device = None
         self._actions = {}
         self._state_variables = {}
  
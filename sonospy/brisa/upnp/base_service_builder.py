@@ -34,6 +34,29 @@ class BaseServiceBuilder(object):
         self._build_service()
         return True
 
+    def build_from_definition(self, definition):
+        """ Builds a service from a definition previously returned by
+        get_definition(), without parsing the SCPD XML.
+
+        @param definition: tuple (actions, variables)
+        @type definition: tuple
+
+        @return: True if service build succeeded, otherwise False.
+        @rtype: bool
+        """
+        self._actions, self._variables = definition
+        self._build_service()
+        return True
+
+    def get_definition(self):
+        """ Returns the parsed actions and state variables as plain data,
+        suitable for pickling.
+
+        @return: tuple (actions, variables)
+        @rtype: tuple
+        """
+        return (self._actions, self._variables)
+
     def _parse_description(self, fd):
         """ Parses the actions and state variables of a service given a file
         descriptor containing the SCPD XML. File descriptor must be open.
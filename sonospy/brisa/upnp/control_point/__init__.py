@@ -7,7 +7,8 @@
 
 from brisa.upnp.control_point.control_point import ControlPoint
 from brisa.upnp.control_point.control_point_av import ControlPointAV
-from brisa.upnp.control_point.event import EventListener, EventListenerServer
+from brisa.upnp.control_point.event import EventListener, EventListenerServer, \
+                                         SubscriptionRegistry, subscriptions
 from brisa.upnp.control_point.service import Service
 from brisa.upnp.control_point.device import Device
 from brisa.upnp.control_point.msearch import MSearch
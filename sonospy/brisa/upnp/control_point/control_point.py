@@ -11,6 +11,7 @@ from brisa.upnp.ssdp import SSDPServer
 from brisa.upnp.control_point.msearch import MSearch
 from brisa.upnp.control_point.event import EventListenerServer, MulticastEventListener
 from brisa.upnp.control_point.device import Device
+from brisa.upnp.control_point import description_cache
 
 
 log = log.getLogger('control-point.basic')
@@ -226,7 +227,8 @@ class ControlPoint(object):
             return
         Device.get_from_location_async(device_info['LOCATION'],
                                        self._new_device_event_impl,
-                                       device_info)
+                                       device_info,
+                                       description_cache.get_key(device_info))
 
     def _new_device_event_impl(self, device_info, device):
         """ Real implementation of the new device event handler.
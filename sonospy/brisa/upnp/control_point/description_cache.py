@@ -0,0 +1,166 @@
+# Licensed under the MIT license
+# http://opensource.org/licenses/mit-license.php or see LICENSE file.
+# Copyright 2007-2008 Brisa Team <brisa-develop@garage.maemo.org>
+
+""" Persistent cache of device descriptions and parsed service definitions.
+
+Entries are keyed on the device location and the SERVER, BOOTID.UPNP.ORG
+and CONFIGID.UPNP.ORG values announced over SSDP, so a device that reboots
+with new firmware or a new configuration gets a new entry. A device built
+from the cache is revalidated in the background and the entry is replaced
+when the device or any of its services changed.
+"""
+
+import os
+import hashlib
+import cPickle
+import threading
+
+from time import time
+
+from brisa.core import log, config
+
+
+# Seconds to wait before revalidating a device built from the cache
+revalidate_delay = 30
+
+
+def get_key(device_info):
+    """ Returns the cache key for a device given the SSDP device info, or
+    None if the location is unknown.
+
+    @param device_info: device info as registered by SSDPServer
+    @type device_info: dict
+
+    @rtype: string
+    """
+    location = device_info.get('LOCATION', None)
+    if not location:
+        return None
+    return '\n'.join([location,
+                      device_info.get('SERVER', '') or '',
+                      device_info.get('BOOTID.UPNP.ORG', '') or '',
+                      device_info.get('CONFIGID.UPNP.ORG', '') or ''])
+
+
+class DescriptionCache(object):
+    """ Stores one pickle file per device in the cache directory. Each entry
+    holds the device description XML and, per SCPD URL, the parsed service
+    definition (actions and state variables) as produced by
+    BaseServiceBuilder.
+    """
+
+    def __init__(self, path):
+        """ Constructor for the DescriptionCache class.
+
+        @param path: cache directory
+        @type path: string
+        """
+        self.path = path
+        self.enabled = True
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """ Returns the entry for the key or None. Entries are dicts with the
+        keys 'location', 'device' (description XML) and 'services'.
+
+        @param key: key returned by get_key()
+        @type key: string
+
+        @rtype: dict
+        """
+        if not self.enabled or not key:
+            return None
+        filename = self._filename(key)
+        if not os.path.isfile(filename):
+            return None
+        try:
+            f = open(filename, 'rb')
+            try:
+                entry = cPickle.load(f)
+            finally:
+                f.close()
+        except Exception, e:
+            log.debug('Discarding unreadable description cache %s: %s',
+                      filename, e)
+            self.remove(key)
+            return None
+        if entry.get('key', None) != key:
+            return None
+        return entry
+
+    def put(self, key, location, device_xml, services):
+        """ Stores an entry, replacing any previous one for the key.
+
+        @param key: key returned by get_key()
+        @param location: device description URL
+        @param device_xml: device description XML
+        @param services: dict of SCPD URL: (actions, variables)
+
+        @type key: string
+        @type location: string
+        @type device_xml: string
+        @type services: dict
+        """
+        if not self.enabled or not key:
+            return
+        entry = {'key': key,
+                 'location': location,
+                 'device': device_xml,
+                 'services': services,
+                 'stored': time()}
+        filename = self._filename(key)
+        self._lock.acquire()
+        try:
+            try:
+                if not os.path.isdir(self.path):
+                    os.makedirs(self.path)
+                # Write to a temporary file first, readers never see a
+                # partial entry
+                tmp = '%s.%d.tmp' % (filename, os.getpid())
+                f = open(tmp, 'wb')
+                try:
+                    cPickle.dump(entry, f, cPickle.HIGHEST_PROTOCOL)
+                finally:
+                    f.close()
+                if os.name == 'nt' and os.path.exists(filename):
+                    os.remove(filename)
+                os.rename(tmp, filename)
+                log.debug('Stored description cache for %s', location)
+            except (IOError, OSError), e:
+                log.warning('Could not write description cache %s: %s',
+                            filename, e)
+        finally:
+            self._lock.release()
+
+    def remove(self, key):
+        """ Removes the entry for the key, if present.
+
+        @param key: key returned by get_key()
+        @type key: string
+        """
+        try:
+            os.remove(self._filename(key))
+        except OSError:
+            pass
+
+    def clear(self):
+        """ Removes all entries.
+        """
+        if not os.path.isdir(self.path):
+            return
+        for name in os.listdir(self.path):
+            if name.endswith('.pickle'):
+                try:
+                    os.remove(os.path.join(self.path, name))
+                except OSError:
+                    pass
+
+    def _filename(self, key):
+        return os.path.join(self.path, '%s.pickle' % hashlib.md5(key).hexdigest())
+
+
+cache = DescriptionCache(os.path.join(config.brisa_home, 'description-cache'))
+if config.get_parameter('brisa', 'description_cache') in \
+   ['off', 'no', '0', 'False', False]:
+    cache.enabled = False
@@ -68,8 +68,10 @@ class Device(BaseDevice):
         return DeviceAssembler(cls(), location).mount_device()
 
     @classmethod
-    def get_from_location_async(cls, location, callback, cargo):
-        DeviceAssembler(cls(), location).mount_device_async(callback, cargo)
+    def get_from_location_async(cls, location, callback, cargo,
+                                cache_key=None):
+        DeviceAssembler(cls(), location,
+                        cache_key=cache_key).mount_device_async(callback, cargo)
 
     @classmethod
     def get_from_file(cls, location, filename):
@@ -6,13 +6,14 @@
 """
 
 from xml.etree.ElementTree import ElementTree
-from xml.etree.ElementTree import tostring
+from xml.etree.ElementTree import tostring, fromstring
 
 from brisa.core import log
 from brisa.core.network import url_fetch, parse_url
-from brisa.core.threaded_call import run_async_call
+from brisa.core.threaded_call import run_async_call, run_async_function
 
 from brisa.upnp.control_point.service import Service
+from brisa.upnp.control_point import description_cache
 from brisa.upnp.upnp_defaults import UPnPDefaults
 
 import brisa
@@ -126,10 +127,13 @@ class DeviceBuilder(object):
 
 class DeviceAssembler(object):
 
-    def __init__(self, device, location, filename=None):
+    def __init__(self, device, location, filename=None, cache_key=None):
         self.device = device
         self.location = location
         self.filename = filename
+        self.cache_key = cache_key
+        self._device_xml = None
+        self._services_ok = True
 
     def mount_device(self):
         if self.filename is None:
@@ -161,11 +165,23 @@ class DeviceAssembler(object):
 #            self.callback(self.cargo, None)
 #            return
         
+        if self.filename is None and self.cache_key:
+            entry = description_cache.cache.get(self.cache_key)
+            if entry and self._mount_from_cache(entry):
+                log.debug('Device %s built from description cache' %
+                          self.location)
+                self.callback(self.cargo, self.device)
+                run_async_function(self._revalidate, (entry, ),
+                                   description_cache.revalidate_delay,
+                                   queue='device-build')
+                return
+
         if self.filename is None:
             run_async_call(url_fetch,
                            success_callback=self.mount_device_async_gotdata,
                            error_callback=self.mount_device_async_error,
-                           delay=0, url=self.location)
+                           delay=0, url=self.location,
+                           async_queue='device-build')
         else:
             self.mount_device_async_gotdata(self, open(self.filename))
 
@@ -178,7 +194,9 @@ class DeviceAssembler(object):
     def mount_device_async_gotdata(self, fd, cargo=None):
         try:
             log.debug('to object async got data getting tree')
-            tree = ElementTree(file=fd).getroot()
+            data = fd.read()
+            tree = fromstring(data)
+            self._device_xml = data
         except Exception, e:
             log.debug("Bad device XML %s" % e)
             self.callback(self.cargo, None)
@@ -188,6 +206,7 @@ class DeviceAssembler(object):
 
         DeviceBuilder(self.device, self.location, tree).cleanup()
         if brisa.__skip_service_xml__:
+            self._store_in_cache()
             self.callback(self.cargo, self.device)
         else:
             log.debug("Fetching device services")
@@ -207,8 +226,78 @@ class DeviceAssembler(object):
         if not built_ok and not brisa.__tolerate_service_parse_failure__:
             log.debug("Device killed")
             self.device = None
+        if not built_ok:
+            self._services_ok = False
         self.pending_services -= 1
 
         if self.pending_services <= 0:
             log.debug("All services fetched, sending device forward")
+            if self.device and self._services_ok:
+                self._store_in_cache()
             self.callback(self.cargo, self.device)
+
+    def _store_in_cache(self):
+        """ Stores the device description and the parsed definitions of its
+        services in the description cache.
+        """
+        if not self.cache_key or self._device_xml is None:
+            return
+        services = {}
+        for service in self.device.services.values():
+            services[service.scpd_url] = service.scpd_definition
+        description_cache.cache.put(self.cache_key, self.location,
+                                    self._device_xml, services)
+
+    def _mount_from_cache(self, entry):
+        """ Builds the device and its services from a description cache
+        entry. Returns False when the entry can't be used, in which case the
+        device is reset so that it can be built from the network.
+        """
+        try:
+            tree = fromstring(entry['device'])
+            DeviceBuilder(self.device, self.location, tree).cleanup()
+            if not brisa.__skip_service_xml__:
+                for service in self.device.services.values():
+                    definition = entry['services'].get(service.scpd_url, None)
+                    if definition is None or \
+                       not service.build_from_definition(definition):
+                        raise ValueError('no definition for %s' %
+                                         service.scpd_url)
+        except Exception, e:
+            log.debug('Discarding description cache for %s: %s' %
+                      (self.location, e))
+            description_cache.cache.remove(self.cache_key)
+            self.device = self.device.__class__()
+            return False
+        self._device_xml = entry['device']
+        return True
+
+    def _revalidate(self, entry):
+        """ Fetches the device and service descriptions of a device built
+        from the cache and replaces the cache entry if any of them changed.
+        The device already handed to the callback is not modified; the new
+        descriptions are used the next time the device is built.
+        """
+        try:
+            fd = url_fetch(self.location, silent=True)
+            if not fd:
+                return
+            data = fd.read()
+            services = {}
+            if not brisa.__skip_service_xml__:
+                for service in self.device.services.values():
+                    definition = service.fetch_scpd_definition()
+                    if definition is None:
+                        return
+                    services[service.scpd_url] = definition
+        except Exception, e:
+            log.debug('Could not revalidate %s: %s' % (self.location, e))
+            return
+
+        if data == entry['device'] and services == entry['services']:
+            log.debug('Description cache for %s is up to date' %
+                      self.location)
+            return
+        log.info('Description of %s changed, updating cache' % self.location)
+        description_cache.cache.put(self.cache_key, self.location, data,
+                                    services)
@@ -5,6 +5,8 @@
 """ Control point side UPnP event support.
 """
 
+import threading
+
 from xml.etree import ElementTree
 
 from brisa.core import log, webserver
@@ -35,6 +37,85 @@ def read_notify_message_body(body_data):
     return changed_vars
 
 
+class SubscriptionRegistry(object):
+    """ Maps event subscription ids (SID) to the subscribed device, service
+    and service type, so incoming notifications can be dispatched without
+    walking every known device. Kept up to date by the subscribe, renew and
+    unsubscribe requests of the control point services.
+    """
+
+    def __init__(self):
+        self._subscriptions = {}
+        self._lock = threading.Lock()
+
+    def add(self, sid, service):
+        """ Registers a subscription.
+
+        @param sid: subscription id returned by the device
+        @param service: subscribed service
+
+        @type sid: string
+        @type service: Service
+        """
+        if not sid:
+            return
+        self._lock.acquire()
+        try:
+            self._subscriptions[sid] = (service.parent_device, service,
+                                        service.service_type)
+        finally:
+            self._lock.release()
+
+    def remove(self, sid):
+        """ Removes a subscription, if registered.
+
+        @param sid: subscription id
+        @type sid: string
+        """
+        self._lock.acquire()
+        try:
+            self._subscriptions.pop(sid, None)
+        finally:
+            self._lock.release()
+
+    def get(self, sid):
+        """ Returns the (device, service, service type) tuple registered for
+        the subscription id or None.
+
+        @param sid: subscription id
+        @type sid: string
+
+        @rtype: tuple
+        """
+        return self._subscriptions.get(sid, None)
+
+    def get_service(self, sid):
+        """ Returns the service registered for the subscription id or None.
+
+        @param sid: subscription id
+        @type sid: string
+
+        @rtype: Service
+        """
+        entry = self._subscriptions.get(sid, None)
+        if entry:
+            return entry[1]
+        return None
+
+    def clear(self):
+        """ Removes all subscriptions.
+        """
+        self._lock.acquire()
+        try:
+            self._subscriptions.clear()
+        finally:
+            self._lock.release()
+
+
+# Registry shared by the control point services and the event listener
+subscriptions = SubscriptionRegistry()
+
+
 class EventListener(webserver.CustomResource):
     """ EventListener resource available at the control point web server,
     listening for events.
@@ -97,7 +178,7 @@ class EventListener(webserver.CustomResource):
         data = data[data.find("<"):data.rfind(">")+1]
 
         run_async_function(self.forward_notification, (request.headers, data),
-                           0.0001)
+                           0.0001, queue='events')
         return ""
 
     def forward_notification(self, received_headers, data):
@@ -126,6 +207,12 @@ class EventListener(webserver.CustomResource):
             else:            
                 self.observer._on_event(headers['sid'], changed_vars)
 
+            service = subscriptions.get_service(headers['sid'])
+            if service != None:
+                service._on_event(changed_vars)
+                return
+
+            # Not subscribed through the registry, search the devices
             for id, dev in self.observer._known_devices.items():
 
                 log.debug('id: %s - dev: %s', id, dev)
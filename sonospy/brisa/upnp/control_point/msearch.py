@@ -171,7 +171,9 @@ class MSearch(object):
                                         headers['st'],
                                         headers['location'],
                                         headers['server'],
-                                        headers['cache-control'])
+                                        headers['cache-control'],
+                                        bootid=headers.get('bootid.upnp.org', ''),
+                                        configid=headers.get('configid.upnp.org', ''))
 #        print "   datagram_received end"
 
     def _cleanup(self):
@@ -35,6 +35,7 @@ from brisa.upnp.soap import SOAPProxy, SOAPProxyFile
 from brisa.upnp.base_service import BaseService, BaseStateVariable,\
                                     format_rel_url
 from brisa.upnp.control_point.action import Action, Argument
+from brisa.upnp.control_point.event import subscriptions
 from brisa.upnp.base_service_builder import BaseServiceBuilder
 
 
@@ -101,6 +102,7 @@ class Service(BaseService):
         self.presentation_url = presentation_url
         self._auto_renew_subs = None
         self._soap_service = None
+        self.scpd_definition = None
 
         if not brisa.__skip_soap_service__:
             if is_file(self.scpd_url):
@@ -135,7 +137,9 @@ class Service(BaseService):
         if not fd:
             log.debug('Could not fetch SCPD URL %s' % self.scpd_url)
             raise RuntimeError('Could not build Service %s', self)
-        ServiceBuilder(self, fd).build()
+        builder = ServiceBuilder(self, fd)
+        if builder.build():
+            self.scpd_definition = builder.get_definition()
 
     def _build_async(self, cb):
         """ Builds the service asynchronously. Forwards True to the specified
@@ -152,7 +156,7 @@ class Service(BaseService):
                            success_callback=self._fetch_scpd_async_done,
                            error_callback=self._fetch_scpd_async_error,
                            delay=0, file=self.scpd_url[8:], mode='r', success_callback_cargo=cb,
-                           error_callback_cargo=cb)
+                           error_callback_cargo=cb, async_queue='device-build')
         else:
             if is_relative(self.scpd_url, self.url_base):
                 path = '%s%s' % (self.url_base, self.scpd_url)
@@ -163,7 +167,7 @@ class Service(BaseService):
                            success_callback=self._fetch_scpd_async_done,
                            error_callback=self._fetch_scpd_async_error,
                            delay=0, url=path, success_callback_cargo=cb,
-                           error_callback_cargo=cb)
+                           error_callback_cargo=cb, async_queue='device-build')
 
     def _fetch_scpd_async_done(self, fd=None, cb=None):
         """ Called when the SCPD XML was sucessfully fetched. If so, build the
@@ -173,11 +177,47 @@ class Service(BaseService):
 #        print '_fetch_scpd_async_done fd: ' + str(fd)
 #        print '_fetch_scpd_async_done cb: ' + str(cb)
         if fd:
-            parsed_ok = ServiceBuilder(self, fd).build()
+            builder = ServiceBuilder(self, fd)
+            parsed_ok = builder.build()
+            if parsed_ok:
+                self.scpd_definition = builder.get_definition()
 #            print '_fetch_scpd_async_done parsed_ok: ' + str(parsed_ok)
             if cb:
                 cb(parsed_ok)
 
+    def build_from_definition(self, definition):
+        """ Builds the service from a parsed SCPD definition, as returned by
+        BaseServiceBuilder.get_definition().
+        """
+        try:
+            built_ok = ServiceBuilder(self, None).build_from_definition(definition)
+        except Exception, e:
+            log.debug('Could not build service %s from definition: %s',
+                      self.id, e)
+            return False
+        if built_ok:
+            self.scpd_definition = definition
+        return built_ok
+
+    def fetch_scpd_definition(self):
+        """ Fetches and parses the SCPD XML synchronously without building the
+        service. Returns the definition or None if it could not be parsed.
+        """
+        if is_file(self.scpd_url):
+            fd = open(self.scpd_url[8:], 'r')
+        else:
+            if is_relative(self.scpd_url, self.url_base):
+                url = '%s%s' % (self.url_base, self.scpd_url)
+            else:
+                url = self.scpd_url
+            fd = url_fetch(url)
+        if not fd:
+            return None
+        builder = BaseServiceBuilder(self, fd)
+        if not builder._parse_description(fd):
+            return None
+        return builder.get_definition()
+
     def _fetch_scpd_async_error(self, cb=None, error=None):
         """ Called when the SCPD XML wasn't successfully fetched.
         """
@@ -345,6 +385,7 @@ class SubscribeRequest(object):
         @rtype: boolean
         """
         log.debug("error %s", error)
+        subscriptions.remove(self.service.event_sid)
         self.service.event_sid = ""
         self.service.event_timeout = 0
         if self.callback:
@@ -382,8 +423,11 @@ class SubscribeRequest(object):
                             timeout = int(stimeout[7:])
                         except ValueError:
                             pass
+                if self.service.event_sid != sid:
+                    subscriptions.remove(self.service.event_sid)
                 self.service.event_sid = sid
                 self.service.event_timeout = timeout
+                subscriptions.add(sid, self.service)
         if self.service._auto_renew_subs and sid:
             self.service._auto_renew_subs.start_auto_renew()
         if self.callback and sid:
@@ -409,6 +453,7 @@ class UnsubscribeRequest(object):
         @type callback: callable
         """
         self.old_sid = service.event_sid
+        subscriptions.remove(self.old_sid)
         service.event_sid = ""
         service.event_timeout = 0
 
@@ -506,7 +551,8 @@ class RenewSubscribeRequest(object):
 
         @rtype: boolean
         """
-        log.debug("error", error)
+        log.debug("error %s", error)
+        subscriptions.remove(self.service.event_sid)
         self.service.event_sid = ""
         self.service.event_timeout = 0
         if self.callback:
@@ -541,8 +587,11 @@ class RenewSubscribeRequest(object):
                             timeout = int(stimeout[7:])
                         except ValueError:
                             pass
+                if self.service.event_sid != sid:
+                    subscriptions.remove(self.service.event_sid)
                 self.service.event_sid = sid
                 self.service.event_timeout = timeout
+                subscriptions.add(sid, self.service)
         if self.callback and sid:
             self.callback(self.cargo, sid, timeout)
 
@@ -7,17 +7,22 @@
 """
 
 import uuid
+import Queue
+import socket
+import httplib
+import threading
 
+from time import time
 from xml.etree import ElementTree
 from datetime import datetime
 
-from brisa.core import log, reactor, webserver
+from brisa.core import log, reactor, webserver, config
 #log = log.getLogger('device-events')
 
-from brisa.core.network import http_call, parse_url
+from brisa.core.network import parse_url
 from brisa.core.network_senders import UDPTransport
 from brisa.core.network_listeners import UDPListener
-from brisa.core.threaded_call import run_async_call, ThreadedCall
+from brisa.core.threaded_call import run_async_function, ThreadedCall
 from brisa.utils.looping_call import LoopingCall
 from brisa.upnp import soap
 from brisa.upnp.upnp_defaults import map_upnp_value, UPnPDefaults
@@ -126,7 +131,8 @@ class EventController(webserver.CustomResource):
             subscriber = Subscriber(self.service, timeout,
                                 callback, request.server_protocol,
                                 self.event_reload_time,
-                                self.force_event_reload)
+                                self.force_event_reload,
+                                self._remove_subscriber)
             response_body = self._get_subscribe_response(request,
                                                          response, subscriber)
             self.subscribers.append(subscriber)
@@ -137,7 +143,7 @@ class EventController(webserver.CustomResource):
                 # TODO: check if we need to do this change anywhere else
                 if state_var.send_events:
                     eventing_variables[var_name] = state_var.get_value()
-            EventMessage(subscriber, eventing_variables, 1, "")
+            get_delivery_pool().deliver(subscriber, eventing_variables, 1)
 
             # Try to unsubscribe after the timeout
             t_call = ThreadedCall(self._auto_remove_subscriber, None, None,
@@ -310,13 +316,14 @@ class EventController(webserver.CustomResource):
 
     def _remove_subscriber(self, subscriber):
         subscriber.stop()
-        self.subscribers.remove(subscriber)
+        if subscriber in self.subscribers:
+            self.subscribers.remove(subscriber)
 
 
 class Subscriber:
 
     def __init__(self, service, subscription_duration, delivery_url, http_version,
-                 event_reload_time, force_event_reload):
+                 event_reload_time, force_event_reload, drop_callback=None):
 
         self.service = service
         self.subscription_id = uuid.uuid4()
@@ -327,8 +334,15 @@ class Subscriber:
         self.subscription_duration = subscription_duration
         self.http_version = http_version
         self.timestamp = datetime.now()
+        self.drop_callback = drop_callback
 
         self.eventing_variables = {}
+        # Moderated variables: name -> (time, value) of the last event and
+        # name -> latest value held until the end of the rate window
+        self._moderated_sent = {}
+        self._moderated_held = {}
+        self._moderation_lock = threading.Lock()
+        self._stopped = False
         for name, state_var in self.service.get_variables().items():
             state_var.subscribe_for_update(self._update_variable)
 
@@ -347,26 +361,93 @@ class Subscriber:
             self.event_key = 1
 
     def _update_variable(self, name, value):
+        state_var = self.service.get_variables().get(name, None)
+        if state_var is not None and state_var.is_moderated():
+            self._update_moderated_variable(state_var, value)
+            return
+
         if self.force_event_reload:
             self.eventing_variables[name] = value
             self._send_variables()
             return
 
-        if name in self.eventing_variables.keys() and \
+        if name in self.eventing_variables and \
             self.eventing_variables[name] != value:
             self._send_variables()
 
         self.eventing_variables[name] = value
 
+    def _update_moderated_variable(self, state_var, value):
+        """ Events a moderated variable at most max_rate times per second
+        and only when it changed by at least min_delta. Changes inside a
+        rate window are merged and the latest value is sent at the end of
+        the window.
+        """
+        name = state_var.name
+        now = time()
+        delay = 0
+
+        self._moderation_lock.acquire()
+        try:
+            last_time, last_value = self._moderated_sent.get(name, (0, None))
+
+            if state_var.min_delta and last_value is not None:
+                try:
+                    if abs(float(value) - float(last_value)) < \
+                       state_var.min_delta:
+                        return
+                except (TypeError, ValueError):
+                    pass
+
+            if state_var.max_rate:
+                interval = 1.0 / state_var.max_rate
+                if name in self._moderated_held:
+                    # Already waiting for the window edge
+                    self._moderated_held[name] = value
+                    return
+                if now - last_time < interval:
+                    self._moderated_held[name] = value
+                    delay = last_time + interval - now
+            if not delay:
+                self._moderated_sent[name] = (now, value)
+        finally:
+            self._moderation_lock.release()
+
+        if delay:
+            run_async_function(self._send_moderated_variable, (name, ), delay)
+        else:
+            self.eventing_variables[name] = value
+            self._send_variables()
+
+    def _send_moderated_variable(self, name):
+        self._moderation_lock.acquire()
+        try:
+            if self._stopped or name not in self._moderated_held:
+                return
+            value = self._moderated_held.pop(name)
+            self._moderated_sent[name] = (time(), value)
+        finally:
+            self._moderation_lock.release()
+
+        self.eventing_variables[name] = value
+        self._send_variables()
+
     def _send_variables(self):
         if self.eventing_variables:
-            EventMessage(self, self.eventing_variables, 0, "")
+            get_delivery_pool().deliver(self, self.eventing_variables)
             self.eventing_variables = {}
 
     def stop(self):
         for name, state_var in self.service.get_variables().items():
             state_var.unsubscribe_for_update(self._update_variable)
 
+        self._moderation_lock.acquire()
+        self._stopped = True
+        self._moderated_held = {}
+        self._moderation_lock.release()
+
+        get_delivery_pool().remove(self)
+
         # When called stop() manually, remove the before stop callback
         if not self.force_event_reload:
             reactor.rem_after_stop_func(self.looping_call.stop)
@@ -398,32 +479,256 @@ def build_notify_message_body(variables):
     return ElementTree.tostring(property_set, 'utf-8')
 
 
-class EventMessage:
-    """ Wrapper for an event message.
+def build_unicast_message_body(variables):
+    log.debug("Building unicast message body to variables: %s", variables)
+    preamble = """<?xml version="1.0" encoding="utf-8"?>"""
+    return '%s%s' % (preamble, build_notify_message_body(variables))
+
+
+class _SubscriberQueue(object):
+    """ Pending variables and delivery state of a single subscriber.
     """
 
-    def __init__(self, subscriber, variables, event_delay, cargo):
-        """ Constructor for the EventMessage class.
+    def __init__(self, subscriber):
+        self.subscriber = subscriber
+        self.pending = {}
+        self.pending_since = None
+        self.not_before = 0
+        self.retry_delay = 0
+        self.scheduled = False
+        self.removed = False
+        self.connection = None
+
+
+class EventDeliveryPool(object):
+    """ Delivers unicast event messages (NOTIFY) to subscribers using a fixed
+    number of worker threads.
+
+    Each subscriber has its own queue of pending variables. Variables updated
+    while a message is waiting to be sent are merged into a single propertyset,
+    and a subscriber is handled by only one worker at a time, so messages
+    are delivered in SEQ order. Connections to subscribers are kept alive
+    between messages. Failed messages are retried with an increasing delay,
+    and subscribers whose pending variables could not be delivered for
+    longer than the timeout are dropped.
+    """
+
+    def __init__(self, workers=4, timeout=30):
+        """ Constructor for the EventDeliveryPool class.
+
+        @param workers: number of delivery threads
+        @param timeout: seconds before an undeliverable subscriber is dropped,
+                        also used as the socket timeout
+
+        @type workers: integer
+        @type timeout: float
+        """
+        self.workers = workers
+        self.timeout = timeout
+        self._queues = {}
+        self._ready = Queue.Queue()
+        self._lock = threading.Lock()
+        self._threads = []
+        self.running = False
+
+    def is_running(self):
+        """ Returns True if the delivery threads are running.
+
+        @rtype: boolean
+        """
+        return self.running
+
+    def start(self):
+        """ Starts the delivery threads.
+        """
+        if self.running:
+            return
+        self.running = True
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker, args=(self._ready, ),
+                                 name='event-delivery-%d' % i)
+            t.setDaemon(True)
+            t.start()
+            self._threads.append(t)
+        log.debug('Event delivery pool started with %d workers', self.workers)
+
+    def stop(self):
+        """ Stops the delivery threads and closes open connections.
+        """
+        if not self.running:
+            return
+        self.running = False
+        ready = self._ready
+        self._ready = Queue.Queue()
+        for t in self._threads:
+            ready.put(None)
+        self._threads = []
+        self._lock.acquire()
+        try:
+            for queue in self._queues.values():
+                queue.scheduled = False
+                self._close(queue)
+        finally:
+            self._lock.release()
+
+    def deliver(self, subscriber, variables, delay=0):
+        """ Queues variables for delivery to a subscriber. Variables already
+        pending for the subscriber are replaced by the new values.
 
         @param subscriber: subscriber that will receive the message
         @param variables: variables of the event
-        @param event_delay: delay to wait before sending the event
-        @param cargo: callback parameters
+        @param delay: minimum time to wait before sending
 
         @type subscriber: Subscriber
         @type variables: dict
-        @type event_delay: float
+        @type delay: float
         """
-        log.debug("event message")
-
         if not variables:
             log.error("There are no variables to send")
             return
 
-        self.cargo = cargo
+        now = time()
+        sid = str(subscriber.subscription_id)
+        stuck = False
+
+        self._lock.acquire()
+        try:
+            queue = self._queues.get(sid, None)
+            if queue is None:
+                queue = self._queues[sid] = _SubscriberQueue(subscriber)
+            if not queue.pending:
+                queue.pending_since = now
+            queue.pending.update(variables)
+            if delay:
+                queue.not_before = max(queue.not_before, now + delay)
+            if now - queue.pending_since > self.timeout:
+                stuck = True
+            else:
+                self._schedule(queue, now)
+        finally:
+            self._lock.release()
+
+        if stuck:
+            self._drop(queue)
+        elif delay:
+            run_async_function(self._wake, (sid, ), delay)
+
+    def remove(self, subscriber):
+        """ Discards pending variables and the connection of a subscriber.
+
+        @param subscriber: subscriber to be removed
+        @type subscriber: Subscriber
+        """
+        self._lock.acquire()
+        try:
+            queue = self._queues.pop(str(subscriber.subscription_id), None)
+            if queue:
+                queue.removed = True
+                queue.pending = {}
+                self._close(queue)
+        finally:
+            self._lock.release()
+
+    def get_queue_depths(self):
+        """ Returns the number of subscribers waiting for a worker and the
+        number of pending variables for each subscriber.
+
+        @return: dict with the keys 'ready' and 'subscribers' (sid: count)
+        @rtype: dict
+        """
+        self._lock.acquire()
+        try:
+            subscribers = dict([(sid, len(q.pending))
+                                for sid, q in self._queues.items()])
+        finally:
+            self._lock.release()
+        return {'ready': self._ready.qsize(), 'subscribers': subscribers}
+
+    def _schedule(self, queue, now):
+        # Must be called with the lock held
+        if queue.scheduled or queue.removed or not queue.pending:
+            return
+        if queue.not_before > now:
+            return
+        queue.scheduled = True
+        self._ready.put(queue)
+
+    def _wake(self, sid):
+        self._lock.acquire()
+        try:
+            queue = self._queues.get(sid, None)
+            if queue:
+                self._schedule(queue, time())
+        finally:
+            self._lock.release()
+
+    def _drop(self, queue):
+        sid = str(queue.subscriber.subscription_id)
+        log.warning('Dropping subscriber sid:%s, events undelivered for '
+                    'more than %s seconds', sid, self.timeout)
+        self.remove(queue.subscriber)
+        if queue.subscriber.drop_callback:
+            queue.subscriber.drop_callback(queue.subscriber)
+
+    def _worker(self, ready):
+        while True:
+            queue = ready.get()
+            if queue is None:
+                break
+
+            self._lock.acquire()
+            variables = queue.pending
+            since = queue.pending_since
+            queue.pending = {}
+            queue.pending_since = None
+            self._lock.release()
+
+            delivered = True
+            if variables and not queue.removed:
+                try:
+                    delivered = self._send(queue, variables)
+                except Exception, e:
+                    log.error('Error while delivering event: %s', e)
+                    delivered = False
+
+            stuck = False
+            retry = 0
+            self._lock.acquire()
+            try:
+                queue.scheduled = False
+                now = time()
+                if not delivered and not queue.removed:
+                    # Keep undelivered values unless newer ones arrived
+                    variables.update(queue.pending)
+                    queue.pending = variables
+                    queue.pending_since = since
+                    stuck = now - since > self.timeout
+                    if not stuck:
+                        retry = min(max(queue.retry_delay * 2, 1),
+                                    self.timeout)
+                        queue.retry_delay = retry
+                        queue.not_before = max(queue.not_before, now + retry)
+                else:
+                    queue.retry_delay = 0
+                    self._schedule(queue, now)
+            finally:
+                self._lock.release()
+
+            if stuck:
+                self._drop(queue)
+            elif retry:
+                run_async_function(self._wake,
+                                   (str(queue.subscriber.subscription_id), ),
+                                   retry)
+
+    def _send(self, queue, variables):
+        subscriber = queue.subscriber
+        url = parse_url(subscriber.delivery_url)
+        path = url.path or '/'
+        if url.query:
+            path += '?' + url.query
 
         headers = {}
-#        headers["HOST"] = subscriber.delivery_url
         headers["HOST"] = subscriber.host
         headers["CONTENT-TYPE"] = 'text/xml'
         headers["NT"] = 'upnp:event'
@@ -432,47 +737,101 @@ class EventMessage:
         headers["SEQ"] = str(subscriber.event_key)
         subscriber.event_key_increment()
 
-        event_body = self._build_message_body(variables)
-
-        headers["CONTENT-LENGTH"] = str(len(event_body))
-
-        log.debug("Running http call")
-        run_async_call(http_call, success_callback=self.response,
-                       error_callback=self.error, delay=event_delay,
-                       method='NOTIFY', url=subscriber.delivery_url,
-                       body=event_body, headers=headers)
-
-    def _build_message_body(self, variables):
-        log.debug("Building unicast message body to variables: %s" 
-                  % str(variables))
-        preamble = """<?xml version="1.0" encoding="utf-8"?>"""
-        return '%s%s' % (preamble, build_notify_message_body(variables))
-
-    def error(self, cargo, error):
-        """ Callback for receiving an error.
-
-        @param cargo: callback parameters passed at construction
-        @param error: exception raised
+        body = build_unicast_message_body(variables)
+        headers["CONTENT-LENGTH"] = str(len(body))
+
+        # A kept-alive connection may have been closed by the subscriber,
+        # in that case retry once on a fresh connection
+        for attempt in range(2):
+            reused = queue.connection is not None
+            if not reused:
+                queue.connection = httplib.HTTPConnection(url.hostname,
+                                                          url.port or 80,
+                                                          timeout=self.timeout)
+            con = queue.connection
+            try:
+                con.request('NOTIFY', path, body, headers)
+                response = con.getresponse()
+                response.read()
+                if response.will_close:
+                    self._close(queue)
+                log.debug('Event delivered to %s, status %s',
+                          subscriber.delivery_url, response.status)
+                return True
+            except (httplib.HTTPException, socket.error), e:
+                log.debug('Event delivery to %s failed: %s',
+                          subscriber.delivery_url, e)
+                self._close(queue)
+                if not reused:
+                    break
+        return False
+
+    def _close(self, queue):
+        if queue.connection:
+            try:
+                queue.connection.close()
+            except Exception:
+                pass
+            queue.connection = None
+
+
+_delivery_pool = None
+_delivery_pool_lock = threading.Lock()
+
+
+def get_delivery_pool():
+    """ Returns the shared EventDeliveryPool, creating and starting it on the
+    first call. The number of workers and the timeout are read from the
+    brisa section parameters event_delivery_workers and
+    event_delivery_timeout.
+
+    @rtype: EventDeliveryPool
+    """
+    global _delivery_pool
+    _delivery_pool_lock.acquire()
+    try:
+        if _delivery_pool is None:
+            try:
+                workers = int(config.get_parameter('brisa',
+                                                   'event_delivery_workers'))
+                if workers < 1:
+                    workers = 1
+            except:
+                workers = 4
+            try:
+                timeout = float(config.get_parameter('brisa',
+                                                     'event_delivery_timeout'))
+            except:
+                timeout = 30
+            _delivery_pool = EventDeliveryPool(workers, timeout)
+            reactor.add_after_stop_func(_delivery_pool.stop)
+        if not _delivery_pool.is_running():
+            _delivery_pool.start()
+    finally:
+        _delivery_pool_lock.release()
+    return _delivery_pool
 
-        @type error: Exception
 
-        @rtype: boolean
-        """
-        log.debug("error: %s", error)
-        return True
-
-    def response(self, http_response, cargo):
-        """ Callback for receiving the HTTP response on a successful HTTP call.
+class EventMessage:
+    """ Wrapper for an event message. The message is queued on the shared
+    EventDeliveryPool.
+    """
 
-        @param http_response: response object
-        @param cargo: callback parameters passed at construction
+    def __init__(self, subscriber, variables, event_delay, cargo):
+        """ Constructor for the EventMessage class.
 
-        @type http_response: HTTPResponse
+        @param subscriber: subscriber that will receive the message
+        @param variables: variables of the event
+        @param event_delay: delay to wait before sending the event
+        @param cargo: callback parameters
 
-        @rtype: boolean
+        @type subscriber: Subscriber
+        @type variables: dict
+        @type event_delay: float
         """
-        log.debug("response")
-        return True
+        log.debug("event message")
+        self.cargo = cargo
+        get_delivery_pool().deliver(subscriber, variables, event_delay)
 
 
 class MulticastEventController:
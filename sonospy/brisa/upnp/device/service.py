@@ -7,8 +7,9 @@ UPnP services.
 """
 
 from os import path, mkdir
+from time import time
 
-from brisa.core import log, config, failure, webserver
+from brisa.core import log, config, failure, webserver, metrics
  
 from brisa.upnp.base_service import BaseService, BaseStateVariable
 from brisa.upnp.base_service_builder import BaseServiceBuilder
@@ -36,6 +37,28 @@ class StateVariable(BaseStateVariable):
     def __init__(self, service, name, send_events, multicast, data_type, values=[]):
         BaseStateVariable.__init__(self, service, name, send_events,
                                    multicast, data_type, values)
+        self.max_rate = 0
+        self.min_delta = 0
+
+    def set_moderation(self, max_rate=0, min_delta=0):
+        """ Sets moderated eventing for the variable. A value of 0 disables
+        the corresponding moderation.
+
+        @param max_rate: maximum number of events per second
+        @param min_delta: minimum change of a numeric value to be evented
+
+        @type max_rate: float
+        @type min_delta: float
+        """
+        self.max_rate = max_rate
+        self.min_delta = min_delta
+
+    def is_moderated(self):
+        """ Returns True if events for the variable are moderated.
+
+        @rtype: boolean
+        """
+        return bool(self.max_rate or self.min_delta)
 
 
 class ServiceBuilder(BaseServiceBuilder):
@@ -88,7 +111,9 @@ class ServiceController(webserver.CustomResource):
         data = request.read()
         headers = request.headers
 
+        start = time()
         method_name, args, kwargs, ns = soap.parse_soap_call(data)
+        metrics.observe('soap_parse_seconds', time() - start)
         try:
             headers['content-type'].index('text/xml')
         except:
@@ -143,7 +168,10 @@ class ServiceController(webserver.CustomResource):
                 remoteaddress = request.env.get('REMOTE_ADDR', '')
                 newkwargs['Address'] = remoteaddress
             
+        start = time()
         result = function(*args, **newkwargs)
+        metrics.observe('upnp_action_seconds', time() - start,
+                        action=method_name)
 
         ns = self.service_type
         try:
@@ -152,8 +180,11 @@ class ServiceController(webserver.CustomResource):
         except AttributeError, IndexError:
             result = {}
             method = ''
+        start = time()
         response = soap.build_soap_call("{%s}%s" % (ns, method),
                                         result, encoding=None)
+        metrics.observe('soap_build_seconds', time() - start,
+                        action=method_name)
         return self._build_response(request, response, response_obj)
 
     def _build_error(self, failure, request, method_name, response_obj):
@@ -270,6 +301,10 @@ class Service(BaseService):
         state_variable = self._state_variables[name]
         state_variable.update(value)
 
+    def set_variable_moderation(self, name, max_rate=0, min_delta=0):
+        state_variable = self._state_variables[name]
+        state_variable.set_moderation(max_rate, min_delta)
+
     def _set_event_reload_time(self, time):
         self._event_reload_time = time
 
@@ -15,8 +15,12 @@ When used on a control point, it's used for keeping record of known devices
 """
 
 import random
+import threading
+
+from time import time
 
 from brisa.core import log
+from brisa.core.network import parse_http_response
 from brisa.core.network_senders import UDPTransport
 from brisa.core.network_listeners import UDPListener
 
@@ -40,6 +44,12 @@ class SSDPServer(object):
     msg_already_started = 'tried to start() SSDPServer when already started'
     msg_already_stopped = 'tried to stop() SSDPServer when already stopped'
 
+    # Seconds during which repeated ssdp:alive messages for a known USN only
+    # refresh its expiry
+    alive_ttl = 30
+    # Minimum seconds between two M-SEARCH replies to the same source and ST
+    search_reply_interval = 1.0
+
     def __init__(self, server_name, xml_description_filename, max_age=1800,
                 receive_notify=True, udp_listener=''):
         """ Constructor for the SSDPServer class.
@@ -63,6 +73,17 @@ class SSDPServer(object):
         self.known_device = {}
         self.advertised = {}
         self._callbacks = {}
+        # usn: (alive dedupe deadline, announced expiry)
+        self._alive = {}
+        # (host, port, st): time of the last M-SEARCH reply
+        self._search_replies = {}
+        self._tables_lock = threading.Lock()
+        self.counters = {'received': 0,
+                         'malformed': 0,
+                         'unknown': 0,
+                         'notify_ignored': 0,
+                         'alive_merged': 0,
+                         'search_throttled': 0}
         self.udp_transport = UDPTransport()
         if udp_listener == '':
             self.udp_listener = UDPListener(SSDP_ADDR, SSDP_PORT,
@@ -118,6 +139,7 @@ class SSDPServer(object):
         """ Clears the device list.
         """
         self.known_device.clear()
+        self._alive.clear()
 
     def discovered_device_failed(self, dev):
         """ Device could not be fully built, so forget it.
@@ -125,6 +147,31 @@ class SSDPServer(object):
         usn = dev['USN']
         if usn in self.known_device:
             self.known_device.pop(usn)
+        self._alive.pop(usn, None)
+
+    def get_counters(self):
+        """ Returns a copy of the datagram counters: received, malformed,
+        unknown, notify_ignored, alive_merged (repeated ssdp:alive absorbed by
+        the USN table) and search_throttled (M-SEARCH replies dropped by the
+        per source rate limit).
+
+        @rtype: dict
+        """
+        return dict(self.counters)
+
+    def get_expiry(self, usn):
+        """ Returns the time at which the last ssdp:alive for the usn
+        expires according to its CACHE-CONTROL, or None if unknown.
+
+        @param usn: device or service usn
+        @type usn: string
+
+        @rtype: float
+        """
+        entry = self._alive.get(usn, None)
+        if entry:
+            return entry[1]
+        return None
 
     def is_known_device(self, usn):
         """ Returns if the device with the passed usn is already known.
@@ -191,41 +238,112 @@ class SSDPServer(object):
         @type host: string
         @type port: integer
         """
-        log.debug("SSDP._datagram_received host: %s, port: %s\ndata: %s", host, port, data)
+        self.counters['received'] += 1
         try:
-            header, payload = data.split('\r\n\r\n')
-        except ValueError, err:
+            cmd, headers = parse_http_response(data)
+            method, target = cmd[0], cmd[1]
+        except (ValueError, IndexError), err:
+            self.counters['malformed'] += 1
             log.error('Error while receiving datagram packet: %s', str(err))
             return
 
-        lines = header.split('\r\n')
-        cmd = lines[0].split(' ')
-        lines = map(lambda x: x.replace(': ', ':', 1), lines[1:])
-        lines = filter(lambda x: len(x) > 0, lines)
-
-        headers = [x.split(':', 1) for x in lines]
-        headers = dict(map(lambda x: (x[0].lower(), x[1]), headers))
-
-        if cmd[0] == 'M-SEARCH' and cmd[1] == '*':
-#        if cmd[0] == 'M-SEARCH' and cmd[1] == '*' \
-#	        and headers['man'] == '"ssdp:discover"':
-            # SSDP discovery
-            log.debug('Received M-Search command from %s:%s', host, port)
-            self._discovery_request(headers, (host, port))
-        elif cmd[0] == 'NOTIFY' and cmd[1] == '*':
-            log.debug("NOTIFY receive_notify: %s", self.receive_notify)
+        if method == 'NOTIFY' and target == '*':
             if not self.receive_notify:
                 # Ignore notify
-                log.debug('Received NOTIFY command from %s:%s (ignored '\
-                          'because of SSDPServer.receive_notify is False)',
-                          host, port)
+                self.counters['notify_ignored'] += 1
                 return
+            if headers.get('nts', None) == 'ssdp:alive' and \
+               self._refresh_alive(headers):
+                # Repeated announcement of a known usn
+                return
+            log.debug('Received NOTIFY %s from %s:%s', headers.get('usn', ''),
+                      host, port)
             # SSDP presence
-            self._notify_received(headers, (host, port))
+            try:
+                self._notify_received(headers, (host, port))
+            except KeyError, err:
+                self.counters['malformed'] += 1
+                log.debug('NOTIFY from %s:%s without %s header', host, port,
+                          err)
+        elif method == 'M-SEARCH' and target == '*':
+#        if cmd[0] == 'M-SEARCH' and cmd[1] == '*' \
+#	        and headers['man'] == '"ssdp:discover"':
+            # SSDP discovery
+            if not self._search_reply_allowed(headers.get('st', ''),
+                                              (host, port)):
+                self.counters['search_throttled'] += 1
+                return
+            log.debug('Received M-Search command from %s:%s', host, port)
+            try:
+                self._discovery_request(headers, (host, port))
+            except KeyError, err:
+                self.counters['malformed'] += 1
+                log.debug('M-SEARCH from %s:%s without %s header', host, port,
+                          err)
         else:
+            self.counters['unknown'] += 1
             log.warning('Received unknown SSDP command %s with headers %s '\
                         'from %s:%s', cmd, str(headers), host, port)
 
+    def _refresh_alive(self, headers):
+        """ Fast path for ssdp:alive messages. If the usn was announced less
+        than alive_ttl seconds ago and is still known, only its expiry is
+        refreshed.
+
+        @return: True if the message was absorbed, False if it must be
+                 processed
+        @rtype: boolean
+        """
+        usn = headers.get('usn', None)
+        if not usn:
+            return False
+        now = time()
+        expiry = now + self._get_max_age(headers.get('cache-control', ''))
+        self._tables_lock.acquire()
+        try:
+            entry = self._alive.get(usn, None)
+            self._alive[usn] = (now + self.alive_ttl, expiry)
+            if entry and entry[0] > now and usn in self.known_device:
+                self.counters['alive_merged'] += 1
+                return True
+            return False
+        finally:
+            self._tables_lock.release()
+
+    def _get_max_age(self, cache_control):
+        """ Returns the max-age of a CACHE-CONTROL header value, defaulting to
+        1800 seconds.
+        """
+        for directive in cache_control.split(','):
+            name, sep, value = directive.partition('=')
+            if sep and name.strip().lower() == 'max-age':
+                try:
+                    return int(value.strip())
+                except ValueError:
+                    break
+        return 1800
+
+    def _search_reply_allowed(self, st, (host, port)):
+        """ Rate limits M-SEARCH replies so that at most one reply per
+        search_reply_interval is sent to the same source and search target.
+        Control points commonly send each M-SEARCH several times.
+        """
+        now = time()
+        key = (host, port, st)
+        self._tables_lock.acquire()
+        try:
+            last = self._search_replies.get(key, 0)
+            if now - last < self.search_reply_interval:
+                return False
+            if len(self._search_replies) > 256:
+                for k, t in self._search_replies.items():
+                    if now - t >= self.search_reply_interval:
+                        del self._search_replies[k]
+            self._search_replies[key] = now
+            return True
+        finally:
+            self._tables_lock.release()
+
     def _discovery_request(self, headers, (host, port)):
         """ Processes discovery requests and responds accordingly.
 
@@ -299,8 +417,11 @@ class SSDPServer(object):
             except KeyError:
                 self._register(headers['usn'], headers['nt'],
                                headers['location'], headers['server'],
-                               headers['cache-control'])
+                               headers['cache-control'],
+                               bootid=headers.get('bootid.upnp.org', ''),
+                               configid=headers.get('configid.upnp.org', ''))
         elif headers['nts'] == 'ssdp:byebye':
+            self._alive.pop(headers['usn'], None)
             if self.is_known_device(headers['usn']):
                 self._unregister(headers['usn'])
         else:
@@ -310,7 +431,7 @@ class SSDPServer(object):
     # Registering
 
     def _register(self, usn, st, location, server, cache_control,
-                  where='remote'):
+                  where='remote', bootid='', configid=''):
         """ Registers a service or device.
 
         @param usn: usn
@@ -318,12 +439,16 @@ class SSDPServer(object):
         @param location: location
         @param server: server
         @param cache_control: cache control
+        @param bootid: BOOTID.UPNP.ORG header (UPnP 1.1), if announced
+        @param configid: CONFIGID.UPNP.ORG header (UPnP 1.1), if announced
 
         @type usn: string
         @type location: string
         @type st: string
         @type server: string
         @type cache_control: string
+        @type bootid: string
+        @type configid: string
 
         @note: these parameters are part of the UPnP Specification. Even though
         they're abstracted by the framework (devices and services messages
@@ -345,6 +470,10 @@ class SSDPServer(object):
                   'EXT': '',
                   'SERVER': server,
                   'CACHE-CONTROL': cache_control}
+        if bootid:
+            d[usn]['BOOTID.UPNP.ORG'] = bootid
+        if configid:
+            d[usn]['CONFIGID.UPNP.ORG'] = configid
 
         if st == 'upnp:rootdevice' and where == 'remote':
         
@@ -403,6 +532,7 @@ class SSDPServer(object):
 
     def _unregister(self, usn):
         log.debug("Unregistering %s", usn)
+        self._alive.pop(usn, None)
 
         try:
             self._callback("removed_device_event", self.known_device[usn])
@@ -1,8 +1,17 @@
 import os
+import time
+import threading
 from brisa.core import webserver
 from brisa.core import log
 from xml.sax.saxutils import unescape
 
+try:
+    import json
+except ImportError:
+    json = None
+
+data_delim = '_|_'
+
 unescape_entities = {
                    '%20'   : " ",
                    '%21'   : "!",
@@ -46,7 +55,7 @@ class ListDataController(webserver.CustomResource):
 
     def render(self, uri, request, response):
         response.status = 200
-        response.body = make_utf8(self.data)
+        response.body = make_body(self.data, request, response)
         return response.body
 
 class GetDataController(webserver.CustomResource):
@@ -62,7 +71,7 @@ class GetDataController(webserver.CustomResource):
 #        print "data: " + str(self.data)
         query = unescape(request.query, unescape_entities)
         self.data = self.getter(query)
-        response.body = make_utf8(self.data)
+        response.body = make_body(self.data, request, response)
         response.status = 200
         return response.body
 
@@ -89,7 +98,7 @@ class GetDeviceController(webserver.CustomResource):
 
     def render(self, uri, request, response):
         response.status = 200
-        response.body = make_utf8(self.data)
+        response.body = make_body(self.data, request, response)
         return response.body
 
 class SetRendererController(webserver.CustomResource):
@@ -104,7 +113,7 @@ class SetRendererController(webserver.CustomResource):
         query = unescape(request.query, unescape_entities)
         self.data = self.setter(query)
         response.status = 200
-        response.body = make_utf8(self.data)
+        response.body = make_body(self.data, request, response)
         return response.body
 
 class PollRendererController(webserver.CustomResource):
@@ -118,7 +127,7 @@ class PollRendererController(webserver.CustomResource):
 #        print "request.query: " + str(request.query)
         query = unescape(request.query, unescape_entities)
         self.data = self.getter(query)
-        response.body = make_utf8(self.data)
+        response.body = make_body(self.data, request, response)
         response.status = 200
         return response.body
 
@@ -134,7 +143,7 @@ class ActionRendererController(webserver.CustomResource):
         query = unescape(request.query, unescape_entities)
         self.data = self.setter(query)
         response.status = 200
-        response.body = make_utf8(self.data)
+        response.body = make_body(self.data, request, response)
         return response.body
 
 class PollServerController(webserver.CustomResource):
@@ -148,7 +157,7 @@ class PollServerController(webserver.CustomResource):
 #        print "request.query: " + str(request.query)
         query = unescape(request.query, unescape_entities)
         self.data = self.getter(query)
-        response.body = make_utf8(self.data)
+        response.body = make_body(self.data, request, response)
         response.status = 200
         return response.body
 
@@ -163,10 +172,130 @@ class PollQueueController(webserver.CustomResource):
 #        print "request.query: " + str(request.query)
         query = unescape(request.query, unescape_entities)
         self.data = self.getter(query)
-        response.body = make_utf8(self.data)
+        response.body = make_body(self.data, request, response)
+        response.status = 200
+        return response.body
+
+class StateChannel(object):
+    """ Versioned key/value state that long-poll clients wait on.
+
+    Every update that changes at least one value increments the version and
+    wakes the waiting clients, who get only the values changed since the
+    version they pass back. Versions are prefixed with an epoch so a client
+    that resumes against a restarted control point gets the full state.
+    """
+
+    def __init__(self):
+        self.epoch = '%x' % int(time.time())
+        self.version = 0
+        self.values = {}
+        self.changed = {}
+        self.waiters = 0
+        self.last_wait = 0
+        self._cond = threading.Condition()
+
+    def get_token(self):
+        return '%s.%d' % (self.epoch, self.version)
+
+    def update(self, values):
+        """ Sets the values passed, bumping the version if any changed.
+        """
+        self._cond.acquire()
+        try:
+            changed = [k for k, v in values.iteritems()
+                       if self.values.get(k, None) != v]
+            if not changed:
+                return
+            self.version += 1
+            for k in changed:
+                self.values[k] = values[k]
+                self.changed[k] = self.version
+            self._cond.notifyAll()
+        finally:
+            self._cond.release()
+
+    def is_watched(self, within=30):
+        """ Returns True if a client is waiting or waited in the last
+        'within' seconds.
+        """
+        return self.waiters > 0 or time.time() - self.last_wait < within
+
+    def wait(self, token, timeout):
+        """ Waits up to timeout seconds for a version newer than token.
+        Returns (token, changes) where changes is a dict of the values
+        changed since token, empty on timeout.
+        """
+        since = 0
+        if token:
+            epoch, sep, version = token.partition('.')
+            if epoch == self.epoch and version.isdigit():
+                since = int(version)
+        self._cond.acquire()
+        try:
+            if since > self.version:
+                since = 0
+            self.waiters += 1
+            try:
+                deadline = time.time() + timeout
+                while self.version <= since:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+            finally:
+                self.waiters -= 1
+                self.last_wait = time.time()
+            changes = dict([(k, self.values[k])
+                            for k, v in self.changed.iteritems() if v > since])
+            return self.get_token(), changes
+        finally:
+            self._cond.release()
+
+class PushController(webserver.CustomResource):
+    """ Long-poll resource for a StateChannel. Query is data=TOKEN, the
+    response is VERSION::TOKEN followed by the changed entries. Requests
+    above max_waiters are answered immediately so that waiting clients
+    can't take all the webserver threads - if nothing has changed the
+    response also contains BUSY::SECONDS, asking the client to wait that
+    long before polling again.
+    """
+
+    def __init__(self, channel, name, timeout=10, max_waiters=4, retry=2):
+        self.channel = channel
+        self.timeout = timeout
+        self.max_waiters = max_waiters
+        self.retry = retry
+        webserver.CustomResource.__init__(self, name)
+
+    def render(self, uri, request, response):
+        token = request.params.get('data', '')
+        busy = self.channel.waiters >= self.max_waiters
+        if busy:
+            token, changes = self.channel.wait(token, 0)
+        else:
+            token, changes = self.channel.wait(token, self.timeout)
+        data = ['VERSION::' + token + data_delim]
+        if busy and not changes:
+            data.append('BUSY::' + str(self.retry) + data_delim)
+        for k, v in changes.iteritems():
+            data.append(k + '::' + v + data_delim)
+        response.body = make_body(data, request, response)
         response.status = 200
         return response.body
 
+def make_body(data, request, response):
+    # clients that accept JSON get the entries as a JSON list of strings
+    # (without delimiters), others get the delimited UTF-8 list
+    if json == None or 'application/json' not in request.headers.get('accept', ''):
+        return make_utf8(data)
+    entries = ''.join(make_utf8(data)).split(data_delim)
+    if entries[-1] == '':
+        entries.pop()
+    body = json.dumps(entries)
+    response.headers['Content-type'] = 'application/json'
+    response.headers['Content-length'] = str(len(body))
+    return body
+
 def make_utf8(list):
     dt = []
     for e in list:
@@ -24,8 +24,8 @@
 # Author: Mark Henkelis <mark.henkelis@tesco.net>
 
 import brisa
-from brisa.core.reactors import SelectReactor
-reactor = SelectReactor()
+from brisa.core.reactors import install_default_reactor
+reactor = install_default_reactor()
 from brisa.core import log
 from brisa.core.log import modcheck
 from brisa.core import webserver
@@ -40,7 +40,7 @@ import mutagen
 from mutagen import File
 from mutagen.asf import ASFUnicodeAttribute     # seems to be an issue with multiple tag entries in wma files
 
-from scanfuncs import adjust_tracknumber, truncate_number
+from scanfuncs import adjust_tracknumber, truncate_number, walk, WalkCycleError
 import filelog
 
 from movetags import empty_database
@@ -113,6 +113,16 @@ except ConfigParser.NoSectionError:
 except ConfigParser.NoOptionError:
     pass
 
+# art content hashing - identical covers in different folders/files share an art id
+art_content_hash = 'n'
+try:        
+    art_content_hash = config.get('gettags', 'art_content_hash')
+    art_content_hash = art_content_hash.lower()
+except ConfigParser.NoSectionError:
+    pass
+except ConfigParser.NoOptionError:
+    pass
+
 # blank tag processing
 ignore_blank_tags = 'n'
 try:        
@@ -269,29 +279,27 @@ def process_dir(scanpath, options, database):
     logstring = "Scannumber: %d" % scannumber
     filelog.write_log(logstring)
 
+    load_art_ids(c)
+
     processing_count = 1
 
     # process tags first
 
-    visitedpaths = []
-    for filepath, dirs, files in os.walk(scanpath, followlinks=follow_symlinks):
+    # works/virtuals and playlists found by the walk, for processing after the tracks
+    workvirtual_dirs = []
+    playlist_dirs = []
+    for filepath, dirs, files in walk_scanpath(scanpath, options):
 
         filepath = os.path.abspath(os.path.realpath(filepath))
-        if follow_symlinks:
-            if filepath in visitedpaths:
-                errorstring = "Path already visited, check symlinks: %s" % filepath
-                filelog.write_error(errorstring)
-                exit(1)
-            visitedpaths.append(filepath)
 
         if type(filepath) == 'str': filepath = filepath.decode(enc, 'replace')
         if type(dirs) == 'str': dirs = [d.decode(enc, 'replace') for d in dirs]
         if type(files) == 'str': files = [f.decode(enc, 'replace') for f in files]
 
-        if options.exclude:
-            for ex in options.exclude:
-                if ex in filepath:
-                    continue
+        wvfiles = [fn for fn in files if os.path.splitext(fn)[1].lower() in work_virtual_extensions]
+        if wvfiles: workvirtual_dirs.append((filepath, [], wvfiles))
+        plfiles = [fn for fn in files if os.path.splitext(fn)[1].lower() in playlist_extensions]
+        if plfiles: playlist_dirs.append((filepath, [], plfiles))
 
         # check for any .tags files found and expand them
         tagfiles = []
@@ -645,7 +653,8 @@ def process_dir(scanpath, options, database):
                     else:
                 
                         try:
-                            kind = File(ffn, easy=True)
+                            # embedded art is only located, not read
+                            kind = File(ffn, easy=True, skip_pictures=True)
                         except Exception:
                             # note - Mutagen raises exceptions as various types, including Exception
                             #        but we shouldn't really use Exception as the lowest common denominator here
@@ -656,7 +665,7 @@ def process_dir(scanpath, options, database):
                             continue
                             
                         if isinstance(kind, mutagen.flac.FLAC):
-                            if len(kind.pictures) > 0:
+                            if kind.picture_offsets:
                                 trackart_offset, trackart_length = kind.find_picture_offset()
                                 trackart = 'EMBEDDED_%s,%s' % (trackart_offset, trackart_length)
                             if kind.tags:
@@ -784,8 +793,8 @@ def process_dir(scanpath, options, database):
                         trackartid = None
                         if trackart:
                             trackspec = os.path.join(path, filename)
+                            trackartid = str(get_art_id(c, trackspec, trackart))
                             trackart = '%s_%s' % (trackart, trackspec)         
-                            trackartid = str(get_art_id(c, trackspec))
                         bitrate = tags.get('bitrate', '')
                         bitspersample = tags.get('bits_per_sample', '')
                         channels = tags.get('channels', '')
@@ -1176,26 +1185,14 @@ def process_dir(scanpath, options, database):
     db.commit()
 
     # now process works and virtuals - processing the generator first
-    visitedpaths = []
-    for filepath, dirs, files in itertools.chain(workvirtual_updates, os.walk(scanpath, followlinks=follow_symlinks)):
+    for filepath, dirs, files in itertools.chain(workvirtual_updates, workvirtual_dirs):
 
         filepath = os.path.abspath(os.path.realpath(filepath))
-        if follow_symlinks:
-            if filepath in visitedpaths:
-                errorstring = "Path already visited, check symlinks: %s" % filepath
-                filelog.write_error(errorstring)
-                exit(1)
-            visitedpaths.append(filepath)
 
         if type(filepath) == 'str': filepath = filepath.decode(enc, 'replace')
         if type(dirs) == 'str': dirs = [d.decode(enc, 'replace') for d in dirs]
         if type(files) == 'str': files = [f.decode(enc, 'replace') for f in files]
 
-        if options.exclude:
-            for ex in options.exclude:
-                if ex in filepath:
-                    continue
-        
 #        print "**** FILEPATH: %s" % filepath
         
         files.sort()
@@ -1609,26 +1606,14 @@ def process_dir(scanpath, options, database):
     db.commit()
 
     # now process playlists - processing the generator first
-    visitedpaths = []
-    for filepath, dirs, files in itertools.chain(playlist_updates, os.walk(scanpath, followlinks=follow_symlinks)):
+    for filepath, dirs, files in itertools.chain(playlist_updates, playlist_dirs):
 
         filepath = os.path.abspath(os.path.realpath(filepath))
-        if follow_symlinks:
-            if filepath in visitedpaths:
-                errorstring = "Path already visited, check symlinks: %s" % filepath
-                filelog.write_error(errorstring)
-                exit(1)
-            visitedpaths.append(filepath)
 
         if type(filepath) == 'str': filepath = filepath.decode(enc, 'replace')
         if type(dirs) == 'str': dirs = [d.decode(enc, 'replace') for d in dirs]
         if type(files) == 'str': files = [f.decode(enc, 'replace') for f in files]
         
-        if options.exclude:
-            for ex in options.exclude:
-                if ex in filepath:
-                    continue
-        
         files.sort()
 
         for fn in files:
@@ -1974,11 +1959,72 @@ def process_dir(scanpath, options, database):
     c.close()
     c2.close()
 
-def get_art_id(c, artspec):
+# art ids by artpath, and for art_content_hash the hash, file stamp and art id
+# recorded for each hashed artpath and the art id for each hash - loaded at the
+# start of a scan
+art_ids = {}
+art_hashes = {}
+art_hash_ids = {}
+art_paths = {}
+art_checked = {}
+
+def load_art_ids(c):
+
+    # every track in a folder shares the folder art, so keep the art table in memory for the scan
+    art_ids.clear()
+    art_hashes.clear()
+    art_hash_ids.clear()
+    art_paths.clear()
+    art_checked.clear()
+    try:
+        c.execute("""select id, artpath from art""")
+        for artid, artpath in c.fetchall():
+            art_ids[artpath] = artid
+            art_paths[artid] = artpath
+        if art_content_hash == 'y':
+            c.execute("""select artpath, arthash, mtime, size, id from arthashes""")
+            for artpath, arthash, mtime, size, artid in c.fetchall():
+                art_hashes[artpath] = (arthash, (mtime, size), artid)
+                if art_paths.get(artid, None) == artpath:
+                    art_hash_ids[arthash] = artid
+    except sqlite3.Error, e:
+        errorstring = "Error loading art: %s" % e.args[0]
+        filelog.write_error(errorstring)
+
+def walk_scanpath(scanpath, options=None):
+
+    # walk scanpath for the scan, skipping excluded folders and stopping on a symlink loop
+    exclude = None
+    if options: exclude = options.exclude
+    try:
+        for entry in walk(scanpath, followlinks=follow_symlinks, exclude=exclude):
+            yield entry
+    except WalkCycleError, e:
+        errorstring = "Path already visited, check symlinks: %s" % e.args[0]
+        filelog.write_error(errorstring)
+        exit(1)
+
+def get_art_id(c, artspec, trackart=None):
 
     # get unique id for album art
-    artid = None
+    # trackart is the EMBEDDED_ offsets if the art is embedded in artspec
+    if art_content_hash == 'y':
+        return get_hashed_art_id(c, artspec, trackart)
+    artid = art_ids.get(artspec, None)
+    if artid != None:
+        return artid
     try:
+        artid = insert_art(c, artspec)
+    except sqlite3.Error, e:
+        errorstring = "Error checking/inserting art: %s" % e.args[0]
+        filelog.write_error(errorstring)
+    return artid
+
+def insert_art(c, artspec):
+
+    # returns the art id of artspec, creating it if needed
+    artid = art_ids.get(artspec, None)
+    if artid == None:
         c.execute("""select id, artpath from art where artpath=?""",
                     (artspec, ))
         row = c.fetchone()
@@ -1987,16 +2033,96 @@ def get_art_id(c, artspec):
         else:
             c.execute('''insert into art values (?,?)''', (None, artspec))
             artid = c.lastrowid
+        art_ids[artspec] = artid
+        art_paths[artid] = artspec
+    return artid
+
+def get_hashed_art_id(c, artspec, trackart=None):
+
+    # get art id for art_content_hash - art with the same content as other
+    # art shares its id, as long as the art the id serves is unchanged
+    artid = art_checked.get(artspec, None)
+    if artid != None:
+        return artid
+    try:
+        stamp = get_art_stamp(artspec)
+        entry = art_hashes.get(artspec, None)
+        if entry and entry[1] == stamp and art_hash_current(entry[2], entry[0]):
+            # unchanged since it was hashed
+            artid = entry[2]
+        else:
+            arthash = get_art_hash(artspec, trackart)
+            if arthash:
+                artid = art_hash_ids.get(arthash, None)
+                if artid != None and not art_hash_current(artid, arthash):
+                    artid = None
+            if artid == None:
+                # no (unchanged) art with this content, use the id of this path
+                artid = insert_art(c, artspec)
+                if arthash and art_paths.get(artid, None) == artspec:
+                    art_hash_ids[arthash] = artid
+            if arthash:
+                c.execute('''insert or replace into arthashes values (?,?,?,?,?)''',
+                            (artspec, arthash, stamp[0], stamp[1], artid))
+                art_hashes[artspec] = (arthash, stamp, artid)
+            else:
+                c.execute('''delete from arthashes where artpath=?''', (artspec, ))
+                art_hashes.pop(artspec, None)
+        art_checked[artspec] = artid
     except sqlite3.Error, e:
         errorstring = "Error checking/inserting art: %s" % e.args[0]
         filelog.write_error(errorstring)
     return artid
 
+def art_hash_current(artid, arthash):
+
+    # returns True if the file the art id serves still has content arthash
+    artpath = art_paths.get(artid, None)
+    if artpath == None:
+        return False
+    entry = art_hashes.get(artpath, None)
+    if not entry or entry[0] != arthash:
+        return False
+    return entry[1] == get_art_stamp(artpath)
+
+def get_art_stamp(artspec):
+
+    # returns (mtime, size) of artspec, used to tell whether its art needs hashing again
+    try:
+        st = os.stat(artspec)
+        return (int(st.st_mtime), st.st_size)
+    except OSError:
+        return (None, None)
+
+def get_art_hash(artspec, trackart=None):
+
+    # returns the md5 of the art in artspec (for embedded art the
+    # sections of the file in trackart), or None if it can't be read
+    try:
+        f = open(artspec, 'rb')
+        try:
+            if not trackart:
+                return hashlib.md5(f.read()).hexdigest()
+            offsets = trackart[len('EMBEDDED_'):].split(',')
+            if len(offsets) % 2:
+                # encoding type
+                offsets.pop()
+            m = hashlib.md5()
+            for i in xrange(0, len(offsets), 2):
+                f.seek(int(offsets[i]))
+                m.update(f.read(int(offsets[i+1])))
+            return m.hexdigest()
+        finally:
+            f.close()
+    except (IOError, OSError, ValueError):
+        return None
+
 def get_workvirtual_update(scannumber):
 
     # get tag records that have been changed and find all associated workvirtuals
     try:
-        statement = """select distinct(wvfile) from workvirtuals where trackfile in (select distinct(path || "%s" || filename) from tags_update where scannumber=?)""" % (os.sep)
+        # tags_update rows for the scan are found by scannumber, then each trackfile by inxWorkvirtualTrackfile
+        statement = """select distinct(w.wvfile) from tags_update u join workvirtuals w on w.trackfile = u.path || "%s" || u.filename where u.scannumber=?""" % (os.sep)
         c.execute(statement, (scannumber, ))
         for crow in c:
             wvfile, = crow
@@ -2011,7 +2137,8 @@ def get_playlist_update(scannumber):
 
     # get tag records that have been changed and find all associated playlists
     try:
-        statement = """select distinct(plfile) from playlists where trackfile in (select distinct(path || "%s" || filename) from tags_update where scannumber=?)""" % (os.sep)
+        # tags_update rows for the scan are found by scannumber, then each trackfile by inxPlaylistTrackfile
+        statement = """select distinct(p.plfile) from tags_update u join playlists p on p.trackfile = u.path || "%s" || u.filename where u.scannumber=?""" % (os.sep)
         c.execute(statement, (scannumber, ))
         for crow in c:
             plfile, = crow
@@ -2434,16 +2561,9 @@ def generate_workvirtualfile_record(filespec, database):
     directory = os.path.isdir(filespec)
     if directory:
     
-        visitedpaths = []
-        for filepath, dirs, files in os.walk(filespec, followlinks=follow_symlinks):
+        for filepath, dirs, files in walk_scanpath(filespec):
 
             filepath = os.path.abspath(os.path.realpath(filepath))
-            if follow_symlinks:
-                if filepath in visitedpaths:
-                    errorstring = "Path already visited, check symlinks: %s" % filepath
-                    filelog.write_error(errorstring)
-                    exit(1)
-                visitedpaths.append(filepath)
 
             if type(filepath) == 'str': filepath = filepath.decode(enc, 'replace')
             if type(dirs) == 'str': dirs = [d.decode(enc, 'replace') for d in dirs]
@@ -2657,6 +2777,13 @@ def create_database(database):
                       ''')
             c.execute('''create unique index inxArt on art (id)''')
             c.execute('''create unique index inxArtArtpath on art (artpath)''')
+
+        # arthashes - content hash, file stamp and art id of each hashed artpath (art_content_hash)
+        c.execute('SELECT count(*) FROM sqlite_master WHERE type="table" AND name="arthashes"')
+        n, = c.fetchone()
+        if n == 0:
+            c.execute('''create table arthashes (artpath text, arthash text, mtime integer, size integer, id integer)''')
+            c.execute('''create unique index inxArthashesArtpath on arthashes (artpath)''')
     
         # tags - contain all detail from tags
         c.execute('SELECT count(*) FROM sqlite_master WHERE type="table" AND name="tags"')
@@ -2681,6 +2808,8 @@ def create_database(database):
             c.execute('''create unique index inxTagsPathFile on tags (path, filename)''')
             c.execute('''create unique index inxTags on tags (id)''')
             c.execute('''create index inxTagsScannumber on tags (scannumber)''')
+        # duplicate lookup (ignore_duplicate_tracks) - added after the table, so may be missing
+        c.execute('''create index if not exists inxTagsDuplicate on tags (title collate nocase, album collate nocase, artist collate nocase, track)''')
 
         # tags_update - pre and post data from tags around an update
         c.execute('SELECT count(*) FROM sqlite_master WHERE type="table" AND name="tags_update"')
@@ -2731,6 +2860,8 @@ def create_database(database):
                       ''')
             c.execute('''create unique index inxWorkvirtualFile on workvirtuals (title, wvfile, plfile, trackfile, occurs)''')
             c.execute('''create index inxWorkvirtualScannumber on workvirtuals (scannumber)''')
+        # track change propagation (get_workvirtual_update) - added after the table, so may be missing
+        c.execute('''create index if not exists inxWorkvirtualTrackfile on workvirtuals (trackfile, wvfile)''')
 
         # workvirtuals_update - pre and post data from workvirtuals around an update
         c.execute('SELECT count(*) FROM sqlite_master WHERE type="table" AND name="workvirtuals_update"')
@@ -2776,6 +2907,8 @@ def create_database(database):
 #            c.execute('''create index inxPlaylistFiles on playlists (plfile)''')
             c.execute('''create index inxPlaylistIDs on playlists (id)''')
             c.execute('''create index inxPlaylistsScannumber on playlists (scannumber)''')
+        # track change propagation (get_playlist_update) - added after the table, so may be missing
+        c.execute('''create index if not exists inxPlaylistTrackfile on playlists (trackfile, plfile)''')
             
         # playlists_update - pre and post data from playlists around an update
         c.execute('SELECT count(*) FROM sqlite_master WHERE type="table" AND name="playlists_update"')
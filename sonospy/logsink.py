@@ -0,0 +1,158 @@
+# Buffered log file written by a background thread.
+#
+# Callers only queue the message - formatting, writing, fsync and rotation
+# all happen on the writer thread. A disabled sink drops messages before
+# they are formatted.
+
+import os
+import sys
+import time
+import Queue
+import threading
+
+enc = sys.getfilesystemencoding()
+
+_STOP = object()
+
+
+class LogSink(object):
+
+    def __init__(self, filename, enabled=True, echo=False, max_bytes=0,
+                 rotate_interval=0, backups=5, fsync_interval=5.0,
+                 on_write=None):
+        # max_bytes/rotate_interval of 0 disable size/time based rotation,
+        # on_write is called on the writer thread after each batch
+        self.filename = filename
+        self.enabled = enabled
+        self.echo = echo
+        self.max_bytes = max_bytes
+        self.rotate_interval = rotate_interval
+        self.backups = backups
+        self.fsync_interval = fsync_interval
+        self.on_write = on_write
+        self.dropped = 0
+        self._queue = Queue.Queue()
+        self._file = None
+        self._opened = 0
+        self._synced = time.time()
+        self._dirty = False
+        self._thread = threading.Thread(target=self._run, name='logsink')
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def write(self, fmt, *args):
+        # queues fmt % args, the arguments should not be changed after the
+        # call as they are formatted later on the writer thread
+        if not self.enabled:
+            return
+        self._queue.put((fmt, args))
+
+    def close(self):
+        # writes out everything queued so far and stops the writer
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=self.fsync_interval)
+            except Queue.Empty:
+                self._sync()
+                continue
+            batch = [item]
+            # take whatever else is already queued as one write
+            while len(batch) < 1000:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except Queue.Empty:
+                    break
+            stop = False
+            lines = []
+            for item in batch:
+                if item is _STOP:
+                    stop = True
+                    continue
+                fmt, args = item
+                try:
+                    if args:
+                        line = fmt % args
+                    else:
+                        line = fmt
+                    if isinstance(line, unicode):
+                        line = line.encode(enc, 'replace')
+                except Exception, e:
+                    line = 'log format error: %r %s\n' % (fmt, e)
+                lines.append(line)
+            if lines:
+                self._write(''.join(lines))
+            if stop:
+                self._sync()
+                if self._file != None:
+                    self._file.close()
+                    self._file = None
+                return
+
+    def _write(self, data):
+        try:
+            self._check_rotate(len(data))
+            if self._file == None:
+                self._file = open(self.filename, 'a')
+                self._opened = time.time()
+            self._file.write(data)
+            self._file.flush()
+            self._dirty = True
+        except (IOError, OSError), e:
+            self.dropped += 1
+            print "logsink: could not write %s: %s" % (self.filename, e)
+        if self.echo:
+            sys.stdout.write(data)
+        if time.time() - self._synced >= self.fsync_interval:
+            self._sync()
+        if self.on_write != None:
+            try:
+                self.on_write()
+            except Exception, e:
+                print "logsink: error after writing %s: %s" % (self.filename, e)
+
+    def _sync(self):
+        self._synced = time.time()
+        if self._file == None or not self._dirty:
+            return
+        try:
+            os.fsync(self._file.fileno())
+        except (IOError, OSError):
+            pass
+        self._dirty = False
+
+    def _check_rotate(self, size):
+        if self._file == None:
+            if not os.path.exists(self.filename):
+                return
+            # only size applies to a file from a previous run
+            current = os.path.getsize(self.filename)
+            started = time.time()
+        else:
+            current = self._file.tell()
+            started = self._opened
+        rotate = (self.max_bytes and current and current + size > self.max_bytes) or \
+                 (self.rotate_interval and current and time.time() - started > self.rotate_interval)
+        if not rotate:
+            return
+        if self._file != None:
+            self._sync()
+            self._file.close()
+            self._file = None
+        for n in range(self.backups - 1, 0, -1):
+            older = '%s.%d' % (self.filename, n)
+            if os.path.exists(older):
+                newer = '%s.%d' % (self.filename, n + 1)
+                if os.path.exists(newer):
+                    os.remove(newer)
+                os.rename(older, newer)
+        if self.backups:
+            backup = self.filename + '.1'
+            if os.path.exists(backup):
+                os.remove(backup)
+            os.rename(self.filename, backup)
+        else:
+            os.remove(self.filename)
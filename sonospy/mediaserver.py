@@ -30,11 +30,13 @@ import operator
 import datetime
 import string
 import copy
+import cPickle
+import hashlib
 from operator import itemgetter
-from numbers import Number
 
 from brisa.core import log
 from brisa.core import webserver
+from brisa.core import metrics
 from brisa.utils.looping_call import LoopingCall
 
 from transcode import checktranscode, checksmapitranscode, checkstream
@@ -48,6 +50,9 @@ enc = sys.getfilesystemencoding()
 
 MULTI_SEPARATOR = '\n'
 
+# marks an entry prefix/suffix field with no value
+EMPTY_ENTRY = '__EMPTY__'
+
 DEFAULTYEAR = 1
 DEFAULTMONTH = 1
 DEFAULTDAY = 1
@@ -55,8 +60,89 @@ DEFAULTDATE = datetime.datetime(DEFAULTYEAR, DEFAULTMONTH, DEFAULTDAY)
 
 DEFAULTINDEX_INI = 'defaultindex.ini'
 USERINDEX_INI = 'userindex.ini'
+
+# change when what load_indexes sets changes, so cached index plans are rebuilt
+INDEX_PLAN_VERSION = 1
 PYCPOINT_INI = 'pycpoint.ini'
 
+# sqlite connection and cursor that record the time spent in execute and
+# fetch calls in the sql_seconds histogram (iterating a cursor is not timed)
+
+class TimedCursor(sqlite3.Cursor):
+
+    def execute(self, *args):
+        start = time.time()
+        try:
+            return sqlite3.Cursor.execute(self, *args)
+        finally:
+            metrics.observe('sql_seconds', time.time() - start)
+
+    def executemany(self, *args):
+        start = time.time()
+        try:
+            return sqlite3.Cursor.executemany(self, *args)
+        finally:
+            metrics.observe('sql_seconds', time.time() - start)
+
+    def fetchone(self):
+        start = time.time()
+        try:
+            return sqlite3.Cursor.fetchone(self)
+        finally:
+            metrics.observe('sql_seconds', time.time() - start)
+
+    def fetchmany(self, *args):
+        start = time.time()
+        try:
+            return sqlite3.Cursor.fetchmany(self, *args)
+        finally:
+            metrics.observe('sql_seconds', time.time() - start)
+
+    def fetchall(self):
+        start = time.time()
+        try:
+            return sqlite3.Cursor.fetchall(self)
+        finally:
+            metrics.observe('sql_seconds', time.time() - start)
+
+class TimedConnection(sqlite3.Connection):
+
+    def cursor(self, factory=TimedCursor):
+        return sqlite3.Connection.cursor(self, factory)
+
+def query_index(kwargs):
+    # returns the index type a query is for, used to label its timings
+    queryID = kwargs.get('QueryID', kwargs.get('ID', kwargs.get('ObjectID', kwargs.get('ContainerID', ''))))
+    if queryID in ('root', '0', '1'):
+        return 'root'
+    elif queryID == 'search':
+        return 'search'
+    elif '__' in queryID:
+        return 'track'
+    hierarchy = kwargs.get('SMAPI', '')
+    if hierarchy:
+        return hierarchy.split(':')[-1]
+    return 'other'
+
+def timed(kind):
+    # records the time taken by a query entry point in the query_seconds
+    # histogram, labelled with kind and the index type queried
+    def decorate(function):
+        def wrapper(self, *args, **kwargs):
+            start = time.time()
+            try:
+                return function(self, *args, **kwargs)
+            finally:
+                metrics.observe('query_seconds', time.time() - start, query=kind, index=query_index(kwargs))
+        wrapper.__name__ = function.__name__
+        wrapper.__doc__ = function.__doc__
+        return wrapper
+    return decorate
+
+def changed_attributes(before, obj):
+    # returns the attributes of obj that have been set since its __dict__ was copied to before
+    return dict((k, v) for k, v in obj.__dict__.iteritems() if k not in before or before[k] is not v)
+
 class MediaServer(object):
 
     # constants
@@ -184,8 +270,8 @@ class MediaServer(object):
 
     def __init__(self, proxy, dbspec, source, structure, proxyaddress, webserverurl, wmpurl, ininame):
 
-        log.debug('MediaServer.__init__ structure: %s' % structure)
-        log.debug('MediaServer.__init__ instance: %s' % self)
+        log.debug('MediaServer.__init__ structure: %s', structure)
+        log.debug('MediaServer.__init__ instance: %s', self)
 
         self.proxy = proxy
         self.dbspec = dbspec
@@ -199,7 +285,7 @@ class MediaServer(object):
 
         self.load_ini()
 
-        log.debug('MediaServer.__init__ structure now: %s' % self.structure)
+        log.debug('MediaServer.__init__ structure now: %s', self.structure)
 
         self.prime_cache()
 
@@ -245,13 +331,24 @@ class MediaServer(object):
         # file will contain a user defined list of indexes, plus
         # optionally some adjustments to the display of those
         # indexes.
+        #
+        # The settings are loaded into a copy of the server and swapped
+        # in together at the end, so that queries running during a
+        # reload see either the old settings or the new ones.
+
+        plan = copy.copy(self)
+        before = plan.__dict__.copy()
+        plan.load_ini_settings()
+        self.__dict__.update(changed_attributes(before, plan))
+
+    def load_ini_settings(self):
 
         # get display properties from ini
         self.load_ini_display()
 
         # get alternative indexing setting from ini
         self.load_ini_indexing()
-        log.debug('alternative_indexing: %s' % self.alternative_indexing)
+        log.debug('alternative_indexing: %s', self.alternative_indexing)
 
         # get work and virtual albumtypes from database
         self.load_albumtypes()
@@ -263,12 +360,15 @@ class MediaServer(object):
         if self.structure == 'HIERARCHY_DEFAULT':
 
             # get default indexes
-            self.load_indexes('DEFAULT')
+            self.load_index_plan('DEFAULT')
 
         elif self.structure == 'HIERARCHY':
 
             # get user defined indexes
-            self.load_indexes('USER')
+            self.load_index_plan('USER')
+
+        # compile the index entry prefixes/suffixes
+        self.load_code_snippets()
 
     ################
     # ini processing
@@ -544,7 +644,7 @@ class MediaServer(object):
         if self.proxy.db_persist_connection:
             db = self.proxy.db
         else:
-            db = sqlite3.connect(self.dbspec)
+            db = sqlite3.connect(self.dbspec, factory=TimedConnection)
         c = db.cursor()
         try:
             c.execute("""select * from wvlookup""")
@@ -570,7 +670,7 @@ class MediaServer(object):
             show_albums += [self.albumtypes['_default_work']]
         self.user_index_key_dict['show_albums'] = show_albums
 
-        log.debug('show_albums: %s' % self.user_index_key_dict['show_albums'])
+        log.debug('show_albums: %s', self.user_index_key_dict['show_albums'])
 
     def load_indexes(self, index_type):
 
@@ -766,14 +866,87 @@ class MediaServer(object):
 
         pm_xml += '</Presentation>\n'
 
+        self.presentation_map_xml = pm_xml
+
+    def write_presentation_map(self):
+
         pm_xml_path = os.path.join(os.getcwd(), self.proxy.presentation_map_file)
-        log.debug("pm file: %s" % pm_xml_path)
+        log.debug("pm file: %s", pm_xml_path)
         try:
             with open(pm_xml_path, 'w+') as f:
-                f.write(str(pm_xml))
+                f.write(str(self.presentation_map_xml))
         except IOError:
             log.debug('Failed to create presentation map file')
 
+    def load_index_plan(self, index_type):
+
+        # load_indexes parses the index ini and builds the hierarchy and
+        # lookups from it, which is most of the work of load_ini - what it
+        # sets is cached in a file keyed on what it reads, and loaded from
+        # there while that is unchanged
+
+        key = self.get_index_plan_key(index_type)
+        planfile = os.path.join(os.getcwd(), '%s.%s.indexplan' % (self.dbname, index_type.lower()))
+        plan = None
+        if key != None and os.path.isfile(planfile):
+            try:
+                f = open(planfile, 'rb')
+                try:
+                    planentry = cPickle.load(f)
+                finally:
+                    f.close()
+                if planentry.get('key', None) == key:
+                    plan = planentry['plan']
+            except Exception, e:
+                log.debug('Discarding unreadable index plan %s: %s', planfile, e)
+
+        if plan != None:
+            log.debug('Loaded index plan from %s', planfile)
+            self.__dict__.update(plan)
+        else:
+            before = self.__dict__.copy()
+            self.load_indexes(index_type)
+            if key != None:
+                plan = changed_attributes(before, self)
+                # write to a temporary file first, readers never see a partial plan
+                tmp = '%s.%d.tmp' % (planfile, os.getpid())
+                try:
+                    f = open(tmp, 'wb')
+                    try:
+                        cPickle.dump({'key': key, 'plan': plan}, f, cPickle.HIGHEST_PROTOCOL)
+                    finally:
+                        f.close()
+                    if os.name == 'nt' and os.path.exists(planfile):
+                        os.remove(planfile)
+                    os.rename(tmp, planfile)
+                except (IOError, OSError, cPickle.PicklingError, TypeError), e:
+                    log.debug('Could not write index plan %s: %s', planfile, e)
+
+        self.write_presentation_map()
+
+    def get_index_plan_key(self, index_type):
+
+        # returns a hash of everything load_indexes reads, or None if
+        # the index ini can't be read
+
+        if index_type == 'DEFAULT': inifile = DEFAULTINDEX_INI
+        else: 
+            if self.ininame == None: inifile = USERINDEX_INI
+            else: inifile = self.ininame
+        try:
+            f = open(inifile, 'rb')
+            try:
+                ini = f.read()
+            finally:
+                f.close()
+            source = os.path.getmtime(__file__)
+        except (IOError, OSError):
+            return None
+        keydata = repr((INDEX_PLAN_VERSION, source, index_type, inifile, ini,
+                        sorted(self.user_index_key_dict.items()),
+                        sorted(self.albumtypes.items())))
+        return hashlib.md5(keydata).hexdigest()
+
     def load_hierarchy(self, index_type):
 
         # allrootitems will contain an ordered list of all root item tuples, of root ID and title
@@ -1102,7 +1275,7 @@ class MediaServer(object):
                         # convert entry and get index start
                         convindexentries = []
                         rootkey = self.get_root_entry(value)
-                        log.debug('value: %s  rootkey: %s' % (value, rootkey))
+                        log.debug('value: %s  rootkey: %s', value, rootkey)
                         if rootkey != None:
                             # get index start
                             indexentrystart = self.index_ids[rootkey][0]
@@ -1340,12 +1513,12 @@ class MediaServer(object):
     ##########
 
     def prime_cache(self):
-        log.debug("prime start: %.3f" % time.time())
+        log.debug("prime start: %.3f", time.time())
 
         if self.proxy.db_persist_connection:
             db = self.proxy.db
         else:
-            db = sqlite3.connect(self.dbspec)
+            db = sqlite3.connect(self.dbspec, factory=TimedConnection)
 #        log.debug(db)
         c = db.cursor()
         try:
@@ -1365,12 +1538,13 @@ class MediaServer(object):
         c.close()
         if not self.proxy.db_persist_connection:
             db.close()
-        log.debug("prime end: %.3f" % time.time())
+        log.debug("prime end: %.3f", time.time())
 
     ###############
     # query service
     ###############
 
+    @timed('query')
     def query(self, **kwargs):
 
         log.debug("Mediaserver.query: %s", kwargs)
@@ -1385,7 +1559,7 @@ class MediaServer(object):
         else:
             id = 'ID'
         queryID = kwargs.get(id, '')
-        log.debug("queryID: %s" % queryID)
+        log.debug("queryID: %s", queryID)
 
         # standardise ID field name
         kwargs['QueryID'] = queryID
@@ -1399,7 +1573,7 @@ class MediaServer(object):
             updateditems = []
             items, total, index, itemstype = ret
             for item in items:
-                log.debug('%s - %s' % (itemstype, item))
+                log.debug('%s - %s', itemstype, item)
 
                 #DEBUG	mediaserver :1369:  query() container - ('R8:1300000136:1400000001', u'Last month')
                 #DEBUG	mediaserver :1374:  query() container - ('R2:350000003', u'V1 - Test', u'http://192.168.1.67:50105/wmp/test.db.1.jpg')
@@ -1463,13 +1637,13 @@ class MediaServer(object):
         log.debug("Mediaserver.hierarchicalQuery: %s", kwargs)
 
         queryID = kwargs.get('QueryID', '')
-        log.debug("QueryID: %s" % queryID)
+        log.debug("QueryID: %s", queryID)
         index = int(kwargs.get('StartingIndex', 0))
-        log.debug("StartingIndex: %s" % index)
+        log.debug("StartingIndex: %s", index)
         count = int(kwargs.get('RequestedCount', 100))
-        log.debug("RequestedCount: %s" % count)
+        log.debug("RequestedCount: %s", count)
         term = kwargs.get('term', None)
-        log.debug("term: %s" % term)
+        log.debug("term: %s", term)
 
         wassearch = False
 
@@ -1515,7 +1689,7 @@ class MediaServer(object):
 
             ids = queryID.split(':')
 
-        log.debug("items: %s" % items)
+        log.debug("items: %s", items)
         if items != None:
 
             # TODO: process count/index (i.e. take note of how many entries are requested)
@@ -1576,12 +1750,12 @@ class MediaServer(object):
         else:
 
             controllername = kwargs.get('Controller', '')
-            log.debug('Controller: %s' % controllername)
+            log.debug('Controller: %s', controllername)
             controlleraddress = kwargs.get('Address', '')
-            log.debug('Address: %s' % controlleraddress)
+            log.debug('Address: %s', controlleraddress)
 
             # have a list of queryIDs - are a hierarchy of containers
-            log.debug('ids: %s' % ids)
+            log.debug('ids: %s', ids)
 
             # convert keys to integers (except rootname)
             ids = [i if i.startswith('R') else int(i) for i in ids]
@@ -1589,8 +1763,8 @@ class MediaServer(object):
             # ID is always passed prepended with root name
             rootname, indexkeys = self.get_index_parts(ids)
 
-            log.debug('rootname: %s' % rootname)
-            log.debug('indexkeys: %s' % indexkeys)
+            log.debug('rootname: %s', rootname)
+            log.debug('indexkeys: %s', indexkeys)
 
             # get position of last index in list in hierarchy 
             indexentryposition = len(indexkeys) - 1
@@ -1645,8 +1819,8 @@ class MediaServer(object):
                 indexkeys += [next_container]
                 indexentryposition += 1
 
-            log.debug('ids: %s' % ids)
-            log.debug('indexkeys: %s' % indexkeys)
+            log.debug('ids: %s', ids)
+            log.debug('indexkeys: %s', indexkeys)
 
             # get type of last item in hierarchy
             if self.index_ids[rootname][indexentryposition] in self.tracktypes:
@@ -1654,7 +1828,7 @@ class MediaServer(object):
             else:
                 itemtype = 'container'
 
-            log.debug('itemtype: %s' % itemtype)
+            log.debug('itemtype: %s', itemtype)
 
             # check whether this call is supported by static or dynamic
             static = False
@@ -1695,7 +1869,7 @@ class MediaServer(object):
 #                            if index_range != ('', '', ''):
 #                                static = 'DYNAMIC'
 
-            log.debug('static: %s' % static)
+            log.debug('static: %s', static)
 
             # if recursive requested, replace last item in hierarchy
             # with track
@@ -1703,7 +1877,7 @@ class MediaServer(object):
             # that recursive will only be requested for hierarchies
             # that end in tracks)
             recursive = kwargs.get('recursive', False)
-            log.debug("recursive: %s" % recursive)
+            log.debug("recursive: %s", recursive)
             if recursive:
                 # if last entry has a user defined path index as a parent,
                 # append rather than replace as we need to take account
@@ -1712,7 +1886,7 @@ class MediaServer(object):
                 if len(ids) > 2:
                     indexname = self.hierarchies[rootname][len(ids) - 3]
                     path_name = '%s_%s' % (rootname, indexname)
-                    log.debug('path_name: %s' % path_name)
+                    log.debug('path_name: %s', path_name)
                     if path_name in self.path_index_entries.keys():
                         append = True
                 if append:
@@ -1721,8 +1895,8 @@ class MediaServer(object):
                 else:
                     ids[-1] = self.track_parentid
                     indexkeys[-1] = self.track_parentid
-                log.debug('ids: %s' % ids)
-                log.debug('indexkeys: %s' % indexkeys)
+                log.debug('ids: %s', ids)
+                log.debug('indexkeys: %s', indexkeys)
 
             # process ids
             idkeys = {}
@@ -1752,8 +1926,8 @@ class MediaServer(object):
                 id = int(indexentrykey)
                 idkeys[indexentryname] = (id, isid, indexentryid)
 
-            log.debug('hierarchy: %s' % hierarchy)
-            log.debug('idkeys: %s' % idkeys)
+            log.debug('hierarchy: %s', hierarchy)
+            log.debug('idkeys: %s', idkeys)
 
             # if we get this far we have a list of IDs and we need to query the database
 
@@ -1799,6 +1973,7 @@ class MediaServer(object):
                                         idkeys=idkeys,
                                         Action='BROWSE')
 
+    @timed('static')
     def staticQuery(self, *args, **kwargs):
 
         log.debug("Mediaserver.staticQuery: %s", kwargs)
@@ -1808,17 +1983,17 @@ class MediaServer(object):
         '''
 
         action = kwargs.get('Action', None)
-        log.debug("action: %s" % action)
+        log.debug("action: %s", action)
 
         queryID = kwargs.get('QueryID', '')
-        log.debug("queryID: %s" % queryID)
+        log.debug("queryID: %s", queryID)
 
 # TODO
 # TODO: remember to decide what to do with titlesort and how to allow the user to select it (or other tags)
 # TODO
 
         SMAPI = kwargs.get('SMAPI', '')
-        log.debug('SMAPI: %s' % SMAPI)
+        log.debug('SMAPI: %s', SMAPI)
         idhierarchy = SMAPI.split(':')
         log.debug(idhierarchy)
         idkeys = kwargs.get('idkeys', '')
@@ -1826,27 +2001,27 @@ class MediaServer(object):
 
         searchCriteria = kwargs.get('SearchCriteria', '')
         searchCriteria = self.fixcriteria(searchCriteria)
-        log.debug('searchCriteria: %s' % searchCriteria.encode(enc, 'replace'))
+        log.debug('searchCriteria: %s', searchCriteria.encode(enc, 'replace'))
 
         items = []
         browsetype = SMAPI
 
-        log.debug("browsetype: %s" % browsetype)
+        log.debug("browsetype: %s", browsetype)
 
         controllername = kwargs.get('Controller', '')
         controlleraddress = kwargs.get('Address', '')
-        log.debug('Controller: %s' % controllername)
-        log.debug('Address: %s' % controlleraddress)
+        log.debug('Controller: %s', controllername)
+        log.debug('Address: %s', controlleraddress)
 
         browseFlag = kwargs.get('BrowseFlag', None)
         searchCriteria = kwargs.get('SearchCriteria', '')
-        log.debug('BrowseFlag: %s' % browseFlag)
-        log.debug('SearchCriteria: %s' % searchCriteria)
+        log.debug('BrowseFlag: %s', browseFlag)
+        log.debug('SearchCriteria: %s', searchCriteria)
 
         startingIndex = int(kwargs['StartingIndex'])
         requestedCount = int(kwargs['RequestedCount'])
-        log.debug('StartingIndex: %s' % startingIndex)
-        log.debug('RequestedCount: %s' % requestedCount)
+        log.debug('StartingIndex: %s', startingIndex)
+        log.debug('RequestedCount: %s', requestedCount)
 
         # create call data for metadata/mediametadata and call it
         return self.querymetadata(Controller=controllername,
@@ -2120,19 +2295,19 @@ class MediaServer(object):
 
     def getQueryTrack(self, searchcontainer, searchstring, sorttype, controllername):
 
-        log.debug('searchcontainer: %s' % searchcontainer)
-        log.debug('searchstring: %s' % searchstring)
-        log.debug('sorttype: %s' % sorttype)
-        log.debug('controllername: %s' % controllername)
+        log.debug('searchcontainer: %s', searchcontainer)
+        log.debug('searchstring: %s', searchstring)
+        log.debug('sorttype: %s', sorttype)
+        log.debug('controllername: %s', controllername)
 
         orderby, prefix, suffix, albumtype, rangefield, indexrange = self.get_orderby(sorttype, controllername, dynamic=False, orderby='title')
 #        orderby, prefix, suffix, albumtype, rangefield, indexrange = self.get_orderby(sorttype, controllername, dynamic=False, orderby='titleorder')
         rangetype, rangewhere = self.format_range(rangefield, indexrange)
 
-        log.debug('orderby: %s' % orderby)
-        log.debug('prefix: %s' % prefix)
-        log.debug('suffix: %s' % suffix)
-        log.debug('albumtype: %s' % albumtype)
+        log.debug('orderby: %s', orderby)
+        log.debug('prefix: %s', prefix)
+        log.debug('suffix: %s', suffix)
+        log.debug('albumtype: %s', albumtype)
 
         searchwhere = ''
         #TODO: check artisttype
@@ -2741,14 +2916,14 @@ class MediaServer(object):
 #            log.debug("albumartist: %s", albumartist)
 
             fixdict = {'year':year, 'lastplayed':lastplayed, 'playcount':playcount, 'created':created, 'lastmodified':lastmodified, 'inserted':inserted, 'artist':artist, 'albumartist':albumartist, 'composer':composer}
-            log.debug('fixdict: %s' % fixdict)
+            log.debug('fixdict: %s', fixdict)
             if prefix:
                 a_prefix = self.static_makepresuffix(prefix, self.replace_pre, fixdict, 'P')
                 if a_prefix: album = '%s%s' % (a_prefix, album)
             if suffix:
                 a_suffix = self.static_makepresuffix(suffix, self.replace_suf, fixdict, 'S')
                 if a_suffix: album = '%s%s' % (album, a_suffix)
-                log.debug('a_suffix: %s' % a_suffix)
+                log.debug('a_suffix: %s', a_suffix)
 
             coverres = ''
             if cover.startswith('EMBEDDED_'):
@@ -2765,9 +2940,8 @@ class MediaServer(object):
 #                    coverres = self.proxyaddress + '/WMPNSSv3/' + dummycoverfile
                 coverres = self.proxyaddress + '/wmp/' + dummycoverfile
 #                log.debug("coverres: %s", coverres)
-                dummycoverstaticfile = webserver.StaticFileSonos(dummycoverfile, cvfile, cvpath, cover=cover)
 #                log.debug("dummycoverstaticfile: %s", dummycoverstaticfile)
-                self.proxy.wmpcontroller2.add_static_file(dummycoverstaticfile)
+                self.proxy.wmpcontroller2.add_lazy_file(webserver.StaticFileSonos, dummycoverfile, cvfile, cvpath, cover=cover)
 #                log.debug("after add_static_file")
             elif cover != '':
                 cvfile = getFile(cover)
@@ -2776,8 +2950,7 @@ class MediaServer(object):
                 dummycoverfile = self.dbname + '.' + str(artid) + '.' + coverfiletype
 #                    coverres = self.proxyaddress + '/WMPNSSv3/' + dummycoverfile
                 coverres = self.proxyaddress + '/wmp/' + dummycoverfile
-                dummycoverstaticfile = webserver.StaticFileSonos(dummycoverfile, cvfile, cvpath)    # TODO: pass contenttype
-                self.proxy.wmpcontroller2.add_static_file(dummycoverstaticfile)
+                self.proxy.wmpcontroller2.add_lazy_file(webserver.StaticFileSonos, dummycoverfile, cvfile, cvpath)    # TODO: pass contenttype
 
             albumidval, browsebyid, containerstart = idkeys['album']
 #            itemid = album_id - containerstart
@@ -2868,7 +3041,6 @@ class MediaServer(object):
                     id, id2, duplicate, title, artistlistshort, artistlist, albumlist, genre, tracknumber, year, albumartistlistshort, albumartistlist, composerlistshort, composerlist, codec, length, size, created, path, filename, discnumber, comment, folderart, trackart, bitrate, samplerate, bitspersample, channels, mime, lastmodified, folderartid, trackartid, inserted, lastplayed, playcount, lastscanned, titlesort, albumsort = row
 #                    id, id2, duplicate, title, artistlistshort, artistlist, albumlist, genre, tracknumber, year, albumartistlistshort, albumartistlist, composerlistshort, composerlist, codec, length, size, created, path, filename, discnumber, comment, folderart, trackart, bitrate, samplerate, bitspersample, channels, mime, lastmodified, folderartid, trackartid, inserted, lastplayed, playcount, lastscanned, titlesort, albumsort, titleorder, alpha, alphaorder = row
 
-            mime = fixMime(mime)
             if albumtype and albumtype != 10:
                 cover, artid = self.choosecover(folderart, trackart, folderartid, trackartid, coverart, coverartid)
             else:
@@ -2880,20 +3052,9 @@ class MediaServer(object):
             filepath = path + filename
             filepath = encode_path(filepath)
             filepath = escape(filepath, escape_entities)
-            protocol = getProtocol(mime)
-            contenttype = mime
-            filetype = getFileType(filename)
-
-            stream, newtype = checkstream(filename, filetype)
-            if stream:
-                transcode = False
-            else:
-                if self.source == 'SMAPI':
-                    transcode, newtype, ext = checksmapitranscode(filetype, bitrate, samplerate, bitspersample, channels, codec)
-                    if transcode:
-                        mime = getMime(ext)
-                else:
-                    transcode, newtype = checktranscode(filetype, bitrate, samplerate, bitspersample, channels, codec)
+            contenttype, protocol, filetype, stream, transcode, newtype, mime = \
+                getFormat(filename, mime, bitrate, samplerate, bitspersample, channels, codec,
+                          smapi=self.source == 'SMAPI', streams=True)
 
             if transcode:
                 dummyfile = self.dbname + '.' + id + '.' + newtype
@@ -2904,16 +3065,13 @@ class MediaServer(object):
             res = self.proxyaddress + '/WMPNSSv3/' + dummyfile
             if transcode:
 #                log.debug('\ndummyfile: %s\nwsfile: %s\nwspath: %s\ncontenttype: %s\ntranscodetype: %s' % (dummyfile, wsfile, wspath, contenttype, newtype))
-                dummystaticfile = webserver.TranscodedFileSonos(dummyfile, wsfile, wspath, newtype, contenttype, cover=cover)
-                self.proxy.wmpcontroller.add_transcoded_file(dummystaticfile)
+                self.proxy.wmpcontroller.add_lazy_file(webserver.TranscodedFileSonos, dummyfile, wsfile, wspath, newtype, contenttype, cover=cover)
             elif stream:
-                log.debug('\ndummyfile: %s\nwsfile: %s\nwspath: %s\ncontenttype: %s\ntranscodetype: %s' % (dummyfile, wsfile, wsfile, contenttype, newtype))
-                dummystaticfile = webserver.TranscodedFileSonos(dummyfile, wsfile, wsfile, newtype, contenttype, cover=cover, stream=True)
-                self.proxy.wmpcontroller.add_transcoded_file(dummystaticfile)
+                log.debug('\ndummyfile: %s\nwsfile: %s\nwspath: %s\ncontenttype: %s\ntranscodetype: %s', dummyfile, wsfile, wsfile, contenttype, newtype)
+                self.proxy.wmpcontroller.add_lazy_file(webserver.TranscodedFileSonos, dummyfile, wsfile, wsfile, newtype, contenttype, cover=cover, stream=True)
             else:
 #                log.debug('\ndummyfile: %s\nwsfile: %s\nwspath: %s\ncontenttype: %s' % (dummyfile, wsfile, wspath, contenttype))
-                dummystaticfile = webserver.StaticFileSonos(dummyfile, wsfile, wspath, contenttype, cover=cover)
-                self.proxy.wmpcontroller.add_static_file(dummystaticfile)
+                self.proxy.wmpcontroller.add_lazy_file(webserver.StaticFileSonos, dummyfile, wsfile, wspath, contenttype, cover=cover)
 
             if self.source == 'SMAPI':
 
@@ -2932,9 +3090,8 @@ class MediaServer(object):
     #                    coverres = self.proxyaddress + '/WMPNSSv3/' + dummycoverfile
                     coverres = self.proxyaddress + '/wmp/' + dummycoverfile
     #                log.debug("coverres: %s", coverres)
-                    dummycoverstaticfile = webserver.StaticFileSonos(dummycoverfile, cvfile, cvpath, cover=cover)
     #                log.debug("dummycoverstaticfile: %s", dummycoverstaticfile)
-                    self.proxy.wmpcontroller2.add_static_file(dummycoverstaticfile)
+                    self.proxy.wmpcontroller2.add_lazy_file(webserver.StaticFileSonos, dummycoverfile, cvfile, cvpath, cover=cover)
     #                log.debug("after add_static_file")
                 elif cover != '':
                     cvfile = getFile(cover)
@@ -2943,8 +3100,7 @@ class MediaServer(object):
                     dummycoverfile = self.dbname + '.' + str(artid) + '.' + coverfiletype
     #                    coverres = self.proxyaddress + '/WMPNSSv3/' + dummycoverfile
                     coverres = self.proxyaddress + '/wmp/' + dummycoverfile
-                    dummycoverstaticfile = webserver.StaticFileSonos(dummycoverfile, cvfile, cvpath)    # TODO: pass contenttype
-                    self.proxy.wmpcontroller2.add_static_file(dummycoverstaticfile)
+                    self.proxy.wmpcontroller2.add_lazy_file(webserver.StaticFileSonos, dummycoverfile, cvfile, cvpath)    # TODO: pass contenttype
 
             else:
 
@@ -2956,8 +3112,7 @@ class MediaServer(object):
                     coverfiletype = getFileType(cvfile)
                     dummycoverfile = self.dbname + '.' + str(artid) + '.' + coverfiletype
                     coverres = self.proxyaddress + '/WMPNSSv3/' + dummycoverfile
-                    dummycoverstaticfile = webserver.StaticFileSonos(dummycoverfile, cvfile, cvpath)    # TODO: pass contenttype
-                    self.proxy.wmpcontroller2.add_static_file(dummycoverstaticfile)
+                    self.proxy.wmpcontroller2.add_lazy_file(webserver.StaticFileSonos, dummycoverfile, cvfile, cvpath)    # TODO: pass contenttype
                 elif cover.startswith('EMBEDDED_'):
                     coverres = self.proxyaddress + '/WMPNSSv3/' + dummyfile
 
@@ -3396,6 +3551,7 @@ class MediaServer(object):
     # metadata query processor for static calls
     ###########################################
 
+    @timed('metadata')
     def querymetadata(self, *args, **kwargs):
 
         log.debug("Mediaserver.search: %s", kwargs)
@@ -3404,28 +3560,28 @@ class MediaServer(object):
 
         controllername = kwargs.get('Controller', '')
         controlleraddress = kwargs.get('Address', '')
-        log.debug('Controller: %s' % controllername)
-        log.debug('Address: %s' % controlleraddress)
+        log.debug('Controller: %s', controllername)
+        log.debug('Address: %s', controlleraddress)
 
-        log.debug("start: %.3f" % time.time())
+        log.debug("start: %.3f", time.time())
 
         queryID = kwargs['QueryID']
-        log.debug('QueryID: %s' % str(queryID))
+        log.debug('QueryID: %s', queryID)
 
         ids = queryID.split(':')
-        log.debug('ids: %s' % ids)
+        log.debug('ids: %s', ids)
 
         searchCriteria = kwargs.get('SearchCriteria', '')
         searchCriteria = self.fixcriteria(searchCriteria)
-        log.debug('searchCriteria: %s' % searchCriteria.encode(enc, 'replace'))
+        log.debug('searchCriteria: %s', searchCriteria.encode(enc, 'replace'))
 
         browsetype = kwargs.get('browsetype', '')
-        log.debug('browsetype: %s' % browsetype)
+        log.debug('browsetype: %s', browsetype)
 
         idhierarchy = browsetype.split(':')
-        log.debug('idhierarchy: %s' % idhierarchy)
+        log.debug('idhierarchy: %s', idhierarchy)
         idkeys = kwargs.get('idkeys', '')
-        log.debug('idkeys: %s' % idkeys)
+        log.debug('idkeys: %s', idkeys)
 
         # check if search requested
         searchcontainer = None
@@ -3439,7 +3595,7 @@ class MediaServer(object):
         if self.proxy.db_persist_connection:
             db = self.proxy.db
         else:
-            db = sqlite3.connect(self.dbspec)
+            db = sqlite3.connect(self.dbspec, factory=TimedConnection)
         c = db.cursor()
 
         startingIndex = int(kwargs['StartingIndex'])
@@ -3489,8 +3645,8 @@ class MediaServer(object):
 
             # have a list of entries
             rootname, indexkeys = self.get_index_parts(ids)
-            log.debug('rootname: %s' % rootname)
-            log.debug('indexkeys: %s' % indexkeys)
+            log.debug('rootname: %s', rootname)
+            log.debug('indexkeys: %s', indexkeys)
 
             # get sorttype
 
@@ -3515,12 +3671,12 @@ class MediaServer(object):
                 sorttype = '%s_%s_%s' % (rootname, self.dynamic_lookup[int(indexkeys[0])], entry)
                 # remove dynamic facet of browsetype
                 browsetype = ':'.join(idhierarchy[1:])
-                log.debug("browsetype: %s" % browsetype)
+                log.debug("browsetype: %s", browsetype)
 
             else:
                 sorttype = self.get_index_key(ids, idhierarchy)
 
-            log.debug("sorttype: %s" % sorttype)
+            log.debug("sorttype: %s", sorttype)
 
             # remove the last entry from the query ID if it's a container id
             # so that we can subsequently append the key selected from that container
@@ -3535,7 +3691,7 @@ class MediaServer(object):
             else:
                 queryIDprefix = queryID
 
-            log.debug('queryIDprefix: %s' % queryIDprefix)
+            log.debug('queryIDprefix: %s', queryIDprefix)
 
         # note - there is a small amount of duplicated code per browsetype
         #        so that they are self-contained and easier to understand
@@ -4371,7 +4527,7 @@ class MediaServer(object):
         if not self.proxy.db_persist_connection:
             db.close()
 
-        log.debug("end: %.3f" % time.time())
+        log.debug("end: %.3f", time.time())
 
         if self.source == 'SMAPI':
             return items, totalMatches, startingIndex, 'container'
@@ -4386,41 +4542,42 @@ class MediaServer(object):
     # dynamic query processor
     #########################
 
+    @timed('dynamic')
     def dynamicQuery(self, *args, **kwargs):
 
         # TODO: fix error conditions (return zero)
         log.debug("Mediaserver.dynamicQuery: %s", kwargs)
 
-        log.debug("start: %.3f" % time.time())
+        log.debug("start: %.3f", time.time())
 
         # process params
         ################
 
         controllername = kwargs.get('Controller', '')
         controlleraddress = kwargs.get('Address', '')
-        log.debug('Controller: %s' % controllername)
-        log.debug('Address: %s' % controlleraddress)
+        log.debug('Controller: %s', controllername)
+        log.debug('Address: %s', controlleraddress)
 
         queryID = kwargs.get('QueryID','')
-        log.debug('queryID: %s' % str(queryID))
+        log.debug('queryID: %s', queryID)
 
         ids = queryID.split(':')
-        log.debug('ids: %s' % ids)
+        log.debug('ids: %s', ids)
 
         searchCriteria = kwargs['SearchCriteria']
         searchCriteria = self.fixcriteria(searchCriteria)
-        log.debug('searchCriteria: %s' % searchCriteria)
+        log.debug('searchCriteria: %s', searchCriteria)
         #log.debug('searchCriteria: %s' % searchCriteria.encode(enc, 'replace'))
 
         SMAPI = kwargs.get('SMAPI', '')
-        log.debug('SMAPI: %s' % SMAPI)
+        log.debug('SMAPI: %s', SMAPI)
         if SMAPI.startswith('!ALPHA'):
             idhierarchy = [SMAPI[6:]]
         else:
             idhierarchy = SMAPI.split(':')
-        log.debug('idhierarchy: %s' % idhierarchy)
+        log.debug('idhierarchy: %s', idhierarchy)
         idkeys = kwargs.get('idkeys', [])
-        log.debug('idkeys: %s' % idkeys)
+        log.debug('idkeys: %s', idkeys)
 
         startingIndex = int(kwargs['StartingIndex'])
         requestedCount = int(kwargs['RequestedCount'])
@@ -4477,7 +4634,7 @@ class MediaServer(object):
         if self.proxy.db_persist_connection:
             db = self.proxy.db
         else:
-            db = sqlite3.connect(self.dbspec)
+            db = sqlite3.connect(self.dbspec, factory=TimedConnection)
         db.row_factory = sqlite3.Row
         c = db.cursor()
 
@@ -4511,8 +4668,8 @@ class MediaServer(object):
         # ID is always passed prepended with root name
         rootname, indexkeys = self.get_index_parts(ids)
 
-        log.debug('rootname: %s' % rootname)
-        log.debug('indexkeys: %s' % indexkeys)
+        log.debug('rootname: %s', rootname)
+        log.debug('indexkeys: %s', indexkeys)
 
         # walk through items in hierarchy, getting SQL keys when id passed
         itemidprefix = rootname
@@ -4538,10 +4695,10 @@ class MediaServer(object):
                 continue
 
             field = self.convert_field_name(entry)
-            log.debug('field: %s' % field)
+            log.debug('field: %s', field)
 
             path_name = '%s_%s' % (rootname, field)
-            log.debug('path_name: %s' % path_name)
+            log.debug('path_name: %s', path_name)
 
             # process for id's only (not containers and usersearch)
             if searchcontainer != 'usersearch' and browsebyid:
@@ -4589,7 +4746,7 @@ class MediaServer(object):
             field = self.convert_field_name(entry)
             log.debug(field)
             path_name = '%s_%s' % (rootname, field)
-            log.debug('path_name: %s' % path_name)
+            log.debug('path_name: %s', path_name)
 
             if searchcontainer:
 
@@ -4684,11 +4841,11 @@ class MediaServer(object):
 
                     ids += [self.index_ids[rootname][len(idhierarchy) - 1]]
 
-                    log.debug("ids: %s" % ids)
+                    log.debug("ids: %s", ids)
 
 #                    sorttype = '%s_%s%s' % (idhierarchy[0], idhierarchy[-1], indexsuffix)
                     sorttype = self.get_index_key(ids, idhierarchy)
-                    log.debug("sorttype: %s" % sorttype)
+                    log.debug("sorttype: %s", sorttype)
 
                 log.debug(sorttype)
 
@@ -4752,7 +4909,7 @@ class MediaServer(object):
                     items += [(itemid, escape(title))]
                     rowid += 1
 
-                log.debug("items: %s" % items)
+                log.debug("items: %s", items)
 
             else:
 
@@ -4772,7 +4929,7 @@ class MediaServer(object):
                             if where.startswith('where'):
                                 where = 'and %s' % where[5:]
                             where = 'where %s %s' % (rangewhere, where)
-                            log.debug('where: %s' % where)
+                            log.debug('where: %s', where)
 
                 if searchcontainer and len(searchlist) > 1:
 
@@ -4926,9 +5083,9 @@ class MediaServer(object):
 
 #            sorttype = '%s_%s%s' % (idhierarchy[0], idhierarchy[-1], indexsuffix)
             ids += [self.index_ids[rootname][len(idhierarchy) - 1]]
-            log.debug("ids: %s" % ids)
+            log.debug("ids: %s", ids)
             sorttype = self.get_index_key(ids, idhierarchy)
-            log.debug("sorttype: %s" % sorttype)
+            log.debug("sorttype: %s", sorttype)
 
             # get sort data
             rangefield, indexrange, sortorder, entryprefix, entrysuffix, albumtype = self.get_orderby(sorttype, controllername, dynamic=True)
@@ -4968,7 +5125,7 @@ class MediaServer(object):
                         if where.startswith('where'):
                             where = 'and %s' % where[5:]
                         where = 'where %s %s' % (rangewhere, where)
-                        log.debug('where: %s' % where)
+                        log.debug('where: %s', where)
 
 
             selectfield = 'id, title, artist, album, genre, tracknumber, albumartist, composer, codec, length, path, filename, folderart, trackart, bitrate, samplerate, bitspersample, channels, mime, folderartid, trackartid'
@@ -4994,7 +5151,7 @@ class MediaServer(object):
 
             c.execute(countstatement)
             totalMatches, = c.fetchone()
-            log.debug('totalMatches: %s' % totalMatches)
+            log.debug('totalMatches: %s', totalMatches)
 
             # check if we need to apply a count to the query
             if rangetype == 'count':
@@ -5013,7 +5170,7 @@ class MediaServer(object):
                 originalMatches = totalMatches
                 if totalMatches > rangecount:
                     totalMatches = rangecount
-                    log.debug('range adjusted count: %s' % totalMatches)
+                    log.debug('range adjusted count: %s', totalMatches)
 
                 # for the select, we need to add a bounding limit to the initial
                 # query before applying the existing requested count/startindex
@@ -5030,7 +5187,7 @@ class MediaServer(object):
                 # insert outer select limit before call limit
                 statement = statement.replace(' limit ', ' %s limit ' % limitclause)
 
-                log.debug('range adjusted statement: %s' % statement)
+                log.debug('range adjusted statement: %s', statement)
 
             if totalMatches > 0:
 
@@ -5052,7 +5209,7 @@ class MediaServer(object):
                         else:
                             title = row[2]
 
-                        log.debug("recordtype, rowid, title: %s, %s, %s" % (recordtype, rowid, title))
+                        log.debug("recordtype, rowid, title: %s, %s, %s", recordtype, rowid, title)
 
                         if searchcontainer:
                             searchfieldtype = recordtype
@@ -5108,7 +5265,7 @@ class MediaServer(object):
                         folderartid = None if not 'folderartid' in row.keys() else row['folderartid']
                         trackartid = None if not 'trackartid' in row.keys() else row['trackartid']
 
-                        log.debug('%s, %s, %s, %s' % (folderart, trackart, folderartid, trackartid))
+                        log.debug('%s, %s, %s, %s', folderart, trackart, folderartid, trackartid)
 
                         if folderart or trackart:
                             cover, artid = self.choosecover(folderart, trackart, folderartid, trackartid)
@@ -5128,9 +5285,8 @@ class MediaServer(object):
                 #                    coverres = self.proxyaddress + '/WMPNSSv3/' + dummycoverfile
                                 coverres = self.proxyaddress + '/wmp/' + dummycoverfile
                 #                log.debug("coverres: %s", coverres)
-                                dummycoverstaticfile = webserver.StaticFileSonos(dummycoverfile, cvfile, cvpath, cover=cover)
                 #                log.debug("dummycoverstaticfile: %s", dummycoverstaticfile)
-                                self.proxy.wmpcontroller2.add_static_file(dummycoverstaticfile)
+                                self.proxy.wmpcontroller2.add_lazy_file(webserver.StaticFileSonos, dummycoverfile, cvfile, cvpath, cover=cover)
                 #                log.debug("after add_static_file")
                             elif cover != '':
                                 cvfile = getFile(cover)
@@ -5139,8 +5295,7 @@ class MediaServer(object):
                                 dummycoverfile = self.dbname + '.' + str(artid) + '.' + coverfiletype
                 #                    coverres = self.proxyaddress + '/WMPNSSv3/' + dummycoverfile
                                 coverres = self.proxyaddress + '/wmp/' + dummycoverfile
-                                dummycoverstaticfile = webserver.StaticFileSonos(dummycoverfile, cvfile, cvpath)    # TODO: pass contenttype
-                                self.proxy.wmpcontroller2.add_static_file(dummycoverstaticfile)
+                                self.proxy.wmpcontroller2.add_lazy_file(webserver.StaticFileSonos, dummycoverfile, cvfile, cvpath)    # TODO: pass contenttype
 
                         log.debug(coverres)
 
@@ -5150,7 +5305,7 @@ class MediaServer(object):
 
                         if searchtype == 'lower':
 
-                            log.debug('itemidprefixes: %s' % itemidprefixes)
+                            log.debug('itemidprefixes: %s', itemidprefixes)
                             # TODO - fix this search on lower levels
                             rowitemidprefix = itemidprefixes[recordtype]
 
@@ -5262,37 +5417,26 @@ class MediaServer(object):
                             if suffix: title = '%s%s' % (title, suffix)
 
                         cover, artid = self.choosecover(folderart, trackart, folderartid, trackartid)
-                        mime = fixMime(mime)
-
                         wsfile = filename
                         wspath = os.path.join(path, filename)
                         path = self.convert_path(path)
                         filepath = path + filename
                         filepath = encode_path(filepath)
                         filepath = escape(filepath, escape_entities)
-                        protocol = getProtocol(mime)
-                        contenttype = mime
-                        filetype = getFileType(filename)
-
-                        if SMAPI != '' and self.source == 'SMAPI':
-                            transcode, newtype, ext = checksmapitranscode(filetype, bitrate, samplerate, bitspersample, channels, codec)
-                            if transcode:
-                                mime = getMime(ext)
-                        else:
-                            transcode, newtype = checktranscode(filetype, bitrate, samplerate, bitspersample, channels, codec)
+                        contenttype, protocol, filetype, stream, transcode, newtype, mime = \
+                            getFormat(filename, mime, bitrate, samplerate, bitspersample, channels, codec,
+                                      smapi=SMAPI != '' and self.source == 'SMAPI')
                         if transcode:
                             dummyfile = self.dbname + '.' + id + '.' + newtype
                         else:
                             dummyfile = self.dbname + '.' + id + '.' + filetype
                         res = self.proxyaddress + '/WMPNSSv3/' + dummyfile
                         if transcode:
-                            log.debug('\ndummyfile: %s\nwsfile: %s\nwspath: %s\ncontenttype: %s\ntranscodetype: %s' % (dummyfile, wsfile, wspath, contenttype, newtype))
-                            dummystaticfile = webserver.TranscodedFileSonos(dummyfile, wsfile, wspath, newtype, contenttype, cover=cover)
-                            self.proxy.wmpcontroller.add_transcoded_file(dummystaticfile)
+                            log.debug('\ndummyfile: %s\nwsfile: %s\nwspath: %s\ncontenttype: %s\ntranscodetype: %s', dummyfile, wsfile, wspath, contenttype, newtype)
+                            self.proxy.wmpcontroller.add_lazy_file(webserver.TranscodedFileSonos, dummyfile, wsfile, wspath, newtype, contenttype, cover=cover)
                         else:
-                            log.debug('\ndummyfile: %s\nwsfile: %s\nwspath: %s\ncontenttype: %s' % (dummyfile, wsfile, wspath, contenttype))
-                            dummystaticfile = webserver.StaticFileSonos(dummyfile, wsfile, wspath, contenttype, cover=cover)
-                            self.proxy.wmpcontroller.add_static_file(dummystaticfile)
+                            log.debug('\ndummyfile: %s\nwsfile: %s\nwspath: %s\ncontenttype: %s', dummyfile, wsfile, wspath, contenttype)
+                            self.proxy.wmpcontroller.add_lazy_file(webserver.StaticFileSonos, dummyfile, wsfile, wspath, contenttype, cover=cover)
 
                         if self.source == 'SMAPI':
 
@@ -5311,9 +5455,8 @@ class MediaServer(object):
                 #                    coverres = self.proxyaddress + '/WMPNSSv3/' + dummycoverfile
                                 coverres = self.proxyaddress + '/wmp/' + dummycoverfile
                 #                log.debug("coverres: %s", coverres)
-                                dummycoverstaticfile = webserver.StaticFileSonos(dummycoverfile, cvfile, cvpath, cover=cover)
                 #                log.debug("dummycoverstaticfile: %s", dummycoverstaticfile)
-                                self.proxy.wmpcontroller2.add_static_file(dummycoverstaticfile)
+                                self.proxy.wmpcontroller2.add_lazy_file(webserver.StaticFileSonos, dummycoverfile, cvfile, cvpath, cover=cover)
                 #                log.debug("after add_static_file")
                             elif cover != '':
                                 cvfile = getFile(cover)
@@ -5322,8 +5465,7 @@ class MediaServer(object):
                                 dummycoverfile = self.dbname + '.' + str(artid) + '.' + coverfiletype
                 #                    coverres = self.proxyaddress + '/WMPNSSv3/' + dummycoverfile
                                 coverres = self.proxyaddress + '/wmp/' + dummycoverfile
-                                dummycoverstaticfile = webserver.StaticFileSonos(dummycoverfile, cvfile, cvpath)    # TODO: pass contenttype
-                                self.proxy.wmpcontroller2.add_static_file(dummycoverstaticfile)
+                                self.proxy.wmpcontroller2.add_lazy_file(webserver.StaticFileSonos, dummycoverfile, cvfile, cvpath)    # TODO: pass contenttype
 
                         else:
 
@@ -5333,8 +5475,7 @@ class MediaServer(object):
                                 coverfiletype = getFileType(cvfile)
                                 dummycoverfile = self.dbname + '.' + str(artid) + '.' + coverfiletype
                                 coverres = self.proxyaddress + '/WMPNSSv3/' + dummycoverfile
-                                dummycoverstaticfile = webserver.StaticFileSonos(dummycoverfile, cvfile, cvpath)    # TODO: pass contenttype
-                                self.proxy.wmpcontroller2.add_static_file(dummycoverstaticfile)
+                                self.proxy.wmpcontroller2.add_lazy_file(webserver.StaticFileSonos, dummycoverfile, cvfile, cvpath)    # TODO: pass contenttype
 
                         iduration = int(length)
                         duration = maketime(float(length))
@@ -5378,7 +5519,7 @@ class MediaServer(object):
         if not self.proxy.db_persist_connection:
             db.close()
 
-        log.debug("end: %.3f" % time.time())
+        log.debug("end: %.3f", time.time())
 
         if self.source == 'SMAPI':
 
@@ -5467,42 +5608,43 @@ class MediaServer(object):
 
 
 
+    @timed('keyword')
     def keywordQuery(self, *args, **kwargs):
 
         # TODO: fix error conditions (return zero)
         log.debug("Mediaserver.keywordQuery: %s", kwargs)
 
-        log.debug("start: %.3f" % time.time())
+        log.debug("start: %.3f", time.time())
 
         # process params
         ################
 
         controllername = kwargs.get('Controller', '')
         controlleraddress = kwargs.get('Address', '')
-        log.debug('Controller: %s' % controllername)
-        log.debug('Address: %s' % controlleraddress)
+        log.debug('Controller: %s', controllername)
+        log.debug('Address: %s', controlleraddress)
 
         queryID = kwargs.get('QueryID','')
-        log.debug('queryID: %s' % str(queryID))
+        log.debug('queryID: %s', queryID)
 
         ids = queryID.split(':')
-        log.debug('ids: %s' % ids)
+        log.debug('ids: %s', ids)
 
         term = kwargs.get('term', None)
-        log.debug("term: %s" % term)
+        log.debug("term: %s", term)
 
         searchfields = kwargs.get('searchfields', None)
-        log.debug("searchfields: %s" % searchfields)
+        log.debug("searchfields: %s", searchfields)
 
         SMAPI = kwargs.get('SMAPI', '')
-        log.debug('SMAPI: %s' % SMAPI)
+        log.debug('SMAPI: %s', SMAPI)
         if SMAPI.startswith('!ALPHA'):
             idhierarchy = [SMAPI[6:]]
         else:
             idhierarchy = SMAPI.split(':')
-        log.debug('idhierarchy: %s' % idhierarchy)
+        log.debug('idhierarchy: %s', idhierarchy)
         idkeys = kwargs.get('idkeys', [])
-        log.debug('idkeys: %s' % idkeys)
+        log.debug('idkeys: %s', idkeys)
 
         startingIndex = int(kwargs['StartingIndex'])
         requestedCount = int(kwargs['RequestedCount'])
@@ -5520,7 +5662,7 @@ class MediaServer(object):
         if self.proxy.db_persist_connection:
             db = self.proxy.db
         else:
-            db = sqlite3.connect(self.dbspec)
+            db = sqlite3.connect(self.dbspec, factory=TimedConnection)
         db.row_factory = sqlite3.Row
         c = db.cursor()
 
@@ -5533,8 +5675,8 @@ class MediaServer(object):
         # ID is always passed prepended with root name
         rootname, indexkeys = self.get_index_parts(ids)
 
-        log.debug('rootname: %s' % rootname)
-        log.debug('indexkeys: %s' % indexkeys)
+        log.debug('rootname: %s', rootname)
+        log.debug('indexkeys: %s', indexkeys)
 
         itemidprefix = rootname
 
@@ -5556,17 +5698,17 @@ class MediaServer(object):
             if subterm.startswith('track='):
                 track = subterm[6:]
                 orderby = ','.join(filter(None,(orderby, 'title')))
-        log.debug('orderby: %s' % orderby)
+        log.debug('orderby: %s', orderby)
 
         if not albumartist and not album and not track:
             return items, -2, -2, 'container'
 
-        log.debug('albumartist=%s, album=%s, track=%s' % (albumartist, album, track))
+        log.debug('albumartist=%s, album=%s, track=%s', albumartist, album, track)
         albumartistwhere = '' if not albumartist else "albumartist like '%%%s%%'" % (albumartist)
         albumwhere = '' if not album else "album like '%%%s%%'" % (album)
         trackwhere = '' if not track else "title like '%%%s%%'" % (track)
         where = ' and '.join(filter(None,(albumartistwhere, albumwhere, trackwhere)))
-        log.debug('where: %s' % where)
+        log.debug('where: %s', where)
 
 #        countstatement = "select count(title) from tracks where %s" % (where)
 #        statement = "select 'track' as recordtype, rowid, id, title, artist, album, genre, tracknumber, albumartist, composer, codec, length, path, filename, folderart, trackart, bitrate, samplerate, bitspersample, channels, mime, folderartid, trackartid from tracks where %s order by %s limit ?, ?" % (where, orderby)
@@ -5591,7 +5733,7 @@ class MediaServer(object):
 
         c.execute(countstatement)
         totalMatches, = c.fetchone()
-        log.debug('totalMatches: %s' % totalMatches)
+        log.debug('totalMatches: %s', totalMatches)
 
 #        foundalbumartists = []
 #        foundalbumartistalbums = []            
@@ -5643,37 +5785,26 @@ class MediaServer(object):
 
                 if recordtype == 'track':
 
-                    mime = fixMime(mime)
-
                     wsfile = filename
                     wspath = os.path.join(path, filename)
                     path = self.convert_path(path)
                     filepath = path + filename
                     filepath = encode_path(filepath)
                     filepath = escape(filepath, escape_entities)
-                    protocol = getProtocol(mime)
-                    contenttype = mime
-                    filetype = getFileType(filename)
-
-                    if SMAPI != '' and self.source == 'SMAPI':
-                        transcode, newtype, ext = checksmapitranscode(filetype, bitrate, samplerate, bitspersample, channels, codec)
-                        if transcode:
-                            mime = getMime(ext)
-                    else:
-                        transcode, newtype = checktranscode(filetype, bitrate, samplerate, bitspersample, channels, codec)
+                    contenttype, protocol, filetype, stream, transcode, newtype, mime = \
+                        getFormat(filename, mime, bitrate, samplerate, bitspersample, channels, codec,
+                                  smapi=SMAPI != '' and self.source == 'SMAPI')
                     if transcode:
                         dummyfile = self.dbname + '.' + id + '.' + newtype
                     else:
                         dummyfile = self.dbname + '.' + id + '.' + filetype
                     res = self.proxyaddress + '/WMPNSSv3/' + dummyfile
                     if transcode:
-                        log.debug('\ndummyfile: %s\nwsfile: %s\nwspath: %s\ncontenttype: %s\ntranscodetype: %s' % (dummyfile, wsfile, wspath, contenttype, newtype))
-                        dummystaticfile = webserver.TranscodedFileSonos(dummyfile, wsfile, wspath, newtype, contenttype, cover=cover)
-                        self.proxy.wmpcontroller.add_transcoded_file(dummystaticfile)
+                        log.debug('\ndummyfile: %s\nwsfile: %s\nwspath: %s\ncontenttype: %s\ntranscodetype: %s', dummyfile, wsfile, wspath, contenttype, newtype)
+                        self.proxy.wmpcontroller.add_lazy_file(webserver.TranscodedFileSonos, dummyfile, wsfile, wspath, newtype, contenttype, cover=cover)
                     else:
-                        log.debug('\ndummyfile: %s\nwsfile: %s\nwspath: %s\ncontenttype: %s' % (dummyfile, wsfile, wspath, contenttype))
-                        dummystaticfile = webserver.StaticFileSonos(dummyfile, wsfile, wspath, contenttype, cover=cover)
-                        self.proxy.wmpcontroller.add_static_file(dummystaticfile)
+                        log.debug('\ndummyfile: %s\nwsfile: %s\nwspath: %s\ncontenttype: %s', dummyfile, wsfile, wspath, contenttype)
+                        self.proxy.wmpcontroller.add_lazy_file(webserver.StaticFileSonos, dummyfile, wsfile, wspath, contenttype, cover=cover)
 
                 if self.source == 'SMAPI':
 
@@ -5692,9 +5823,8 @@ class MediaServer(object):
         #                    coverres = self.proxyaddress + '/WMPNSSv3/' + dummycoverfile
                         coverres = self.proxyaddress + '/wmp/' + dummycoverfile
         #                log.debug("coverres: %s", coverres)
-                        dummycoverstaticfile = webserver.StaticFileSonos(dummycoverfile, cvfile, cvpath, cover=cover)
         #                log.debug("dummycoverstaticfile: %s", dummycoverstaticfile)
-                        self.proxy.wmpcontroller2.add_static_file(dummycoverstaticfile)
+                        self.proxy.wmpcontroller2.add_lazy_file(webserver.StaticFileSonos, dummycoverfile, cvfile, cvpath, cover=cover)
         #                log.debug("after add_static_file")
                     elif cover != '':
                         cvfile = getFile(cover)
@@ -5703,8 +5833,7 @@ class MediaServer(object):
                         dummycoverfile = self.dbname + '.' + str(artid) + '.' + coverfiletype
         #                    coverres = self.proxyaddress + '/WMPNSSv3/' + dummycoverfile
                         coverres = self.proxyaddress + '/wmp/' + dummycoverfile
-                        dummycoverstaticfile = webserver.StaticFileSonos(dummycoverfile, cvfile, cvpath)    # TODO: pass contenttype
-                        self.proxy.wmpcontroller2.add_static_file(dummycoverstaticfile)
+                        self.proxy.wmpcontroller2.add_lazy_file(webserver.StaticFileSonos, dummycoverfile, cvfile, cvpath)    # TODO: pass contenttype
 
                 else:
 
@@ -5714,8 +5843,7 @@ class MediaServer(object):
                         coverfiletype = getFileType(cvfile)
                         dummycoverfile = self.dbname + '.' + str(artid) + '.' + coverfiletype
                         coverres = self.proxyaddress + '/WMPNSSv3/' + dummycoverfile
-                        dummycoverstaticfile = webserver.StaticFileSonos(dummycoverfile, cvfile, cvpath)    # TODO: pass contenttype
-                        self.proxy.wmpcontroller2.add_static_file(dummycoverstaticfile)
+                        self.proxy.wmpcontroller2.add_lazy_file(webserver.StaticFileSonos, dummycoverfile, cvfile, cvpath)    # TODO: pass contenttype
 
                 if recordtype == 'track':
                     iduration = int(length)
@@ -5794,7 +5922,7 @@ class MediaServer(object):
         if not self.proxy.db_persist_connection:
             db.close()
 
-        log.debug("end: %.3f" % time.time())
+        log.debug("end: %.3f", time.time())
 
         if self.source == 'SMAPI':
 
@@ -5824,9 +5952,9 @@ class MediaServer(object):
     def format_range(self, rangefield, indexrange):
 
         rangestart, rangeend, units = indexrange
-        log.debug('rangestart: %s' % rangestart)
-        log.debug('rangeend: %s' % rangeend)
-        log.debug('units: %s' % units)
+        log.debug('rangestart: %s', rangestart)
+        log.debug('rangeend: %s', rangeend)
+        log.debug('units: %s', units)
 
         # ignore empty range
         if rangestart == '' and rangeend == '':
@@ -5884,8 +6012,8 @@ class MediaServer(object):
                 elif units == 'years':
                     rangestartdate = now+datedelta(years=rangeend)
                     rangeenddate = now+datedelta(years=rangestart)
-            log.debug('rangestartdate: %s' % rangestartdate)
-            log.debug('rangeenddate: %s' % rangeenddate)
+            log.debug('rangestartdate: %s', rangestartdate)
+            log.debug('rangeenddate: %s', rangeenddate)
 
         # now convert the input so the database understands it
 
@@ -5904,7 +6032,7 @@ class MediaServer(object):
             rangeendstring = escape_sql(rangeendstring)
             rangewhere = "%s between '%s' and '%s'" % (rangefield, rangestartstring, rangeendstring)
 
-        log.debug('rangewhere: %s' % rangewhere)
+        log.debug('rangewhere: %s', rangewhere)
 
         return 'where', rangewhere
 
@@ -5926,7 +6054,7 @@ class MediaServer(object):
         originalMatches = totalMatches
         if totalMatches > rangecount:
             totalMatches = rangecount
-            log.debug('range adjusted count: %s' % totalMatches)
+            log.debug('range adjusted count: %s', totalMatches)
 
         # for the statements we need to add additional limits
         # work out bounding limit clause
@@ -5943,13 +6071,13 @@ class MediaServer(object):
             orderstatement = 'SELECT * from (%s' % orderstatement
             # insert outer select limit before call limit
             orderstatement = orderstatement.replace(' limit ', ' %s limit ' % limitclause)
-            log.debug('range adjusted orderstatement: %s' % orderstatement)
+            log.debug('range adjusted orderstatement: %s', orderstatement)
 
         # alphastatement
         if alphastatement != '':
             # we need to add a bounding limit to the inner query
             alphastatement = alphastatement.replace('order by %%s)', 'order by %%s limit %s)' % limitclause)
-            log.debug('range adjusted alphastatement: %s' % alphastatement)
+            log.debug('range adjusted alphastatement: %s', alphastatement)
 
         return totalMatches, orderstatement, alphastatement
 
@@ -6048,7 +6176,7 @@ class MediaServer(object):
                 for key in self.proxy_simple_keys:
                     if line.startswith(key):
                         value = line[len(key):].strip()
-                        log.debug("%s - %s" % (key, value))
+                        log.debug("%s - %s", key, value)
                         simple_keys[key[:-1]] = value
         if processing_index:
             if simple_keys != self.proxy_simple_key_dict:
@@ -6222,7 +6350,7 @@ class MediaServer(object):
         if self.proxy.db_persist_connection:
             db = self.proxy.db
         else:
-            db = sqlite3.connect(self.dbspec)
+            db = sqlite3.connect(self.dbspec, factory=TimedConnection)
 #        log.debug(db)
         c = db.cursor()
         statement = "select lastscanid from params where key = '1'"
@@ -6245,7 +6373,7 @@ class MediaServer(object):
         if self.proxy.db_persist_connection:
             db = self.proxy.db
         else:
-            db = sqlite3.connect(self.dbspec)
+            db = sqlite3.connect(self.dbspec, factory=TimedConnection)
 #        log.debug(db)
         c = db.cursor()
 
@@ -6276,7 +6404,7 @@ class MediaServer(object):
         updateid1 = '10,%s' % (self.systemupdateid)
         self._state_variables['ContainerUpdateIDs'].update(updateid1)
         self._state_variables['SystemUpdateID'].update(self.systemupdateid)
-        log.debug("ContainerUpdateIDs value: %s" % self._state_variables['ContainerUpdateIDs'].get_value())
+        log.debug("ContainerUpdateIDs value: %s", self._state_variables['ContainerUpdateIDs'].get_value())
         self.systemupdateid += 1
         updateid2 = '11,%s' % (self.systemupdateid)
         self.systemupdateid += 1
@@ -6287,7 +6415,7 @@ class MediaServer(object):
         self.playlistupdateid = self.systemupdateid
         self._state_variables['ContainerUpdateIDs'].update(updateid)
         self._state_variables['SystemUpdateID'].update(self.systemupdateid)
-        log.debug("ContainerUpdateIDs value: %s" % self._state_variables['ContainerUpdateIDs'].get_value())
+        log.debug("ContainerUpdateIDs value: %s", self._state_variables['ContainerUpdateIDs'].get_value())
 
 
     #########
@@ -6341,9 +6469,9 @@ class MediaServer(object):
 
     def get_icon(self, indexkey):
         # TODO: support different per controller?
-        log.debug('get_icon indexkey: %s' % indexkey)
+        log.debug('get_icon indexkey: %s', indexkey)
         icon_entry = self.icon_entries.get(indexkey, None)
-        log.debug('get_icon icon_entry: %s' % icon_entry)
+        log.debug('get_icon icon_entry: %s', icon_entry)
         icon = ''
         if icon_entry:
             icon = self.proxy.index_icons.get(icon_entry, '')
@@ -6353,8 +6481,8 @@ class MediaServer(object):
 
     def get_orderby(self, sorttype, controller, dynamic=True, orderby=None):
 
-        log.debug('get_orderby sorttype: %s' % sorttype)
-        log.debug('get_orderby orderby: %s' % orderby)
+        log.debug('get_orderby sorttype: %s', sorttype)
+        log.debug('get_orderby orderby: %s', orderby)
         albumtypes = self.user_index_key_dict['show_albums']
 
         # static = sort_order, entry_prefix, entry_suffix, albumtypes
@@ -6401,7 +6529,7 @@ class MediaServer(object):
                     elif values[namekey].lower() == 'all' and values['controller'].lower() == 'all' and \
                          not bothfound and not proxyfound and not controllerfound and not foundvalues:
                         foundvalues = values
-            log.debug('foundvalues: %s' % foundvalues)
+            log.debug('foundvalues: %s', foundvalues)
             if not foundvalues:
                 if dynamic: 
                     return default_dynamic_orderby
@@ -6418,135 +6546,59 @@ class MediaServer(object):
                     return (sort_order, foundvalues['entry_prefix'], foundvalues['entry_suffix'], foundvalues['show_albums'], range_field, foundvalues['index_range'])
 
     def static_makepresuffix(self, fix, replace, fixdict, ps):
-        EMPTY = '__EMPTY__'
         outfix = ''
         if fix and fix != '':
 
             fixes, entries, entrystring = self.get_code_snippets(fix)
-            log.debug('fixes: %s' % fixes)
-            log.debug('entries: %s' % entries)
-            log.debug('entrystring: %s' % entrystring)
-#            fix = fix.replace(' ', '')
-#            fixes = fix.lower().split(',')
 
-            for (fix, snippet) in fixes:
+            for (fix, render) in fixes:
                 if fix in fixdict:
-                    data = fixdict[fix]
-                    if snippet:
-                        if data == '':
-                            data = EMPTY
-                    else:
-                        if fix in ['lastplayed', 'inserted', 'created', 'lastmodified', 'lastscanned']:
-                            if data == '':
-                                data = EMPTY
-                            else:
-                                try:
-                                    data = float(data)
-                                    data = time.strftime(self.metadata_date_format, time.gmtime(data))
-                                except TypeError:
-                                    data = EMPTY
-                        elif fix == 'playcount':
-                            if data == '': data = '0'
-                        elif fix == 'year':
-                            if data == '':
-                                data = EMPTY
-                            else:
-                                try:
-                                    data = datetime.date.fromordinal(data).strftime(self.metadata_date_format)
-                                except TypeError:
-                                    data = EMPTY
-                        else:
-                            # other tags just pass through
-                            if data == '': data = EMPTY
-
-                    if data == EMPTY and ps == 'P' and self.dont_display_separator_for_empty_prefix == False:
-                        pass
-                    elif data == EMPTY and ps == 'S' and self.dont_display_separator_for_empty_suffix == False:
-                        pass
-                    else:
-                        if data == EMPTY: 
-                            data = self.metadata_empty
-                        else:
-                            if snippet:
-                                log.debug('data before: %s' % data)
-                                log.debug('%s=%s' % (fix, data))
-                                log.debug('data=%s' % snippet)
-                                if isinstance(data, Number):
-                                    exec('%s=%s' % (fix, data))
-                                else:
-                                    exec('%s="%s"' % (fix, data))
-                                exec('data=%s' % snippet)
-                                log.debug('data after: %s' % data)
-                        outfix += replace % data
+                    outfix += self.render_presuffix(render(fixdict[fix]), replace, ps)
         return outfix
 
     def dynamic_makepresuffix(self, snippetlist, replace, fixdata, ps):
-        log.debug('snippetlist: %s' % snippetlist)
-#        log.debug(replace)
-#        log.debug(fixdata)
+        log.debug('snippetlist: %s', snippetlist)
 
-        EMPTY = '__EMPTY__'
         outfix = ''
         if snippetlist and snippetlist != []:
             fixcount = 0
-            for (fix, snippet) in snippetlist:
-                data = fixdata[fixcount]
-                if snippet:
-                    if data == '':
-                        data = EMPTY
-                else:
-                    if fix in ['lastplayed', 'inserted', 'created', 'lastmodified', 'lastscanned']:
-                        if data == '' or data == 0:
-                            data = EMPTY
-                        else:
-                            try:
-                                data = float(data)
-                                data = time.strftime(self.metadata_date_format, time.gmtime(data))
-                            except TypeError:
-                                data = EMPTY
-                    elif fix == 'playcount':
-                        if data == '': data = '0'
-                    elif fix == 'year':
-                        if data == '':
-                            data = EMPTY
-                        else:
-                            try:
-                                data = datetime.date.fromordinal(data).strftime(self.metadata_date_format)
-                            except TypeError:
-                                data = EMPTY
-                    else:
-                        # other tags just pass through
-                        if data == '': data = EMPTY
-
-                if data == EMPTY and ps == 'P' and self.dont_display_separator_for_empty_prefix == False:
-                    pass
-                elif data == EMPTY and ps == 'S' and self.dont_display_separator_for_empty_suffix == False:
-                    pass
-                else:
-                    if data == EMPTY: 
-                        data = self.metadata_empty
-                    else:
-                        if snippet:
-                            log.debug('data before: %s' % data)
-                            log.debug('%s=%s' % (fix, data))
-                            log.debug('data=%s' % snippet)
-                            if isinstance(data, Number):
-                                exec('%s=%s' % (fix, data))
-                            else:
-                                exec('%s="%s"' % (fix, data))
-                            exec('data=%s' % snippet)
-                            log.debug('data after: %s' % data)
-                    outfix += replace % data
+            for (fix, render) in snippetlist:
+                outfix += self.render_presuffix(render(fixdata[fixcount]), replace, ps)
                 fixcount += 1
         return outfix
 
+    def render_presuffix(self, data, replace, ps):
+        if data == EMPTY_ENTRY:
+            if ps == 'P' and self.dont_display_separator_for_empty_prefix == False:
+                return ''
+            elif ps == 'S' and self.dont_display_separator_for_empty_suffix == False:
+                return ''
+            data = self.metadata_empty
+        return replace % data
+
+    def load_code_snippets(self):
+        # compile the entry prefix/suffix snippets of all indexes up front
+        self.code_snippets = {}
+        for values in self.index_settings.itervalues():
+            for key in ('entry_prefix', 'entry_suffix'):
+                fix = values.get(key, None)
+                if fix:
+                    self.get_code_snippets(fix)
+
     def get_code_snippets(self, fix):
+        # parsed and compiled once per fix string
+        snippets = self.code_snippets.get(fix, None)
+        if snippets == None:
+            snippets = self.code_snippets[fix] = self.parse_code_snippets(fix)
+        return snippets
+
+    def parse_code_snippets(self, fix):
 
         # entries are separated by comma
         # code snippets are surrounded by braces
-        # create list of entry/code tuples, list of entries and string of entries
+        # create list of entry/renderer tuples, list of entries and string of entries
         # fix = "year, year{year[-2:]}, year{'--' if year == '' else year[-2:]}, year"
-        # snippetlist = [('year', None), ('year', 'year[-2:]'), ('year', "'--' if year == '' else year[-2:]"), ('year', None)]
+        # snippetlist = [('year', <render>), ('year', <render year[-2:]>), ('year', <render '--' if year == '' else year[-2:]>), ('year', <render>)]
         # entrylist = ['year','year','year','year']
         # entrystring = 'year,year,year,year'
 
@@ -6582,7 +6634,7 @@ class MediaServer(object):
                 snippet = None
             i += 1
             entrylist += [entry]
-            snippetlist += [(entry, snippet)]
+            snippetlist += [(entry, self.compile_code_snippet(entry, snippet))]
 
 #        log.debug('snippetlist: %s' % snippetlist)
 #        log.debug('entrylist: %s' % entrylist)
@@ -6590,6 +6642,64 @@ class MediaServer(object):
 
         return snippetlist, entrylist, ','.join(entrylist)
 
+    def compile_code_snippet(self, entry, snippet):
+
+        # returns a function that converts a value of the entry field
+        # into the text to display, or EMPTY_ENTRY if there is none.
+        # A code snippet is compiled into a function taking the field
+        # value as a local named after the entry, e.g. year{year[-2:]}
+        # becomes lambda year: (year[-2:])
+
+        if snippet:
+            try:
+                code = eval(compile('lambda %s: (%s)' % (entry, snippet), '<%s snippet>' % entry, 'eval'), globals())
+            except SyntaxError, e:
+                log.warning('Invalid code snippet for %s: {%s} (%s)', entry, snippet, e)
+                code = None
+            if code:
+                def render(data):
+                    if data == '':
+                        return EMPTY_ENTRY
+                    return code(data)
+                return render
+
+        dateformat = self.metadata_date_format
+
+        if entry in ['lastplayed', 'inserted', 'created', 'lastmodified', 'lastscanned']:
+            def render(data):
+                if data == '' or data == 0:
+                    return EMPTY_ENTRY
+                try:
+                    return time.strftime(dateformat, time.gmtime(float(data)))
+                except (TypeError, ValueError):
+                    return EMPTY_ENTRY
+        elif entry == 'playcount':
+            def render(data):
+                if data == '':
+                    return '0'
+                return data
+        elif entry == 'year':
+            # years are ordinals, and there are few distinct ones
+            years = {}
+            def render(data):
+                if data == '':
+                    return EMPTY_ENTRY
+                year = years.get(data, None)
+                if year == None:
+                    try:
+                        year = datetime.date.fromordinal(data).strftime(dateformat)
+                    except (TypeError, ValueError):
+                        year = EMPTY_ENTRY
+                    years[data] = year
+                return year
+        else:
+            # other tags just pass through
+            def render(data):
+                if data == '':
+                    return EMPTY_ENTRY
+                return data
+        return render
+
     def get_index_parts(self, idkeys):
         # split root name from keys and return both separately
         rootname = idkeys[0]
@@ -6829,14 +6939,14 @@ class MediaServer(object):
             dbo = ''
             for k,v in data.iteritems():
                 dbo += '\n\t\t\t\t\t\t\t\t\t\t\t\t%s: %s' % (k, v)
-            log.debug('%s:%s' % (label, dbo))
+            log.debug('%s:%s', label, dbo)
         elif isinstance(data, (list, tuple, set, frozenset)):
             dbo = ''
             for v in data:
                 dbo += '\n\t\t\t\t\t\t\t\t\t\t\t\t%s' % (repr(v))
-            log.debug('%s:%s' % (label, dbo))
+            log.debug('%s:%s', label, dbo)
         else:
-            log.debug('%s: %s' % (label, data))
+            log.debug('%s: %s', label, data)
 
 
 #################
@@ -6915,6 +7025,36 @@ def getProtocol(mime):
 def getFileType(filename):
     return filename.split('.')[-1]
 
+# how a track is served only depends on its file type, mime and resolution
+# (the transcode tables don't look at bitrate or codec), and there are few
+# distinct combinations in a library, so decisions are cached
+format_cache = {}
+
+def getFormat(filename, mime, bitrate, samplerate, bitspersample, channels, codec, smapi=False, streams=False):
+    # returns (contenttype, protocol, filetype, stream, transcode, newtype, mime)
+    # where contenttype is the mime of the file and mime is the mime served
+    filetype = getFileType(filename)
+    stream = False
+    if streams:
+        stream, streamtype = checkstream(filename, filetype)
+    key = (filetype, stream, mime, samplerate, bitspersample, channels, smapi)
+    format = format_cache.get(key, None)
+    if format == None:
+        contenttype = fixMime(mime)
+        protocol = getProtocol(contenttype)
+        servedmime = contenttype
+        if stream:
+            transcode = False
+            newtype = streamtype
+        elif smapi:
+            transcode, newtype, ext = checksmapitranscode(filetype, bitrate, samplerate, bitspersample, channels, codec)
+            if transcode:
+                servedmime = getMime(ext)
+        else:
+            transcode, newtype = checktranscode(filetype, bitrate, samplerate, bitspersample, channels, codec)
+        format = format_cache[key] = (contenttype, protocol, filetype, stream, transcode, newtype, servedmime)
+    return format
+
 def getFile(path):
     return path.split(os.sep)[-1]
 
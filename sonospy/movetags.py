@@ -55,10 +55,15 @@ def process_tags(args, options, tagdatabase, trackdatabase):
     # DB size is not constrained as the library is expected to have sufficient disk available
     # artist/albumartist/composer/genre are multi entry fields, so can result in multiple lookup records
     # lookup records are unique
-    # state is not maintained across tag_update/track records to save memory - the db is checked for duplicates on insert
+    # lookup rows that repeat across tracks (e.g. artist/genre/album) written in this run are remembered
+    # (written_lookups) so repeats are not reinserted, rows from previous runs and per track rows
+    # (which never repeat across tracks so are not kept in memory) are left to the unique indexes (insert or ignore)
 
     logstring = "Processing tags"
     filelog.write_log(logstring)
+
+    written_lookups.clear()
+    duplicate_counts.clear()
     
     db2 = sqlite3.connect(trackdatabase)
     db2.execute("PRAGMA synchronous = 0;")
@@ -451,6 +456,9 @@ def process_tags(args, options, tagdatabase, trackdatabase):
 
                 if updatetype == 'D' or updatetype == 'U':
                 
+                    # the deletes below can remove lookup rows written earlier in this run
+                    written_lookups.clear()
+
                     # remove redundant separators
                     o_title = remove_sep(o_title)
                 
@@ -581,14 +589,21 @@ def process_tags(args, options, tagdatabase, trackdatabase):
                             # assume we have a duplicate
                             # Sonos doesn't like duplicate names, so append a number and keep trying
                             
-                            tstring = title + " (%"
-                            try:
-                                cs2.execute("""select max(duplicate) from tracks where title like ? and album=? and artist=? and tracknumber=?""",
-                                            (tstring, albumliststringfull, artistliststring, tracknumber))
-                                row = cs2.fetchone()
-                            except sqlite3.Error, e:
-                                errorstring = "Error finding max duplicate on track insert: %s" % e
-                                filelog.write_error(errorstring)
+                            # the db is only asked for the highest number used the first time
+                            # a title is duplicated in this run
+                            dupkey = duplicate_key(title, albumliststringfull, artistliststring, tracknumber)
+                            row = None
+                            if dupkey in duplicate_counts:
+                                row = (duplicate_counts[dupkey], )
+                            else:
+                                tstring = title + " (%"
+                                try:
+                                    cs2.execute("""select max(duplicate) from tracks where title like ? and album=? and artist=? and tracknumber=?""",
+                                                (tstring, albumliststringfull, artistliststring, tracknumber))
+                                    row = cs2.fetchone()
+                                except sqlite3.Error, e:
+                                    errorstring = "Error finding max duplicate on track insert: %s" % e
+                                    filelog.write_error(errorstring)
                             if row:
                                 tduplicate, = row
                                 # special case for second entry - first won't have been matched
@@ -604,6 +619,7 @@ def process_tags(args, options, tagdatabase, trackdatabase):
                                     cs2.execute('insert into tracks values (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)', tracks)
                                     track_rowid = cs2.lastrowid
                                     duplicate = tcount
+                                    duplicate_counts[dupkey] = tcount
                                 except sqlite3.Error, e:
                                     errorstring = "Error performing duplicate processing on track insert: %s" % e
                                     filelog.write_error(errorstring)
@@ -1061,49 +1077,19 @@ def process_tags(args, options, tagdatabase, trackdatabase):
                                 for genre in genrelist:
                                     for artist in artistlist:
                                         check = (track_rowid, genre, artist, album_id, duplicate, albumtype)
-                                        cs2.execute("""select * from GenreArtistAlbumTrack where track_id=? and genre=? and artist=? and album_id=? and duplicate=? and albumtype=?""", check)
-                                        crow = cs2.fetchone()
-                                        if not crow:
-                                            insert = (track_rowid, genre, artist, album, album_id, duplicate, albumtype)
-                                            logstring = "INSERT GenreArtistAlbumTrack: %s" % str(insert)
-                                            filelog.write_verbose_log(logstring)
-                                            cs2.execute('insert into GenreArtistAlbumTrack values (?,?,?,?,?,?,?)', insert)
+                                        insert_lookup(cs2, 'GenreArtistAlbumTrack', check, (track_rowid, genre, artist, album, album_id, duplicate, albumtype), """track_id=? and genre=? and artist=? and album_id=? and duplicate=? and albumtype=?""", remember=False)
                                     for albumartist in albumartistlist:
                                         check = (track_rowid, genre, albumartist, album_id, duplicate, albumtype)
-                                        cs2.execute("""select * from GenreAlbumartistAlbumTrack where track_id=? and genre=? and albumartist=? and album_id=? and duplicate=? and albumtype=?""", check)
-                                        crow = cs2.fetchone()
-                                        if not crow:
-                                            insert = (track_rowid, genre, albumartist, album, album_id, duplicate, albumtype)
-                                            logstring = "INSERT GenreAlbumartistAlbumTrack: %s" % str(insert)
-                                            filelog.write_verbose_log(logstring)
-                                            cs2.execute('insert into GenreAlbumartistAlbumTrack values (?,?,?,?,?,?,?)', insert)
+                                        insert_lookup(cs2, 'GenreAlbumartistAlbumTrack', check, (track_rowid, genre, albumartist, album, album_id, duplicate, albumtype), """track_id=? and genre=? and albumartist=? and album_id=? and duplicate=? and albumtype=?""", remember=False)
                                 for artist in artistlist:
                                     check = (track_rowid, artist, album_id, duplicate, albumtype)
-                                    cs2.execute("""select * from ArtistAlbumTrack where track_id=? and artist=? and album_id=? and duplicate=? and albumtype=?""", check)
-                                    crow = cs2.fetchone()
-                                    if not crow:
-                                        insert = (track_rowid, artist, album, album_id, duplicate, albumtype)
-                                        logstring = "INSERT ArtistAlbumTrack:" + str(insert)
-                                        filelog.write_verbose_log(logstring)
-                                        cs2.execute('insert into ArtistAlbumTrack values (?,?,?,?,?,?)', insert)
+                                    insert_lookup(cs2, 'ArtistAlbumTrack', check, (track_rowid, artist, album, album_id, duplicate, albumtype), """track_id=? and artist=? and album_id=? and duplicate=? and albumtype=?""", remember=False)
                                 for albumartist in albumartistlist:
                                     check = (track_rowid, albumartist, album_id, duplicate, albumtype)
-                                    cs2.execute("""select * from AlbumartistAlbumTrack where track_id=? and albumartist=? and album_id=? and duplicate=? and albumtype=?""", check)
-                                    crow = cs2.fetchone()
-                                    if not crow:
-                                        insert = (track_rowid, albumartist, album, album_id, duplicate, albumtype)
-                                        logstring = "INSERT AlbumartistAlbumTrack:" + str(insert)
-                                        filelog.write_verbose_log(logstring)
-                                        cs2.execute('insert into AlbumartistAlbumTrack values (?,?,?,?,?,?)', insert)
+                                    insert_lookup(cs2, 'AlbumartistAlbumTrack', check, (track_rowid, albumartist, album, album_id, duplicate, albumtype), """track_id=? and albumartist=? and album_id=? and duplicate=? and albumtype=?""", remember=False)
                                 for composer in composerlist:
                                     check = (track_rowid, composer, album_id, duplicate, albumtype)
-                                    cs2.execute("""select * from ComposerAlbumTrack where track_id=? and composer=? and album_id=? and duplicate=? and albumtype=?""", check)
-                                    crow = cs2.fetchone()
-                                    if not crow:
-                                        insert = (track_rowid, composer, album, album_id, duplicate, albumtype)
-                                        logstring = "INSERT ComposerAlbumTrack:" + str(insert)
-                                        filelog.write_verbose_log(logstring)
-                                        cs2.execute('insert into ComposerAlbumTrack values (?,?,?,?,?,?)', insert)
+                                    insert_lookup(cs2, 'ComposerAlbumTrack', check, (track_rowid, composer, album, album_id, duplicate, albumtype), """track_id=? and composer=? and album_id=? and duplicate=? and albumtype=?""", remember=False)
 
                             if albumtypestring == 'work' or albumtypestring == 'virtual':
 
@@ -1115,13 +1101,7 @@ def process_tags(args, options, tagdatabase, trackdatabase):
 
 #                                                    check = (track_rowid, genreliststring, artistliststringfull, albumartistliststringfull, originalalbum, album, composerliststringfull, duplicate, albumtype, album_tracknumber, coverart, coverartid)
                                                     check = (track_rowid, genre, artist, albumartist, originalalbum, album, composer, duplicate, albumtype, album_tracknumber, coverart, coverartid)
-                                                    cs2.execute("""select * from TrackNumbers where track_id=? and genre=? and artist=? and albumartist=? and album=? and dummyalbum=? and composer=? and duplicate=? and albumtype=? and tracknumber=? and coverart=? and coverartid=?""", check)
-                                                    crow = cs2.fetchone()
-                                                    if not crow:
-                                                        insert = check
-                                                        logstring = "INSERT TrackNumbers:" + str(insert)
-                                                        filelog.write_verbose_log(logstring)
-                                                        cs2.execute('insert into TrackNumbers values (?,?,?,?,?,?,?,?,?,?,?,?)', insert)
+                                                    insert_lookup(cs2, 'TrackNumbers', check, check, remember=False)
 
                         except sqlite3.Error, e:
                             errorstring = "Error inserting album/track lookup details: %s" % e.args[0]
@@ -1182,65 +1162,23 @@ def process_tags(args, options, tagdatabase, trackdatabase):
                                 for genre in genrelist:
                                     for artist in artistlist:
                                         check = (genre, artist)
-                                        cs2.execute("""select * from GenreArtist where genre=? and artist=?""", check)
-                                        crow = cs2.fetchone()
-                                        if not crow:
-                                            insert = check + ('', '')
-                                            logstring = "INSERT GenreArtist: %s" % str(insert)
-                                            filelog.write_verbose_log(logstring)
-                                            cs2.execute('insert into GenreArtist values (?,?,?,?)', insert)
+                                        insert_lookup(cs2, 'GenreArtist', check, check + ('', ''))
                                         check = (album_id, genre, artist, album, duplicate, albumtype, artistsort)
-                                        cs2.execute("""select * from GenreArtistAlbum where album_id=? and genre=? and artist=? and album=? and duplicate=? and albumtype=? and artistsort=?""", check)
-                                        crow = cs2.fetchone()
-                                        if not crow:
-                                            insert = check + ('', '')
-                                            logstring = "INSERT GenreArtistAlbum: %s" % str(insert)
-                                            filelog.write_verbose_log(logstring)
-                                            cs2.execute('insert into GenreArtistAlbum values (?,?,?,?,?,?,?,?,?)', insert)
+                                        insert_lookup(cs2, 'GenreArtistAlbum', check, check + ('', ''))
                                     for albumartist in albumartistlist:
                                         check = (genre, albumartist)
-                                        cs2.execute("""select * from GenreAlbumartist where genre=? and albumartist=?""", check)
-                                        crow = cs2.fetchone()
-                                        if not crow:
-                                            insert = check + ('', '')
-                                            logstring = "INSERT GenreAlbumartist: %s" % str(insert)
-                                            filelog.write_verbose_log(logstring)
-                                            cs2.execute('insert into GenreAlbumartist values (?,?,?,?)', insert)
+                                        insert_lookup(cs2, 'GenreAlbumartist', check, check + ('', ''))
                                         check = (album_id, genre, albumartist, album, duplicate, albumtype, albumartistsort)
-                                        cs2.execute("""select * from GenreAlbumartistAlbum where album_id=? and genre=? and albumartist=? and album=? and duplicate=? and albumtype=? and albumartistsort=?""", check)
-                                        crow = cs2.fetchone()
-                                        if not crow:
-                                            insert = check + ('', '')
-                                            logstring = "INSERT GenreAlbumartistAlbum: %s" % str(insert)
-                                            filelog.write_verbose_log(logstring)
-                                            cs2.execute('insert into GenreAlbumartistAlbum values (?,?,?,?,?,?,?,?,?)', insert)
+                                        insert_lookup(cs2, 'GenreAlbumartistAlbum', check, check + ('', ''))
                                 for artist in artistlist:
                                     check = (album_id, artist, album, duplicate, albumtype, artistsort)
-                                    cs2.execute("""select * from ArtistAlbum where album_id=? and artist=? and album=? and duplicate=? and albumtype=? and artistsort=?""", check)
-                                    crow = cs2.fetchone()
-                                    if not crow:
-                                        insert = check + ('', '')
-                                        logstring = "INSERT ArtistAlbum:" + str(insert)
-                                        filelog.write_verbose_log(logstring)
-                                        cs2.execute('insert into ArtistAlbum values (?,?,?,?,?,?,?,?)', insert)
+                                    insert_lookup(cs2, 'ArtistAlbum', check, check + ('', ''))
                                 for albumartist in albumartistlist:
                                     check = (album_id, albumartist, album, duplicate, albumtype, albumartistsort)
-                                    cs2.execute("""select * from AlbumartistAlbum where album_id=? and albumartist=? and album=? and duplicate=? and albumtype=? and albumartistsort=?""", check)
-                                    crow = cs2.fetchone()
-                                    if not crow:
-                                        insert = check + ('', '')
-                                        logstring = "INSERT AlbumartistAlbum:" + str(insert)
-                                        filelog.write_verbose_log(logstring)
-                                        cs2.execute('insert into AlbumartistAlbum values (?,?,?,?,?,?,?,?)', insert)
+                                    insert_lookup(cs2, 'AlbumartistAlbum', check, check + ('', ''))
                                 for composer in composerlist:
                                     check = (album_id, composer, album, duplicate, albumtype, composersort)
-                                    cs2.execute("""select * from ComposerAlbum where album_id=? and composer=? and album=? and duplicate=? and albumtype=? and composersort=?""", check)
-                                    crow = cs2.fetchone()
-                                    if not crow:
-                                        insert = check + ('', '')
-                                        logstring = "INSERT ComposerAlbum:" + str(insert)
-                                        filelog.write_verbose_log(logstring)
-                                        cs2.execute('insert into ComposerAlbum values (?,?,?,?,?,?,?,?)', insert)
+                                    insert_lookup(cs2, 'ComposerAlbum', check, check + ('', ''))
                         except sqlite3.Error, e:
                             errorstring = "Error inserting (genre)/(artist/albumartist/composer)/album lookup details: %s" % e.args[0]
                             filelog.write_error(errorstring)
@@ -1283,14 +1221,8 @@ def process_tags(args, options, tagdatabase, trackdatabase):
                     if updatetype == 'I' or artist_change:
 
                         try:
-                            # check whether we already have this artist (from a previous run or another track)
-                            cs2.execute("""select artist from Artist where artist=?""", (artist, ))
-                            crow = cs2.fetchone()
-                            if not crow:
-                                artists = (None, artist, '', '')
-                                logstring = "INSERT ARTIST: %s" % str(artists)
-                                filelog.write_verbose_log(logstring)
-                                cs2.execute('insert into Artist values (?,?,?,?)', artists)
+                            # insert unless we already have this artist (from a previous run or another track)
+                            insert_lookup(cs2, 'Artist', (artist, ), (None, artist, '', ''))
                         except sqlite3.Error, e:
                             errorstring = "Error inserting artist details: %s" % e.args[0]
                             filelog.write_error(errorstring)
@@ -1333,14 +1265,8 @@ def process_tags(args, options, tagdatabase, trackdatabase):
                     if updatetype == 'I' or albumartist_change:
 
                         try:
-                            # check whether we already have this albumartist (from a previous run or another track)
-                            cs2.execute("""select albumartist from Albumartist where albumartist=?""", (albumartist, ))
-                            crow = cs2.fetchone()
-                            if not crow:
-                                albumartists = (None, albumartist, '', '')
-                                logstring = "INSERT ALBUMARTIST: %s" % str(albumartists)
-                                filelog.write_verbose_log(logstring)
-                                cs2.execute('insert into Albumartist values (?,?,?,?)', albumartists)
+                            # insert unless we already have this albumartist (from a previous run or another track)
+                            insert_lookup(cs2, 'Albumartist', (albumartist, ), (None, albumartist, '', ''))
                         except sqlite3.Error, e:
                             errorstring = "Error inserting albumartist details: %s" % e.args[0]
                             filelog.write_error(errorstring)
@@ -1383,14 +1309,8 @@ def process_tags(args, options, tagdatabase, trackdatabase):
                     if updatetype == 'I' or composer_change:
 
                         try:
-                            # check whether we already have this composer (from a previous run or another track)
-                            cs2.execute("""select composer from Composer where composer=?""", (composer, ))
-                            crow = cs2.fetchone()
-                            if not crow:
-                                composers = (None, composer, '', '')
-                                logstring = "INSERT COMPOSER: %s" % str(composers)
-                                filelog.write_verbose_log(logstring)
-                                cs2.execute('insert into Composer values (?,?,?,?)', composers)
+                            # insert unless we already have this composer (from a previous run or another track)
+                            insert_lookup(cs2, 'Composer', (composer, ), (None, composer, '', ''))
                         except sqlite3.Error, e:
                             errorstring = "Error inserting composer details: %s" % e.args[0]
                             filelog.write_error(errorstring)
@@ -1439,14 +1359,8 @@ def process_tags(args, options, tagdatabase, trackdatabase):
                     if updatetype == 'I' or genre_change:
 
                         try:
-                            # check whether we already have this genre (from a previous run or another track)
-                            cs2.execute("""select genre from Genre where genre=?""", (genre, ))
-                            crow = cs2.fetchone()
-                            if not crow:
-                                genres = (None, genre, '', '')
-                                logstring = "INSERT GENRE: %s" % str(genres)
-                                filelog.write_verbose_log(logstring)
-                                cs2.execute('insert into Genre values (?,?,?,?)', genres)
+                            # insert unless we already have this genre (from a previous run or another track)
+                            insert_lookup(cs2, 'Genre', (genre, ), (None, genre, '', ''))
                         except sqlite3.Error, e:
                             errorstring = "Error inserting genre details: %s" % e.args[0]
                             filelog.write_error(errorstring)
@@ -1585,39 +1499,15 @@ def process_tags(args, options, tagdatabase, trackdatabase):
                         if keep_albums_separate:
                             for lalbum in albumlist:
                                 check = (a_album_id, lalbum, artistlist, duplicate, albumtype, albumsort)
-                                cs2.execute("""select * from ArtistAlbumsonly where album_id=? and album=? and artist=? and duplicate=? and albumtype=? and albumsort=?""", check)
-                                crow = cs2.fetchone()
-                                if not crow:
-                                    insert = a_album_id, lalbum, a_artist, duplicate, albumtype, albumsort, '', ''
-                                    logstring = "INSERT ArtistAlbumsonly:" + str(insert)
-                                    filelog.write_verbose_log(logstring)
-                                    cs2.execute('insert into ArtistAlbumsonly values (?,?,?,?,?,?,?,?)', insert)
+                                insert_lookup(cs2, 'ArtistAlbumsonly', check, (a_album_id, lalbum, a_artist, duplicate, albumtype, albumsort, '', ''))
                                 check = (a_album_id, lalbum, albumartistlist, duplicate, albumtype, albumsort)
-                                cs2.execute("""select * from AlbumartistAlbumsonly where album_id=? and album=? and albumartist=? and duplicate=? and albumtype=? and albumsort=?""", check)
-                                crow = cs2.fetchone()
-                                if not crow:
-                                    insert = a_album_id, lalbum, a_albumartist, duplicate, albumtype, albumsort, '', ''
-                                    logstring = "INSERT AlbumartistAlbumsonly:" + str(insert)
-                                    filelog.write_verbose_log(logstring)
-                                    cs2.execute('insert into AlbumartistAlbumsonly values (?,?,?,?,?,?,?,?)', insert)
+                                insert_lookup(cs2, 'AlbumartistAlbumsonly', check, (a_album_id, lalbum, a_albumartist, duplicate, albumtype, albumsort, '', ''))
                         else:
                             for lalbum in albumlist:
                                 check = (a_album_id, lalbum, duplicate, albumtype, albumsort)
-                                cs2.execute("""select * from ArtistAlbumsonly where album_id=? and album=? and duplicate=? and albumtype=? and albumsort=?""", check)
-                                crow = cs2.fetchone()
-                                if not crow:
-                                    insert = a_album_id, lalbum, a_artist, duplicate, albumtype, albumsort, '', ''
-                                    logstring = "INSERT ArtistAlbumsonly:" + str(insert)
-                                    filelog.write_verbose_log(logstring)
-                                    cs2.execute('insert into ArtistAlbumsonly values (?,?,?,?,?,?,?,?)', insert)
+                                insert_lookup(cs2, 'ArtistAlbumsonly', check, (a_album_id, lalbum, a_artist, duplicate, albumtype, albumsort, '', ''))
                                 check = (a_album_id, lalbum, duplicate, albumtype, albumsort)
-                                cs2.execute("""select * from AlbumartistAlbumsonly where album_id=? and album=? and duplicate=? and albumtype=? and albumsort=?""", check)
-                                crow = cs2.fetchone()
-                                if not crow:
-                                    insert = a_album_id, lalbum, a_albumartist, duplicate, albumtype, albumsort, '', ''
-                                    logstring = "INSERT AlbumartistAlbumsonly:" + str(insert)
-                                    filelog.write_verbose_log(logstring)
-                                    cs2.execute('insert into AlbumartistAlbumsonly values (?,?,?,?,?,?,?,?)', insert)
+                                insert_lookup(cs2, 'AlbumartistAlbumsonly', check, (a_album_id, lalbum, a_albumartist, duplicate, albumtype, albumsort, '', ''))
 
                 except sqlite3.Error, e:
                     errorstring = "Error updating albumonly details: %s" % e.args[0]
@@ -1708,6 +1598,34 @@ def process_tags(args, options, tagdatabase, trackdatabase):
     logstring = "finished"
     filelog.write_verbose_log(logstring)
 
+# lookup rows written so far in this run, by table
+written_lookups = {}
+
+def insert_lookup(cs, table, key, row, where=None, remember=True):
+    # inserts row into a lookup table unless key has already been written in this run;
+    # rows from previous runs are left to the table's unique index (insert or ignore),
+    # or for tables whose existing check is looser than their index, to where.
+    # keys of per track tables are not remembered, as they never repeat across tracks
+    if remember:
+        seen = written_lookups.setdefault(table, set())
+        if key in seen:
+            return
+    logstring = "INSERT %s: %s" % (table, str(row))
+    filelog.write_verbose_log(logstring)
+    if where:
+        cs.execute('insert or ignore into %s select %s where not exists (select 1 from %s where %s)' % (table, ','.join('?' * len(row)), table, where), row + key)
+    else:
+        cs.execute('insert or ignore into %s values (%s)' % (table, ','.join('?' * len(row))), row)
+    if remember:
+        seen.add(key)
+
+# highest duplicate number used so far in this run, by duplicate_key
+duplicate_counts = {}
+
+def duplicate_key(title, album, artist, tracknumber):
+    # the title is case folded as the db probe (title like) is case insensitive
+    return (title.lower(), album, artist, tracknumber)
+
 def makeint(number):
     try:
         i = int(float(number))
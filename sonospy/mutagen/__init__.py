@@ -66,6 +66,7 @@ class FileType(mutagen._util.DictMixin):
     tags = None
     filename = None
     _mimes = ["application/octet-stream"]
+    can_skip_pictures = False
 
     def __init__(self, filename=None, *args, **kwargs):
         if filename is None:
@@ -155,13 +156,17 @@ class FileType(mutagen._util.DictMixin):
 
     mime = property(__get_mime)
 
-def File(filename, options=None, easy=False):
+def File(filename, options=None, easy=False, skip_pictures=False):
     """Guess the type of the file and try to open it.
 
     The file type is decided by several things, such as the first 128
     bytes (which usually contains a file type identifier), the
     filename extension, and the presence of existing tags.
 
+    If skip_pictures is true, types that support it (can_skip_pictures)
+    record where embedded pictures are rather than reading them. Such
+    files cannot be saved.
+
     If no appropriate type could be found, None is returned.
     """
 
@@ -213,5 +218,8 @@ def File(filename, options=None, easy=False):
     results = zip(results, options)
     results.sort()
     (score, name), Kind = results[-1]
-    if score > 0: return Kind(filename)
+    if score > 0:
+        if skip_pictures and Kind.can_skip_pictures:
+            return Kind(filename, skip_pictures=True)
+        return Kind(filename)
     else: return None
@@ -508,9 +508,16 @@ class FLAC(FileType):
     cuesheet -- CueSheet object, if any
     seektable -- SeekTable object, if any
     pictures -- list of embedded pictures
+    picture_offsets -- (offset, length) in the file of the image data
+                       of each embedded picture
+
+    If loaded with skip_pictures, pictures is empty and the file
+    cannot be saved.
     """
 
     _mimes = ["audio/x-flac", "application/x-flac"]
+    can_skip_pictures = True
+    pictures_skipped = False
 
     METADATA_BLOCKS = [StreamInfo, Padding, None, SeekTable, VCFLACDict,
         CueSheet, Picture]
@@ -524,6 +531,12 @@ class FLAC(FileType):
     def __read_metadata_block(self, file):
         byte = ord(file.read(1))
         size = to_int_be(file.read(3))
+        if byte & 0x7F == Picture.code:
+            start = file.tell()
+            if self.pictures_skipped:
+                self.picture_offsets.append(self.__read_picture_offset(file))
+                file.seek(start + size)
+                return (byte >> 7) ^ 1
         try:
             data = file.read(size)
             if len(data) != size:
@@ -545,8 +558,22 @@ class FLAC(FileType):
             elif block.code == SeekTable.code:
                 if self.seektable is None: self.seektable = block
                 else: raise error("> 1 SeekTable block found")
+            elif block.code == Picture.code:
+                offset = start + 32 + len(block.mime.encode('UTF-8')) + \
+                         len(block.desc.encode('UTF-8'))
+                self.picture_offsets.append((offset, len(block.data)))
         return (byte >> 7) ^ 1
 
+    def __read_picture_offset(self, fileobj):
+        # returns the (offset, length) of the image data of the picture
+        # block at the current position, reading only the header
+        itype, length = struct.unpack('>2I', fileobj.read(8))
+        fileobj.seek(length, 1)
+        length, = struct.unpack('>I', fileobj.read(4))
+        fileobj.seek(length, 1)
+        (width, height, depth, colors, length) = struct.unpack('>5I', fileobj.read(20))
+        return fileobj.tell(), length
+
     def add_tags(self):
         """Add a Vorbis comment block to the file."""
         if self.tags is None:
@@ -570,10 +597,16 @@ class FLAC(FileType):
 
     vc = property(lambda s: s.tags, doc="Alias for tags; don't use this.")
 
-    def load(self, filename):
-        """Load file information from a filename."""
+    def load(self, filename, skip_pictures=False):
+        """Load file information from a filename.
+
+        If skip_pictures is true, picture blocks are seeked past and only
+        their picture_offsets are recorded.
+        """
 
         self.metadata_blocks = []
+        self.picture_offsets = []
+        self.pictures_skipped = skip_pictures
         self.tags = None
         self.cuesheet = None
         self.seektable = None
@@ -615,6 +648,8 @@ class FLAC(FileType):
         """
 
         if filename is None: filename = self.filename
+        if self.pictures_skipped:
+            raise error("pictures were skipped on load, can't save")
         f = open(filename, 'rb+')
 
         # Ensure we've got padding at the end, and only at the end.
@@ -672,6 +707,8 @@ class FLAC(FileType):
         return fileobj.tell()
 
     def find_picture_offset(self):
+        if self.picture_offsets:
+            return self.picture_offsets[0]
         fileobj = open(self.filename, 'rb')
         self.__check_header(fileobj)
         byte = 0x00
@@ -65,6 +65,7 @@ class ID3(DictProxy, mutagen.Metadata):
 
     filename = None
     size = 0
+    pictures_skipped = False
     __flags = 0
     __readbytes = 0
     __crc = None
@@ -90,7 +91,8 @@ class ID3(DictProxy, mutagen.Metadata):
         return self.picture, self.pictureoffset, self.picturesize
 
 
-    def load(self, filename, known_frames=None, translate=True):
+    def load(self, filename, known_frames=None, translate=True,
+             skip_pictures=False):
         """Load tags from a filename.
 
         Keyword arguments:
@@ -99,6 +101,9 @@ class ID3(DictProxy, mutagen.Metadata):
         translate -- Update all tags to ID3v2.4 internally. Mutagen is
                      only capable of writing ID3v2.4 tags, so if you
                      intend to save, this must be true.
+        skip_pictures -- Seek past APIC frames rather than reading them,
+                         only recording where the first picture is (see
+                         getpic). Tags loaded this way cannot be saved.
 
         Example of loading a custom frame:
             my_frames = dict(mutagen.id3.Frames)
@@ -117,6 +122,7 @@ class ID3(DictProxy, mutagen.Metadata):
         self.picture = False
         self.pictureoffset = 0
         self.picturesize = 0
+        self.pictures_skipped = False
         try:
             try:
                 self.__load_header()
@@ -142,8 +148,13 @@ class ID3(DictProxy, mutagen.Metadata):
                     if (2,3,0) <= self.version: frames = Frames
                     elif (2,2,0) <= self.version: frames = Frames_2_2
                 self.frameoffset = self.__fileobj.tell()
-                data = self.__fullread(self.size - 10)
-                for frame in self.__read_frames(data, frames=frames):
+                bpi = None
+                if skip_pictures and (2,3,0) <= self.version and \
+                   not (self.version < (2,4,0) and self.f_unsynch):
+                    data, bpi = self.__read_skipping_pictures(frames)
+                else:
+                    data = self.__fullread(self.size - 10)
+                for frame in self.__read_frames(data, frames=frames, bpi=bpi):
                     if isinstance(frame, Frame):
                         if frame.FrameID == 'APIC' and not self.picture:
                             apicheader = 10+1+len(frame.mime)+1+1+len(frame.desc)+1
@@ -272,6 +283,87 @@ class ID3(DictProxy, mutagen.Metadata):
             else:
                 self.__extdata = ""
 
+    def __read_skipping_pictures(self, frames):
+        # Returns the frame data __fullread(self.size - 10) would, less
+        # any APIC frames, and the frame size type. The frames are read
+        # one at a time so pictures can be seeked past, the position and
+        # size of the first is recorded as the full read would.
+        fileobj = self.__fileobj
+        start = fileobj.tell()
+        end = start + self.size - 10
+        if end > self.__filesize:
+            return self.__fullread(self.size - 10), None
+        if self.version < (2, 4, 0):
+            bpi = int
+        else:
+            asbpi, bpioff = self.__count_frames(start, end, frames, BitPaddedInt)
+            asint, intoff = self.__count_frames(start, end, frames, int)
+            if asint > asbpi or (asint == asbpi and (bpioff >= 1 and intoff <= 1)):
+                bpi = int
+            else:
+                bpi = BitPaddedInt
+        data = []
+        o = start
+        while o < end:
+            fileobj.seek(o)
+            header = fileobj.read(min(10, end - o))
+            try: name, size, flags = unpack('>4sLH', header)
+            except struct.error: break
+            if name.strip('\x00') == '': break
+            size = bpi(size)
+            size = min(size, end - o - 10)
+            if name == 'APIC':
+                if not self.picture:
+                    apicheader = self.__apic_header_size(
+                        fileobj.read(min(size, 1024)))
+                    if apicheader is None:
+                        # header too long to find, read the frame as a whole
+                        fileobj.seek(o + 10)
+                        data.append(header + fileobj.read(size))
+                        o += 10 + size
+                        continue
+                    self.pictureoffset = o + 10 + apicheader
+                    self.picturesize = size - apicheader
+                    self.picture = True
+                self.pictures_skipped = True
+            else:
+                data.append(header + fileobj.read(size))
+            o += 10 + size
+        self.__readbytes += end - start
+        return ''.join(data), bpi
+
+    def __count_frames(self, start, end, frames, bpi, EMPTY="\x00" * 10):
+        # __determine_bpi for the tag in the file from start to end
+        o = start
+        count = 0
+        while o < end - 10:
+            self.__fileobj.seek(o)
+            part = self.__fileobj.read(10)
+            if part == EMPTY:
+                return count, -((end - o) % 10)
+            name, size, flags = unpack('>4sLH', part)
+            o += 10 + bpi(size)
+            if name in frames:
+                count += 1
+        return count, o - end
+
+    def __apic_header_size(self, data):
+        # size of the encoding, mime, type and description before the
+        # picture in APIC frame data, None if they are not all in data
+        try:
+            encoding = ord(data[0])
+            start = data.index('\x00', 1) + 2
+            if encoding in (1, 2):
+                o = start
+                while True:
+                    o = data.index('\x00\x00', o)
+                    if (o - start) % 2 == 0:
+                        return o + 2
+                    o += 1
+            return data.index('\x00', start) + 1
+        except (IndexError, ValueError):
+            return None
+
     def __determine_bpi(self, data, frames, EMPTY="\x00" * 10):
         if self.version < (2, 4, 0):
             return int
@@ -314,13 +406,14 @@ class ID3(DictProxy, mutagen.Metadata):
             return int
         return BitPaddedInt
 
-    def __read_frames(self, data, frames):
+    def __read_frames(self, data, frames, bpi=None):
         if self.version < (2,4,0) and self.f_unsynch:
             try: data = unsynch.decode(data)
             except ValueError: pass
 
         if (2,3,0) <= self.version:
-            bpi = self.__determine_bpi(data, frames)
+            if bpi is None:
+                bpi = self.__determine_bpi(data, frames)
             while data:
                 header = data[:10]
                 try: name, size, flags = unpack('>4sLH', header)
@@ -385,6 +478,9 @@ class ID3(DictProxy, mutagen.Metadata):
         The lack of a way to update only an ID3v1 tag is intentional.
         """
 
+        if self.pictures_skipped:
+            raise error("pictures were skipped on load, can't save")
+
         # Sort frames by 'importance'
         order = ["TIT2", "TPE1", "TRCK", "TALB", "TPOS", "TDRC", "TCON"]
         order = dict(zip(order, range(len(order))))
@@ -1993,6 +2089,7 @@ class ID3FileType(mutagen.FileType):
     """An unknown type of file with ID3 tags."""
 
     ID3 = ID3
+    can_skip_pictures = True
     
     class _Info(object):
         length = 0
@@ -240,11 +240,18 @@ class MP4Tags(DictProxy, Metadata):
     Unknown non-text tags are removed.
     """
 
-    def load(self, atoms, fileobj):
+    pictures_skipped = False
+
+    def load(self, atoms, fileobj, skip_pictures=False):
         try: ilst = atoms["moov.udta.meta.ilst"]
         except KeyError, key:
             raise MP4MetadataError(key)
+        self.pictures_skipped = False
         for atom in ilst.children:
+            if skip_pictures and atom.name == "covr":
+                # cover art is not read, so can't be saved either
+                self.pictures_skipped = True
+                continue
             fileobj.seek(atom.offset + 8)
             data = fileobj.read(atom.length - 8)
             info = self.__atoms.get(atom.name, (type(self).__parse_text, None))
@@ -268,6 +275,8 @@ class MP4Tags(DictProxy, Metadata):
 
     def save(self, filename):
         """Save the metadata to the given filename."""
+        if self.pictures_skipped:
+            raise error("pictures were skipped on load, can't save")
         values = []
         items = self.items()
         items.sort(self.__key_sort)
@@ -651,8 +660,9 @@ class MP4(FileType):
     MP4Tags = MP4Tags
     
     _mimes = ["audio/mp4", "audio/x-m4a", "audio/mpeg4", "audio/aac"]
+    can_skip_pictures = True
 
-    def load(self, filename):
+    def load(self, filename, skip_pictures=False):
         self.filename = filename
         fileobj = file(filename, "rb")
         try:
@@ -660,7 +670,7 @@ class MP4(FileType):
             try: self.info = MP4Info(atoms, fileobj)
             except StandardError, err:
                 raise MP4StreamInfoError, err, sys.exc_info()[2]
-            try: self.tags = self.MP4Tags(atoms, fileobj)
+            try: self.tags = self.MP4Tags(atoms, fileobj, skip_pictures)
             except MP4MetadataError:
                 self.tags = None
             except StandardError, err:
@@ -23,8 +23,8 @@
 #
 # Author: Mark Henkelis <mark.henkelis@tesco.net>
 
-from brisa.core.reactors import SelectReactor
-reactor = SelectReactor()
+from brisa.core.reactors import install_default_reactor
+reactor = install_default_reactor()
 
 import sys
 import os
@@ -74,7 +74,7 @@ from control_point_sonos import ControlPointSonos
 ##from brisa.upnp.didl.didl_lite import *     # TODO: fix this
 from brisa.core.network import parse_xml
 from brisa.core.network import parse_url, url_fetch
-from brisa.core.threaded_call import run_async_function ##, run_async_call
+from brisa.core.threaded_call import run_async_function, set_pool_size ##, run_async_call
 
 ##from brisa.utils.looping_call import LoopingCall
 
@@ -87,6 +87,9 @@ from sonos_service import AvailableServices
 
 from optparse import OptionParser
 
+from playcountsdb import PlaycountIngester
+from logsink import LogSink
+
 from brisa import url_fetch_attempts, url_fetch_attempts_interval, __skip_service_xml__, __skip_soap_service__, __tolerate_service_parse_failure__, __enable_logging__, __enable_webserver_logging__, __enable_offline_mode__, __enable_events_logging__
 
 enc = sys.getfilesystemencoding()
@@ -217,12 +220,38 @@ class ControlPointScrob(object):
     except ConfigParser.NoOptionError:
         pass
 
+    # get log rotation settings (playcounts file is never rotated)
+    log_max_bytes = 10 * 1024 * 1024
+    try:        
+        log_max_bytes = int(config.get('INI', 'playcounts_log_max_bytes'))
+    except ConfigParser.NoOptionError:
+        pass
+    log_rotate_hours = 0
+    try:        
+        log_rotate_hours = int(config.get('INI', 'playcounts_log_rotate_hours'))
+    except ConfigParser.NoOptionError:
+        pass
+
+    # get databases to apply playcounts to
+    pc_databases = []
+    try:        
+        pc_databases = [d.strip() for d in config.get('INI', 'playcounts_databases').split(',') if d.strip()]
+    except ConfigParser.NoOptionError:
+        pass
+
     ###########################################################################
     # __init__
     ###########################################################################
 
     def __init__(self):
 
+        self.ingesters = [PlaycountIngester(d, self.pc_file) for d in self.pc_databases]
+
+        # log files are written by background threads, handlers only queue
+        self.log_sink = LogSink(self.log_file, max_bytes=self.log_max_bytes, rotate_interval=self.log_rotate_hours * 3600)
+        self.log_sink2 = LogSink(self.log_file2, enabled=self.options.verbose, max_bytes=self.log_max_bytes, rotate_interval=self.log_rotate_hours * 3600)
+        self.pc_sink = LogSink(self.pc_file, echo=True, on_write=self.ingest_playcounts)
+
         self.control_point = ControlPointSonos(self.ws_port)
         self.control_point.subscribe("new_device_event", self.on_new_device)
         self.control_point.subscribe("removed_device_event", self.on_del_device)
@@ -232,6 +261,10 @@ class ControlPointScrob(object):
         # start MSEARCH
         run_async_function(self.control_point.start_search, (600.0, "ssdp:all"), 0.001)
 
+        # apply any plays logged while we were not running, one database at a time
+        set_pool_size('playcounts', 1)
+        self.ingest_playcounts()
+
     def subscribe_to_device(self, service, udn, servicetype, name):
         try:
             service.event_subscribe(self.control_point.event_host, self._event_subscribe_callback, (udn, servicetype, service, name), True, self._event_renewal_callback)
@@ -299,8 +332,7 @@ class ControlPointScrob(object):
 
     def _event_unsubscribe_callback(self, cargo, subscription_id):
         if self.options.verbose:
-            out = "cancelled subscription for service: %s\n" % str(cargo)
-            self.write_log(out)
+            self.write_log("cancelled subscription for service: %s\n", cargo)
         log.debug('Event unsubscribe done cargo=%s sid=%s', cargo, subscription_id)
         
     def unsubscribe_from_device(self, serviceset):
@@ -433,8 +465,7 @@ class ControlPointScrob(object):
                 ZP = self.zoneattributes[self.at_subscription_ids[sid]]['CurrentZoneName']
                 delta = self.getmintime(time.time(), self.current_track_absolute_time_position[sid], self.current_track_start[sid])
                 if self.options.logging:
-                    out = "%s Transport Error. Old duration: %s, position: %s, delta: %s\n" % (ZP, self.current_track_duration[sid], self.current_track_relative_time_position[sid], delta)
-                    self.write_log(out)
+                    self.write_log("%s Transport Error. Old duration: %s, position: %s, delta: %s\n", ZP, self.current_track_duration[sid], self.current_track_relative_time_position[sid], delta)
                 self.check_scrobble(sid, self.current_track_duration[sid], self.current_track_relative_time_position[sid], delta)
             # ignore this notification
             return
@@ -463,13 +494,11 @@ class ControlPointScrob(object):
 
         if self.options.logging:
             ZP = self.zoneattributes[self.at_subscription_ids[sid]]['CurrentZoneName']
-            out = "%s play_state: %s\n" % (ZP, self.current_play_state[sid])
-            self.write_log(out)
+            self.write_log("%s play_state: %s\n", ZP, self.current_play_state[sid])
         # get latest position info
         self.current_position_info[sid] = self.get_position_info(sid)
         if self.options.logging:
-            out = "%s current_position_info: %s\n" % (ZP, self.current_position_info[sid])
-            self.write_log(out)
+            self.write_log("%s current_position_info: %s\n", ZP, self.current_position_info[sid])
         # check if track has changed
         if self.current_track_URI[sid] == self.current_position_info[sid]['TrackURI'] or passed_track:
             # same track
@@ -477,8 +506,7 @@ class ControlPointScrob(object):
             self.current_track_duration[sid] = self.current_position_info[sid]['TrackDuration']
             self.current_track_relative_time_position[sid] = self.current_position_info[sid]['RelTime']
             if self.options.logging:
-                out = "%s Same track. Duration: %s, position: %s\n" % (ZP, self.current_track_duration[sid], self.current_track_relative_time_position[sid])
-                self.write_log(out)
+                self.write_log("%s Same track. Duration: %s, position: %s\n", ZP, self.current_track_duration[sid], self.current_track_relative_time_position[sid])
             self.current_track_absolute_time_position[sid] = time.time()
             self.current_track_metadata[sid] = self.current_position_info[sid]['TrackMetaData']
             self.check_scrobble(sid, self.current_track_duration[sid], self.current_track_relative_time_position[sid])
@@ -493,8 +521,7 @@ class ControlPointScrob(object):
             if self.previous_play_state[sid] == 'PLAYING':
                 delta = self.getmintime(time.time(), self.current_track_absolute_time_position[sid], self.current_track_start[sid])
                 if self.options.logging:
-                    out = "%s New track. Old duration: %s, position: %s, delta: %s\n" % (ZP, self.current_track_duration[sid], self.current_track_relative_time_position[sid], delta)
-                    self.write_log(out)
+                    self.write_log("%s New track. Old duration: %s, position: %s, delta: %s\n", ZP, self.current_track_duration[sid], self.current_track_relative_time_position[sid], delta)
                 self.check_scrobble(sid, self.current_track_duration[sid], self.current_track_relative_time_position[sid], delta)
             # set up for new track
             self.current_track_start[sid] = time.time()
@@ -502,8 +529,7 @@ class ControlPointScrob(object):
             self.current_track_duration[sid] = self.current_position_info[sid]['TrackDuration']
             self.current_track_relative_time_position[sid] = self.current_position_info[sid]['RelTime']
             if self.options.logging:
-                out = "%s New track. Duration: %s, position: %s\n" % (ZP, self.current_track_duration[sid], self.current_track_relative_time_position[sid])
-                self.write_log(out)
+                self.write_log("%s New track. Duration: %s, position: %s\n", ZP, self.current_track_duration[sid], self.current_track_relative_time_position[sid])
             self.current_track_absolute_time_position[sid] = time.time()
             self.current_track_metadata[sid] = self.current_position_info[sid]['TrackMetaData']
             self.current_track_scrobbled[sid] = False
@@ -575,24 +601,30 @@ class ControlPointScrob(object):
 
         scrob_log ='"%s","%s","%s",%s,"%s","%s"%s\n' % (self.current_track_start[sid], ZP, service, trackdata, self.current_track_duration[sid], trackURI, extras)
         scrob_log = scrob_log.encode(enc, 'replace')
-        print scrob_log
         self.write_log(scrob_log)
-        
-        f = open(self.pc_file, 'a')
-        f.write(scrob_log)
-        f.close()
+        # playcounts are applied once the writer has written the line
+        self.pc_sink.write(scrob_log)
         self.current_track_scrobbled[sid] = True
         self.previous_track_URI[sid] = self.current_track_URI[sid]
 
-    def write_log(self, out):
-        f = open(self.log_file, 'a')
-        f.write(out)
-        f.close()
+    def ingest_playcounts(self):
+        for ingester in self.ingesters:
+            run_async_function(self._ingest_playcounts, (ingester,), queue='playcounts')
 
-    def write_log2(self, out):
-        f = open(self.log_file2, 'a')
-        f.write(out)
-        f.close()
+    def _ingest_playcounts(self, ingester):
+        try:
+            read, matched = ingester.ingest()
+        except Exception, e:
+            self.write_log('error applying playcounts to %s: %s\n', ingester.dbspec, e)
+            return
+        if read:
+            self.write_log('applied %s of %s plays to %s\n', matched, read, ingester.dbspec)
+
+    def write_log(self, out, *args):
+        self.log_sink.write(out, *args)
+
+    def write_log2(self, out, *args):
+        self.log_sink2.write(out, *args)
 
     def unwrap_metadata(self, metadata):
         title = artist = album = ''
@@ -648,8 +680,7 @@ class ControlPointScrob(object):
         if sid == esid:
             # subscription callback has been called - check for events and process and dequeue
             if self.options.verbose:
-                out = "notification dequeued: seq=%s, sid=%s\nchanged_vars=%s\n\n" % (seq, sid, changed_vars)
-                self.write_log(out)
+                self.write_log("notification dequeued: seq=%s, sid=%s\nchanged_vars=%s\n\n", seq, sid, changed_vars)
             self.on_device_event_seq(sid, seq, changed_vars)
             return None
         return event
@@ -665,14 +696,12 @@ class ControlPointScrob(object):
         if not sid in self.subscription_ids:
             # notification arrived before subscription callback - queue event
             if self.options.verbose:
-                out = "notification queued: seq=%s, sid=%s\nchanged_vars=%s\n\n" % (seq, sid, changed_vars)
-                self.write_log(out)
+                self.write_log("notification queued: seq=%s, sid=%s\nchanged_vars=%s\n\n", seq, sid, changed_vars)
             self.event_queue.append((sid, seq, changed_vars))
             return
 
         if self.options.verbose:
-            out = "service, Zone=%s, seq=%s, sid=%s\nchanged_vars=%s\n\n" % (self.subscription_ids[sid], seq, sid, changed_vars)
-            self.write_log(out)
+            self.write_log("service, Zone=%s, seq=%s, sid=%s\nchanged_vars=%s\n\n", self.subscription_ids[sid], seq, sid, changed_vars)
         if self.subscription_ids[sid].startswith('ZoneGroupTopology'):
             self.process_zgt(sid, self.subscription_ids[sid][19:], changed_vars)
     
@@ -769,7 +798,9 @@ class ControlPointScrob(object):
             xml = nodedict['ZoneGroupState']
             elt = parse_xml(xml)
             elt = elt.getroot()
-            out = node + ' ZoneGroupTopology\n'
+            verbose = self.options.verbose
+            if verbose:
+                out = node + ' ZoneGroupTopology\n'
             self.zone_groups[sid] = {}
             self.zone_group_coordinators_lookup[sid] = {}
             for e in elt.findall('ZoneGroup'):
@@ -783,17 +814,18 @@ class ControlPointScrob(object):
                     zone_group_members.append((zgm_uuid, zgm_zonename))
                     if zgm_uuid == zg_coord:
                         zg_coord_name = zgm_zonename
-                out += '    ' + 'Coordinator ' + zg_coord_name + '\n'
+                if verbose:
+                    out += '    ' + 'Coordinator ' + zg_coord_name + '\n'
                 zgm = []
                 for m in zone_group_members:
                     uuid, name = m
-                    out += '        ' + 'Member ' + name + '\n'
+                    if verbose:
+                        out += '        ' + 'Member ' + name + '\n'
                     zgm.append(uuid)
                     self.zone_group_coordinators_lookup[sid][uuid] = zg_coord
                 self.zone_groups[sid][zg_coord] = zgm
-            out += '\n'
-            if self.options.verbose:
-                self.write_log2(out)
+            if verbose:
+                self.write_log2(out + '\n')
 
     def check_zone_grouped(self, sid):
         # get udn of zone
@@ -819,6 +851,9 @@ class ControlPointScrob(object):
         print "cancelling subscriptions, please wait..."
         self.cancel_subscriptions()
         print "subscriptions cancelled."
+        self.pc_sink.close()
+        self.log_sink.close()
+        self.log_sink2.close()
         reactor.main_quit()
 
 def ustr(string):
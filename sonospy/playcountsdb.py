@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+#
+# playcountsdb
+#
+# pycpoint and sonospy copyright (c) 2009-2014 Mark Henkelis
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Applies the plays scrobbled by playcounts.py to the playcount and
+# lastplayed columns of a library database.
+#
+# The scrobble log is read from the offset saved in the database by the
+# previous run, so each play is counted once. Plays are matched to tracks by
+# the proxy filename in the scrobble when it is for this database, otherwise
+# by title/album/artist/length (inxTrackPlay). The counters of the track and
+# of the albums, artists, albumartists, composers and genres it belongs to
+# are updated in one transaction per batch, together with the new offset.
+
+import os
+import sys
+import csv
+import sqlite3
+import optparse
+
+enc = sys.getfilesystemencoding()
+
+# scrobble fields, as written by ControlPointScrob.scrobble
+F_START = 0
+F_TITLE = 3
+F_ARTIST = 4
+F_ALBUM = 5
+F_DURATION = 6
+F_URI = 7
+F_FILENAME = 8
+F_DATABASE = 9
+
+# tables holding counters and the rows of each to update for a track
+counter_tables = [
+    ('tracks', 'id=:track'),
+    ('albums', 'id in (select album_id from ArtistAlbumTrack where track_id=:track)'),
+    ('Artist', 'artist in (select artist from ArtistAlbumTrack where track_id=:track)'),
+    ('Albumartist', 'albumartist in (select albumartist from AlbumartistAlbumTrack where track_id=:track)'),
+    ('Composer', 'composer in (select composer from ComposerAlbumTrack where track_id=:track)'),
+    ('Genre', 'genre in (select genre from GenreArtistAlbumTrack where track_id=:track)'),
+    ('ArtistAlbum', 'album_id in (select album_id from ArtistAlbumTrack where track_id=:track) and artist in (select artist from ArtistAlbumTrack where track_id=:track)'),
+    ('AlbumartistAlbum', 'album_id in (select album_id from AlbumartistAlbumTrack where track_id=:track) and albumartist in (select albumartist from AlbumartistAlbumTrack where track_id=:track)'),
+    ('ComposerAlbum', 'album_id in (select album_id from ComposerAlbumTrack where track_id=:track) and composer in (select composer from ComposerAlbumTrack where track_id=:track)'),
+    ('GenreArtist', 'genre in (select genre from GenreArtistAlbumTrack where track_id=:track) and artist in (select artist from GenreArtistAlbumTrack where track_id=:track)'),
+    ('GenreAlbumartist', 'genre in (select genre from GenreAlbumartistAlbumTrack where track_id=:track) and albumartist in (select albumartist from GenreAlbumartistAlbumTrack where track_id=:track)'),
+    ('GenreArtistAlbum', 'album_id in (select album_id from GenreArtistAlbumTrack where track_id=:track) and genre in (select genre from GenreArtistAlbumTrack where track_id=:track) and artist in (select artist from GenreArtistAlbumTrack where track_id=:track)'),
+    ('GenreAlbumartistAlbum', 'album_id in (select album_id from GenreAlbumartistAlbumTrack where track_id=:track) and genre in (select genre from GenreAlbumartistAlbumTrack where track_id=:track) and albumartist in (select albumartist from GenreAlbumartistAlbumTrack where track_id=:track)'),
+    ]
+
+update_statement = "update %s set playcount=playcount+:count, lastplayed=max(ifnull(lastplayed, 0), :last) where %s"
+
+
+class PlaycountIngester(object):
+
+    def __init__(self, dbspec, logfile, batch_size=500):
+        self.dbspec = dbspec
+        self.dbname = os.path.split(dbspec)[1]
+        self.logfile = os.path.abspath(logfile)
+        self.batch_size = batch_size
+        self.statements = [update_statement % (table, where) for (table, where) in counter_tables]
+
+    def ingest(self):
+        # applies the scrobbles logged since the last run,
+        # returns a tuple of (plays read, plays matched)
+        if not os.path.exists(self.logfile):
+            return (0, 0)
+        db = sqlite3.connect(self.dbspec)
+        try:
+            c = db.cursor()
+            self.check_tables(c)
+            offset = self.get_offset(c)
+            if offset > os.path.getsize(self.logfile):
+                # log has been truncated or replaced, start again
+                offset = 0
+            read = matched = 0
+            f = open(self.logfile, 'rb')
+            try:
+                f.seek(offset)
+                while True:
+                    lines, offset = self.read_batch(f, offset)
+                    if not lines:
+                        break
+                    plays = {}
+                    for line in lines:
+                        play = self.match(c, line)
+                        if play:
+                            track, last = play
+                            count, prevlast = plays.get(track, (0, 0))
+                            plays[track] = (count + 1, max(last, prevlast))
+                            matched += 1
+                    read += len(lines)
+                    self.apply(c, plays)
+                    self.set_offset(c, offset)
+                    db.commit()
+            finally:
+                f.close()
+            return (read, matched)
+        finally:
+            db.close()
+
+    def read_batch(self, f, offset):
+        # returns up to batch_size complete lines and the offset after them,
+        # a partly written line is left for the next run
+        lines = []
+        while len(lines) < self.batch_size:
+            line = f.readline()
+            if not line.endswith('\n'):
+                break
+            offset += len(line)
+            if line.strip():
+                lines.append(line)
+        f.seek(offset)
+        return lines, offset
+
+    def check_tables(self, c):
+        c.execute('SELECT count(*) FROM sqlite_master WHERE type="table" AND name="scrobbleoffsets"')
+        n, = c.fetchone()
+        if n == 0:
+            c.execute('''create table scrobbleoffsets (logfile text, offset integer)''')
+            c.execute('''create unique index inxScrobbleOffsets on scrobbleoffsets (logfile)''')
+        # movetags inserts empty counters, which sort above any count - make
+        # them numeric (lastplayed null so that it displays as empty)
+        for (table, where) in counter_tables:
+            c.execute("update %s set playcount=0 where playcount=''" % table)
+            c.execute("update %s set lastplayed=null where lastplayed=''" % table)
+
+    def get_offset(self, c):
+        c.execute("select offset from scrobbleoffsets where logfile=?", (self.logfile, ))
+        row = c.fetchone()
+        if row:
+            return row[0]
+        return 0
+
+    def set_offset(self, c, offset):
+        c.execute("insert or replace into scrobbleoffsets values (?,?)", (self.logfile, offset))
+
+    def match(self, c, line):
+        # returns (track id, time played) for a scrobble, or None
+        try:
+            fields = csv.reader([line]).next()
+        except csv.Error:
+            return None
+        if len(fields) <= F_URI:
+            return None
+        fields = [field.decode(enc, 'replace') for field in fields]
+        try:
+            last = int(float(fields[F_START]))
+        except ValueError:
+            return None
+        if len(fields) > F_DATABASE and fields[F_DATABASE] == self.dbname:
+            # proxy filename is dbname.id.ext
+            id = fields[F_FILENAME][len(self.dbname) + 1:].rsplit('.', 1)[0]
+            c.execute("select id from tracks where id=?", (id, ))
+            row = c.fetchone()
+            if row:
+                return (row[0], last)
+        length = makeseconds(fields[F_DURATION])
+        c.execute("select id, length from tracks where title=? and album=? and artist=?",
+                  (fields[F_TITLE], fields[F_ALBUM], fields[F_ARTIST]))
+        for id, tracklength in c.fetchall():
+            if not length or not tracklength or abs(tracklength - length) <= 1:
+                return (id, last)
+        return None
+
+    def apply(self, c, plays):
+        params = [{'track': track, 'count': count, 'last': last} for (track, (count, last)) in plays.iteritems()]
+        for statement in self.statements:
+            c.executemany(statement, params)
+
+
+def makeseconds(time):
+    if not ':' in time:
+        return 0
+    try:
+        h, m, s = time.split(':')
+        return (int(h)*60*60 + int(m)*60 +int(float(s)))
+    except ValueError:
+        return 0
+
+def process_command_line(argv):
+    if argv is None:
+        argv = sys.argv[1:]
+    parser = optparse.OptionParser(
+        formatter=optparse.TitledHelpFormatter(width=78),
+        add_help_option=None)
+    parser.add_option("-d", "--database", dest="database", type="string",
+                      help="update playcounts in DATABASE", action="store",
+                      metavar="DATABASE")
+    parser.add_option("-l", "--log", dest="logfile", type="string",
+                      help="read scrobbles from LOGFILE", action="store",
+                      metavar="LOGFILE", default="playcounts.log")
+    parser.add_option('-h', '--help', action='help',
+                      help='Show this help message and exit.')
+    settings, args = parser.parse_args(argv)
+    return settings, args
+
+def main(argv=None):
+    options, args = process_command_line(argv)
+    if not options.database:
+        print "'-d databasename' must be specified"
+        return 1
+    read, matched = PlaycountIngester(options.database, options.logfile).ingest()
+    print "%s plays read, %s matched" % (read, matched)
+    return 0
+
+if __name__ == "__main__":
+    status = main()
+    sys.exit(status)
@@ -44,8 +44,9 @@ from mediaserver import getFileType
 from mediaserver import getFile
 from mediaserver import fixcolonequals
 from mediaserver import fixMime
+from mediaserver import TimedConnection
 
-from brisa.core import log
+from brisa.core import log, metrics
 
 from brisa.core import webserver, network
 
@@ -167,9 +168,9 @@ class Proxy(object):
             else:
                 try:
                     if self.db_persist_connection:
-                        db = sqlite3.connect(self.dbspec, check_same_thread = False)
+                        db = sqlite3.connect(self.dbspec, check_same_thread = False, factory=TimedConnection)
                     else:
-                        db = sqlite3.connect(self.dbspec)
+                        db = sqlite3.connect(self.dbspec, factory=TimedConnection)
                     cs = db.execute("PRAGMA cache_size;")
                     log.debug('cache_size before: %s', cs.fetchone()[0])
                     db.execute("PRAGMA cache_size = %s;" % self.db_cache_size)
@@ -269,6 +270,7 @@ class Proxy(object):
         self.wmpwebserver.add_resource(self.wmpcontroller)
         self.wmpcontroller2 = ProxyServerController(self, 'wmp')
         self.wmpwebserver.add_resource(self.wmpcontroller2)
+        self.wmpwebserver.add_resource(webserver.MetricsResource())
         self._serve_image_files()
 
     def _serve_pm_file(self):
@@ -434,6 +436,14 @@ class ProxyServerController(webserver.SonosResource):
     def __init__(self, proxy, res):
         webserver.SonosResource.__init__(self, res, proxy)
 
+    def application(self, environ, start_response):
+        # time to set up the response - streaming the body happens later
+        start = time.time()
+        try:
+            return webserver.SonosResource.application(self, environ, start_response)
+        finally:
+            metrics.observe('http_request_seconds', time.time() - start, resource=self.name)
+
 ###############
 ###############
 # SMAPI service
@@ -1090,6 +1100,10 @@ class ContentDirectory(Service):
 
         Service.__init__(self, self.service_name, self.service_type, url_base='', scpd_xml_filepath=self.scpd_xml_path)
 
+        # the CDS spec moderates these variables to one event every 2 seconds
+        self.set_variable_moderation('SystemUpdateID', max_rate=0.5)
+        self.set_variable_moderation('ContainerUpdateIDs', max_rate=0.5)
+
         self.systemupdateid = 0
         self.update_loop = LoopingCall(self.get_containerupdateid)
         self.update_loop.start(60.0, now=True)
@@ -31,8 +31,8 @@ import sys
 fenc = sys.getfilesystemencoding()
 #print sys.getdefaultencoding()
 
-from brisa.core.reactors import SelectReactor
-reactor = SelectReactor()
+from brisa.core.reactors import install_default_reactor
+reactor = install_default_reactor()
 
 import os
 import uuid
@@ -42,7 +42,7 @@ import StringIO
 import codecs
 import urllib
 
-from data import ListDataController, GetDataController, PlayController, GetDeviceController, SetRendererController, PollRendererController, ActionRendererController, PollServerController, PollQueueController
+from data import ListDataController, GetDataController, PlayController, GetDeviceController, SetRendererController, PollRendererController, ActionRendererController, PollServerController, PollQueueController, StateChannel, PushController
 
 #import log
 from brisa.core import log
@@ -65,6 +65,7 @@ from threading import Lock
 import datetime
     
 from brisa.upnp.control_point.service import Service, SubscribeRequest
+from brisa.upnp.control_point.event import subscriptions
 
 from proxy import Proxy
 
@@ -777,6 +778,12 @@ Music/Rating                101     object.container
             self.gdataparent = {}
 
             self.queue_entry = None
+
+            # renderer and queue state pushed to long-poll clients
+            self.state_channel = StateChannel()
+            self.position_ticking = False
+            self.position_loop = LoopingCall(run_async_function, self.tick_position)
+            self.position_loop.start(1.0, now=False)
             
             getdevicecontroller = GetDeviceController(self.devicedata, 'deviceData')
             setrenderercontroller = SetRendererController(self.renderermetadata, 'rendererData', self.setrenderer)
@@ -788,6 +795,7 @@ Music/Rating                101     object.container
             rootmenucontroller = GetDataController(self.rootmenus, 'rootMenus', self.getrootmenus)
             getdatacontroller = GetDataController(None, 'getData', self.getdata)
             playcontroller = PlayController('playData', self.playdata)
+            pushcontroller = PushController(self.state_channel, 'statePush')
 
             ws = self.control_point._event_listener.srv
             res = webserver.CustomResource('data')
@@ -801,6 +809,7 @@ Music/Rating                101     object.container
             res.add_resource(rootmenucontroller)
             res.add_resource(getdatacontroller)
             res.add_resource(playcontroller)
+            res.add_resource(pushcontroller)
             ws.add_resource(res)
 
             # start MSEARCH for controlpoint
@@ -1404,6 +1413,7 @@ Music/Rating                101     object.container
         elif action == 'VOLUME':
             self.do_volume(value)
         self.update_position()
+        self.publish_state()
         self.get_renderer_data()
         # add any return from action here
 #        new_entry = 'ACTION' + "::" + str(self.@@@@)
@@ -1505,6 +1515,44 @@ Music/Rating                101     object.container
         if self.rendererdata == []:
             self.rendererdata.append("NOCHANGE::0" + self.data_delim)
 
+    def publish_state(self):
+        # publish the current renderer and queue state to the push channel,
+        # the channel works out what has changed
+        if not hasattr(self, 'state_channel'):
+            return
+        state = {}
+        state.update(self.now_playing_dict)
+        state.update(self.now_extras_dict)
+        state['POSITION'] = self.now_playing_pos
+        state['PERCENT'] = self.now_playing_percent
+        state['VOLUME'] = "%.0f" % self.current_volume
+        state['VOLUME_FIXED'] = str(self.volume_fixed)
+        state['MUTE'] = str(self.volume_mute)
+        state['STATE'] = str(self.play_state)
+        state['ART'] = str(self.album_art)
+        state['QUEUE'] = str(self.queue_updateid)
+        self.state_channel.update(state)
+
+    def tick_position(self):
+        # position only changes while playing and is not evented, so fetch
+        # it once a second for all push clients, and only while somebody
+        # is listening
+        if self.position_ticking:
+            return
+        if self.play_state != 'PLAYING' or not self.state_channel.is_watched():
+            return
+        if self.control_point.get_current_renderer() == None:
+            return
+        self.position_ticking = True
+        try:
+            try:
+                self.update_position()
+                self.publish_state()
+            except Exception, e:
+                log.debug('tick_position: %s' % e)
+        finally:
+            self.position_ticking = False
+
     def get_server_data(self):
         # TODO:
         #   this will only cater for a single controlpoint at the moment
@@ -2032,7 +2080,8 @@ Music/Rating                101     object.container
                        error_callback=self.show_napster_result,
                        success_callback_cargo=(service, id, root, count, returned, sequence, search, searchstring, newtype, setkey), 
                        error_callback_cargo=(service, id, root, count, returned, sequence, search, searchstring, newtype, setkey),
-                       delay=0, 
+                       delay=0,
+                       async_queue='browse',
                        id=id,
                        index=returned,
                        count=count)
@@ -2044,7 +2093,8 @@ Music/Rating                101     object.container
                        error_callback=self.show_napster_result,
                        success_callback_cargo=(service, id, root, count, returned, sequence, search, searchstring, newtype, setkey), 
                        error_callback_cargo=(service, id, root, count, returned, sequence, search, searchstring, newtype, setkey),
-                       delay=0, 
+                       delay=0,
+                       async_queue='browse',
                        id=id,
                        term=searchstring,
                        index=returned,
@@ -2543,7 +2593,8 @@ Music/Rating                101     object.container
                        error_callback=self.show_library_result,
                        success_callback_cargo=(id, count, returned, sequence, filter, sort, search, searchstring, newtype, setkey), 
                        error_callback_cargo=(id, count, returned, sequence, filter, sort, search, searchstring, newtype, setkey),
-                       delay=0, 
+                       delay=0,
+                       async_queue='browse',
                        object_id=id,
                        browse_flag='BrowseDirectChildren',
                        filter=filter,
@@ -3170,7 +3221,8 @@ Music/Rating                101     object.container
                        error_callback=self.show_browse_result,
                        success_callback_cargo=(id, count, returned, sequence, filter, sort, search, searchstring, newtype, setkey, device), 
                        error_callback_cargo=(id, count, returned, sequence, filter, sort, search, searchstring, newtype, setkey, device),
-                       delay=0, 
+                       delay=0,
+                       async_queue='browse',
                        object_id=id,
                        browse_flag='BrowseDirectChildren',
                        filter=filter,
@@ -3186,7 +3238,8 @@ Music/Rating                101     object.container
                        error_callback=self.show_browse_result,
                        success_callback_cargo=(id, count, returned, sequence, filter, sort, search, searchstring, newtype, setkey, device), 
                        error_callback_cargo=(id, count, returned, sequence, filter, sort, search, searchstring, newtype, setkey, device),
-                       delay=0, 
+                       delay=0,
+                       async_queue='browse',
                        container_id=1,
                        search_criteria=searchstring,
                        filter=filter,
@@ -3668,6 +3721,7 @@ Music/Rating                101     object.container
                        success_callback_cargo=(name, id, count, returned, sequence, filter, sort, search, searchstring, newtype, setkey), 
                        error_callback_cargo=(name, id, count, returned, sequence, filter, sort, search, searchstring, newtype, setkey),
                        delay=0,
+                       async_queue='browse',
                        name=name, 
                        object_id=id,
                        browse_flag='BrowseDirectChildren',
@@ -4983,7 +5037,7 @@ Music/Rating                101     object.container
                 if sid == '':
                     sid = current_renderer.udn  # event_sid is not set as eventing is not working
                 
-                run_async_function(self.on_device_event_seq, (sid, -1, change), 0.001)
+                run_async_function(self.on_device_event_seq, (sid, -1, change), 0.001, queue='events')
 
         except Exception, e:
             log.info('Choose a Renderer to play Music. Specific problem: %s' % \
@@ -5690,36 +5744,45 @@ Music/Rating                101     object.container
 
 #        print changed_vars
 
+        # classify the event from the subscription registry - if the sid
+        # is not registered fall back to checking each service
+        event_type = None
+        entry = subscriptions.get(sid)
+        if entry != None:
+            event_type = entry[2]
+
         # check it is a cd event - just pass these through without seq/queueing
         # remember that we subscribe to cd for ZP renderer as well as all servers
-        current_renderer = self.control_point.get_current_renderer()
-        if current_renderer != None and current_renderer.udn in self.known_zone_players:
-            if self.control_point.get_cd_service(current_renderer).event_sid == sid:    
-                self.process_cd_event_renderer(sid, seq, changed_vars)
-                return
-        else:
-            if self.control_point.get_current_server() != None:
-                if self.control_point.get_cd_service().event_sid == sid:    
-                    self.process_cd_event(sid, seq, changed_vars)
-                    return
-
-        if self.control_point.get_current_server() != None:
-            if self.control_point.get_cd_service().event_sid == sid:    
-                self.process_cd_event(sid, seq, changed_vars)
-                return
-        else:
+        if event_type == None or event_type == self.control_point.CD_namespace:
             current_renderer = self.control_point.get_current_renderer()
             if current_renderer != None and current_renderer.udn in self.known_zone_players:
                 if self.control_point.get_cd_service(current_renderer).event_sid == sid:    
                     self.process_cd_event_renderer(sid, seq, changed_vars)
                     return
+            else:
+                if self.control_point.get_current_server() != None:
+                    if self.control_point.get_cd_service().event_sid == sid:    
+                        self.process_cd_event(sid, seq, changed_vars)
+                        return
+
+            if self.control_point.get_current_server() != None:
+                if self.control_point.get_cd_service().event_sid == sid:    
+                    self.process_cd_event(sid, seq, changed_vars)
+                    return
+            else:
+                current_renderer = self.control_point.get_current_renderer()
+                if current_renderer != None and current_renderer.udn in self.known_zone_players:
+                    if self.control_point.get_cd_service(current_renderer).event_sid == sid:    
+                        self.process_cd_event_renderer(sid, seq, changed_vars)
+                        return
     
         # check it is an rc event - just pass these through without seq/queueing
         # TODO: add separate queue/seq for these?
-        if 'LastChange' in changed_vars and changed_vars['LastChange'] != None:
-            if self.control_point.get_rc_service().event_sid == sid:    
-                self.process_device_event_seq(sid, seq, changed_vars)
-                return
+        if event_type == None or event_type == self.control_point.RC_namespace:
+            if 'LastChange' in changed_vars and changed_vars['LastChange'] != None:
+                if self.control_point.get_rc_service().event_sid == sid:    
+                    self.process_device_event_seq(sid, seq, changed_vars)
+                    return
     
         seq = int(seq)
         # don't process events that come late in sequence, unless it's a dummy event (seq=-1)
@@ -5782,6 +5845,7 @@ Music/Rating                101     object.container
                     if self.queue_entry != None:
                         self.browse_queue(self.queue_entry)
                         self.queue_updateid = containerupdate[1]
+                        self.publish_state()
 
 
     def process_device_event_seq(self, sid, seq, changed_vars):
@@ -5898,6 +5962,7 @@ Music/Rating                101     object.container
                             self.set_play(value)
 #                print str(datetime.datetime.now()) + " @@@@@@@@  AVT end"
 #                return
+            self.publish_state()
             
         elif 'ThirdPartyMediaServers' in changed_vars:
 
@@ -35,8 +35,8 @@ fenc = sys.getfilesystemencoding()
 import signal
 import time
 
-from brisa.core.reactors import SelectReactor
-reactor = SelectReactor()
+from brisa.core.reactors import install_default_reactor
+reactor = install_default_reactor()
 
 import os
 import uuid
@@ -396,7 +396,8 @@ X-RINCON-HOUSEHOLD: HHID_PqS8N7XZPvbmHWl5D3KHkgq2DKu
                        error_callback=self.process_library_result,
                        success_callback_cargo=(id, count, returned, sequence, filter, sort, search, searchstring, newtype, setkey, device), 
                        error_callback_cargo=(id, count, returned, sequence, filter, sort, search, searchstring, newtype, setkey, device),
-                       delay=0, 
+                       delay=0,
+                       async_queue='browse',
                        object_id=id,
                        browse_flag='BrowseDirectChildren',
                        filter=filter,
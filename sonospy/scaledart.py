@@ -0,0 +1,136 @@
+
+# Scaled album art variants for controllers that ask for small covers.
+#
+# Variants are JPEGs keyed on (art source, size) and kept in memory up to a
+# byte cap, least recently used first out. They are generated in the
+# background on the 'art' call queue - the request that misses is served
+# the original art. Without PIL nothing is generated and the original art
+# is always served.
+
+import threading
+import StringIO
+
+from time import time
+
+from brisa.core import log, config, metrics
+from brisa.core.threaded_call import run_async_function
+
+try:
+    from PIL import Image
+except ImportError:
+    try:
+        import Image
+    except ImportError:
+        Image = None
+
+min_size = 16
+max_size = 1024
+
+def get_size(params):
+    # returns the requested size from the request parameters, or None
+    size = params.get('size', None)
+    if size == None:
+        return None
+    try:
+        size = int(size)
+    except ValueError:
+        return None
+    return max(min_size, min(max_size, size))
+
+def is_available():
+    return Image != None
+
+def scale(data, size):
+    # returns data scaled to fit in size x size as a JPEG
+    image = Image.open(StringIO.StringIO(data))
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    if image.size[0] > size or image.size[1] > size:
+        image.thumbnail((size, size), Image.ANTIALIAS)
+    out = StringIO.StringIO()
+    image.save(out, 'JPEG', quality=85)
+    return out.getvalue()
+
+
+class ScaledArtCache(object):
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        # returns the scaled art for key or None
+        self._lock.acquire()
+        try:
+            entry = self._entries.get(key, None)
+            if entry == None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            entry[1] = time()
+            return entry[0]
+        finally:
+            self._lock.release()
+
+    def generate(self, key, size, data=None, path=None):
+        # queues generation of the variant at size of the art in data or,
+        # if not passed, in the file at path - unless it is already queued
+        self._lock.acquire()
+        try:
+            if key in self._pending or key in self._entries:
+                return
+            self._pending.add(key)
+        finally:
+            self._lock.release()
+        run_async_function(self._generate, (key, size, data, path), queue='art')
+
+    def _generate(self, key, size, data, path):
+        try:
+            try:
+                if data == None:
+                    f = open(path, 'rb')
+                    try:
+                        data = f.read()
+                    finally:
+                        f.close()
+                scaled = scale(data, size)
+            except Exception, e:
+                log.debug('Could not scale art %s to %d: %s' % (key, size, e))
+                return
+            self._add(key, scaled)
+        finally:
+            self._lock.acquire()
+            self._pending.discard(key)
+            self._lock.release()
+
+    def _add(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        self._lock.acquire()
+        try:
+            if key in self._entries:
+                return
+            self._entries[key] = [data, time()]
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                oldest = min(self._entries.iteritems(), key=lambda e: e[1][1])[0]
+                self.size -= len(self._entries.pop(oldest)[0])
+        finally:
+            self._lock.release()
+
+
+try:
+    cache_bytes = int(config.get_parameter('brisa', 'scaled_art_cache_bytes'))
+except:
+    cache_bytes = 8 * 1024 * 1024
+
+cache = ScaledArtCache(cache_bytes)
+
+metrics.add_gauge('scaled_art_cache_hits', lambda: cache.hits)
+metrics.add_gauge('scaled_art_cache_misses', lambda: cache.misses)
+metrics.add_gauge('scaled_art_cache_bytes', lambda: cache.size)
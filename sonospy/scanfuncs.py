@@ -1,5 +1,11 @@
+import os
 import re
 
+try:
+    from scandir import scandir
+except ImportError:
+    scandir = None
+
 def truncate_number(number):
     # find integer portion of number passed as string
     if not number:
@@ -33,3 +39,62 @@ def adjust_tracknumber(tracknumber):
                 tracknumber = ''
     return tracknumber
 
+class WalkCycleError(Exception):
+    # a directory has been reached a second time following symlinks
+    pass
+
+def walk(top, followlinks=False, exclude=None):
+    # like os.walk(top, followlinks=followlinks) (top down, dirs can be pruned),
+    # but takes file types from scandir where available rather than a stat per entry
+    # directories whose path contains a string in exclude are skipped with their contents
+    # when following links, reaching a directory again (by st_dev/st_ino) raises
+    # WalkCycleError
+    visited = set()
+    stack = [top]
+    while stack:
+        path = stack.pop()
+        if exclude and [ex for ex in exclude if ex in path]:
+            continue
+        if followlinks:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            key = (st.st_dev, st.st_ino)
+            if key in visited:
+                raise WalkCycleError(path)
+            visited.add(key)
+        try:
+            dirs, files, links = listdir(path)
+        except OSError:
+            continue
+        yield path, dirs, files
+        for d in reversed(dirs):
+            if followlinks or not d in links:
+                stack.append(os.path.join(path, d))
+
+def listdir(path):
+    # returns the directories, the files and the set of directories that are symlinks in path
+    dirs = []
+    files = []
+    links = set()
+    if scandir != None:
+        for entry in scandir(path):
+            try:
+                isdir = entry.is_dir()
+            except OSError:
+                isdir = False
+            if isdir:
+                dirs.append(entry.name)
+                if entry.is_symlink(): links.add(entry.name)
+            else:
+                files.append(entry.name)
+    else:
+        for name in os.listdir(path):
+            fullname = os.path.join(path, name)
+            if os.path.isdir(fullname):
+                dirs.append(name)
+                if os.path.islink(fullname): links.add(name)
+            else:
+                files.append(name)
+    return dirs, files, links
@@ -1,6 +1,6 @@
 
-from brisa.core.reactors import SelectReactor
-reactor = SelectReactor()
+from brisa.core.reactors import install_default_reactor
+reactor = install_default_reactor()
 
 import sys
 fenc = sys.getfilesystemencoding()
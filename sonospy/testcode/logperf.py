@@ -0,0 +1,38 @@
+#!/usr/bin/python
+# -*- encoding: utf8 -*-
+# time the debug logging done for a request when debug output is off for
+# the module: eager formatting through the logger, eager formatting through
+# log.debug, and lazy arguments through log.debug
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from brisa.core import log
+
+requests = 10000
+# roughly the debug calls made by StaticFileSonos.application and render
+calls = 40
+
+environ = dict(('HTTP_X_HEADER_%d' % i, 'value %d' % i) for i in range(20))
+
+def logger_eager():
+    for i in range(calls):
+        log.root_logger.debug('application environ %s' % environ)
+
+def eager():
+    for i in range(calls):
+        log.debug('application environ %s' % environ)
+
+def lazy():
+    for i in range(calls):
+        log.debug('application environ %s', environ)
+
+print 'debug output enabled: %s' % log.is_enabled()
+for test in [logger_eager, eager, lazy]:
+    start = time.time()
+    for r in range(requests):
+        test()
+    elapsed = time.time() - start
+    print '%-14s %8.1f us per request' % (test.__name__, elapsed / requests * 1000000)
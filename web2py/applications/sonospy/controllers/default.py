@@ -35,6 +35,14 @@ active_ifaces = get_active_ifaces()
 ip_address = get_ip_address(active_ifaces[0])
 #print ip_address
 
+# shared keep-alive client for the pycpoint data resources
+cpclient = local_import('cpclient').get_client(ip_address, 50101)
+
+# album art loaded in the background into a shared cache
+art_workers = 4
+art_thumbsize = 200
+artcache = local_import('artcache').get_cache('applications/sonospy/static/art', '/sonospy/static/art', art_workers, art_thumbsize)
+
 escape_entities = {'"' : '&quot;', "'" : '&apos;', " " : '%20'}
 escape_entities_quotepos = {'"' : '&quot;', "'" : '&apos;'}
 unescape_entities_quotepos = {'&quot;' : '"', '&apos;' : "'"}
@@ -75,14 +83,6 @@ url_escape_entities = {
                   }
 
 
-def unwrap_data(datastring):
-    # translate the string returned from the server to a list
-    datastring = escape(datastring, escape_entities_quotepos)
-    datadict = datastring.split('_|_')
-    if datadict[len(datadict)-1] == '':
-        datadict.pop()
-    return datadict
-
 def get_message(datadict):
     # remove any message from the end of the controlpoint response and return it
     message = None
@@ -103,19 +103,27 @@ def index():
     response.flash = T('Welcome to sonospy')
     # default page - get list of servers and renderers to display
     try:
-        datastring=urllib.urlopen('http://' + ip_address + ':50101/data/deviceData').read()
+        datadict = cpclient.fetch('deviceData')
     except IOError:
         response.flash = T('Unable to connect to pycpoint webserver')
         return dict(message='')
     
-    datadict = unwrap_data(datastring)
     return dict(message=datadict)
 
+def albumthumbnail(row):
+    # use the cached thumbnail if the art has been loaded (in this or a
+    # previous session), otherwise whatever the album record holds
+    if row.arturi != '' and row.arturi != None:
+        url = artcache.get_url(row.arturi, thumbnail=True)
+        if url != None:
+            return url
+    return row.artname
+
 @service.json
 def JSONgallery():
     itemcount = 0
     gallery = []
-    for row in db().select(db.album.title,db.album.creator,db.album.artname,db.album.data, orderby=db.album.title.upper()):
+    for row in db().select(db.album.title,db.album.creator,db.album.arturi,db.album.artname,db.album.data, orderby=db.album.title.upper()):
         print row.title
         print row.creator
         print row.artname
@@ -124,7 +132,7 @@ def JSONgallery():
         if title.startswith('<') and title.endswith('>'): title = '[' + title[1:-1] + ']'
         creator = unescape(row.creator, unescape_entities_quotepos)
         data = unescape(row.data, unescape_entities_quotepos)
-        gallery.append((row.artname,title,'','',creator,data))
+        gallery.append((albumthumbnail(row),title,'','',creator,data))
         itemcount += 1
     return gallery
 
@@ -134,7 +142,7 @@ def flow():
     out += '<div id="contentflow" class="ContentFlow">'
     out += '<div class="loadIndicator"><div class="indicator"></div></div>'
     out += '<div class="flow" id="flowtarget">'
-    for row in db().select(db.album.title,db.album.creator,db.album.artname,db.album.data, orderby=db.album.title.upper()):
+    for row in db().select(db.album.title,db.album.creator,db.album.arturi,db.album.artname,db.album.data, orderby=db.album.title.upper()):
         print row.title
         print row.creator
         print row.artname
@@ -152,7 +160,7 @@ def flow():
         
 #        if itemcount > 20: continue
         
-        out += '<img class="item" id="' + id + '" menu="' + menu + '" src="' + row.artname + '" title="' + outtitle + '" data="' + data + '"></img>'
+        out += '<img class="item" id="' + id + '" menu="' + menu + '" src="' + albumthumbnail(row) + '" title="' + outtitle + '" data="' + data + '"></img>'
         itemcount += 1
         
     out += '</div>'
@@ -186,25 +194,24 @@ def clearalbums():
 def JSONloadalbumart(id=''):
     print "JSONloadalbumart"
     print id
-    import urllib
     if id == '':
+        # queue the art of all albums for loading in the background, the
+        # per album calls that follow then mostly find it already loaded
         numrecs = db(db.album.id > 0).count()
+        for row in db(db.album.id > 0).select(db.album.arturi, orderby=db.album.id):
+            if row.arturi != '' and row.arturi != None:
+                artcache.fetch(row.arturi)
         return['count=' + str(numrecs)]    
     else:
         id = int(id)
         rows = db(db.album.id == id).select(db.album.id, db.album.arturi, db.album.artname)
         for row in rows:    # should only be one!
-            if row.arturi == '':
-                filename = 'applications/sonospy/static/art/blank.gif'
-            else:        
-                localname = 'applications/sonospy/static/art/' + str(id) + '.jpg'
+            filename = None
+            if row.arturi != '' and row.arturi != None:
                 print "uri: " + str(row.arturi)
-                print "lname: " + str(localname)
-                (filename, headers) = urllib.urlretrieve(row.arturi, localname)
-                print "headers: " + str(headers)
-                if not 'Content-Type' in headers or headers['Content-Type'] == 'text/html':
-                    filename = 'applications/sonospy/static/art/blank.gif'
-            filename = filename[12:]
+                filename = artcache.wait(row.arturi, 60)
+            if filename == None:
+                filename = '/sonospy/static/art/blank.gif'
             print "fname: " + str(filename)
             db(db.album.id == row.id).update(artname = filename)
         return [id, filename]
@@ -231,8 +238,7 @@ def setrenderer():
     print "entry: " + str(pentry)
 
     # get the meta data for this renderer
-    datastring=urllib.urlopen('http://' + ip_address + ':50101/data/rendererData?data='+pentry).read()
-    datadict = unwrap_data(datastring)
+    datadict = cpclient.fetch('rendererData', pentry)
 
     print "rendererData: " + str(datadict)
     print
@@ -249,8 +255,7 @@ def setrenderer():
             queueentry = text
 
     # get the now playing data for this renderer
-    datastring=urllib.urlopen('http://' + ip_address + ':50101/data/rendererPoll?data='+pentry).read()
-    datadict = unwrap_data(datastring)
+    datadict = cpclient.fetch('rendererPoll', pentry)
 
     print "rendererPoll: " + str(datadict)
     print
@@ -295,7 +300,7 @@ def controlrenderer():
     print "---- controlrenderer -----------------------------------"
     print "paramoption: " + str(request.vars.paramoption)
     poption = request.vars.paramoption
-    datastring=urllib.urlopen('http://' + ip_address + ':50101/data/rendererAction?data='+poption).read()
+    cpclient.call('rendererAction', poption)
     return ""
     
 def pollrenderer():
@@ -304,8 +309,7 @@ def pollrenderer():
     ptype = request.vars.renderertype
     ptarget = request.vars.renderertarget
     pentry = ptype + '::' + ptitle
-    datastring=urllib.urlopen('http://' + ip_address + ':50101/data/rendererPoll?data='+pentry).read()
-    datadict = unwrap_data(datastring)
+    datadict = cpclient.fetch('rendererPoll', pentry)
     out = formatrendererstatus(datadict)
     return out
 
@@ -371,8 +375,7 @@ def pollserver():
     ptype = request.vars.servertype
     qdata = request.vars.queuedata
     pentry = ptype + '::' + ptitle
-    datastring=urllib.urlopen('http://' + ip_address + ':50101/data/serverPoll?data='+pentry).read()
-    datadict = unwrap_data(datastring)
+    datadict = cpclient.fetch('serverPoll', pentry)
 
     print "pollserver return: " + str(datadict)
 
@@ -397,8 +400,7 @@ def pollqueue():
     qentry = escape(request.vars.queueentry, url_escape_entities)
     qcall = request.vars.queuecall
 
-    datastring=urllib.urlopen('http://' + ip_address + ':50101/data/queuePoll?data='+qentry).read()
-    datadict = unwrap_data(datastring)
+    datadict = cpclient.fetch('queuePoll', qentry)
     out = ''
     for item in datadict:
         entry = item.split('::')
@@ -410,6 +412,39 @@ def pollqueue():
             out += qcall
     return out
 
+def pushstate():
+    # wait for the renderer or queue state to change - the control point
+    # holds the request until something changes (or times out) and returns
+    # the changed entries and the state version to pass on the next call
+    pversion = request.vars.pushversion
+    qcall = request.vars.queuecall
+    datadict = cpclient.fetch('statePush', urllib.quote(pversion))
+    if 'BUSY' in [item.split('::')[0] for item in datadict]:
+        # too many clients waiting at the control point - fail the request
+        # so that the page backs off before polling again
+        raise HTTP(503, 'busy')
+    version = ''
+    queuechanged = False
+    renderdata = []
+    for item in datadict:
+        entry = item.split('::')
+        id = entry[0]
+        if id == 'VERSION':
+            version = entry[1]
+        elif id == 'QUEUE':
+            queuechanged = True
+        else:
+            renderdata.append(item)
+    out = ''
+    if renderdata != []:
+        out += formatrendererstatus(renderdata)
+    # on the first call (no version) the queue has just been fetched
+    if queuechanged and pversion != '':
+        # qcall contains a pre-formatted ajax call for the queue
+        out += qcall
+    out += "update_pushversion('" + version + "');"
+    return out
+
 def getrootdata():
     # get the root data for the selected UPnP server
     print "---- getrootdata -----------------------------------"
@@ -424,8 +459,7 @@ def getrootdata():
     print "entry: " + str(pentry)
 
     # first get all the context menus for this server
-    datastring=urllib.urlopen('http://' + ip_address + ':50101/data/rootMenus?data='+pentry).read()
-    datadict = unwrap_data(datastring)
+    datadict = cpclient.fetch('rootMenus', pentry, cache=True)
 
     # format the menus - create Javascript functions to load them
     # (we use individual functions as only the first one works if
@@ -473,8 +507,7 @@ def getrootdata():
     print menuscripts
 
     # get root entries for this server
-    datastring=urllib.urlopen('http://' + ip_address + ':50101/data/rootData?data='+pentry).read()
-    datadict = unwrap_data(datastring)
+    datadict = cpclient.fetch('rootData', pentry)
 
     # remove any message
     messagescript = ''
@@ -594,8 +627,7 @@ def getdata():
     gotdata = False
     while gotdata == False:
         # get data from the server
-        datastring=urllib.urlopen('http://' + ip_address + ':50101/data/getData?data='+pentry).read()
-        datadict = unwrap_data(datastring)
+        datadict = cpclient.fetch('getData', pentry)
         # check whether we have received any data
         if datadict[0].startswith('NOTREADY'):
             time.sleep(0.3)
@@ -922,7 +954,7 @@ def calloption():
     else:
         pentry = pid + '::' + ptype + '::' + pmenu + '::' + ptitle + ":::" + poption
     print "entry: " + str(pentry)
-    datastring=urllib.urlopen('http://' + ip_address + ':50101/data/playData?data='+pentry).read()
+    cpclient.call('playData', pentry)
 
     return ""
 
@@ -937,7 +969,7 @@ def calloptionmulti():
     
     pentry = 'MULTI' + ':::' + poption + ':::' + pdata
     print "entry: " + str(pentry)
-    datastring=urllib.urlopen('http://' + ip_address + ':50101/data/playData?data='+pentry).read()
+    cpclient.call('playData', pentry)
 
     return ""
 
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+# Background album art loader with a content-addressed local cache.
+#
+# Art is downloaded by a fixed number of worker threads and stored under
+# the hash of its content, so the same cover served from different URIs is
+# kept once. A scaled thumbnail is stored next to it when PIL is available.
+# The URI to file mapping is appended to an index file so that art loaded in
+# a previous session is reused without downloading it again.
+
+import os
+import hashlib
+import threading
+import urllib2
+import Queue
+from cStringIO import StringIO
+
+try:
+    from PIL import Image
+except ImportError:
+    try:
+        import Image
+    except ImportError:
+        Image = None
+
+art_types = {'image/jpeg' : '.jpg',
+             'image/jpg' : '.jpg',
+             'image/png' : '.png',
+             'image/gif' : '.gif',
+             'image/bmp' : '.bmp',
+            }
+
+
+class ArtCache(object):
+
+    def __init__(self, path, urlpath, workers=4, thumbsize=200, timeout=15):
+        self.path = path
+        self.urlpath = urlpath
+        self.workers = workers
+        self.thumbsize = thumbsize
+        self.timeout = timeout
+        self._index = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._queue = Queue.Queue()
+        self._threads = []
+        self._indexname = os.path.join(path, 'index.txt')
+        self._load_index()
+
+    def _load_index(self):
+        # index lines are uri<TAB>name<TAB>thumbname, later lines win
+        if not os.path.exists(self._indexname):
+            return
+        for line in open(self._indexname):
+            entry = line.rstrip('\n').split('\t')
+            if len(entry) != 3:
+                continue
+            uri, name, thumbname = entry
+            if os.path.exists(os.path.join(self.path, name)) and \
+               os.path.exists(os.path.join(self.path, thumbname)):
+                self._index[uri] = (name, thumbname)
+
+    def _add_index(self, uri, name, thumbname):
+        self._lock.acquire()
+        try:
+            self._index[uri] = (name, thumbname)
+            f = open(self._indexname, 'a')
+            try:
+                f.write('%s\t%s\t%s\n' % (uri, name, thumbname))
+            finally:
+                f.close()
+        finally:
+            self._lock.release()
+
+    def get_url(self, uri, thumbnail=False):
+        # returns the URL of the cached art for the uri, or None
+        entry = self._index.get(uri, None)
+        if entry == None:
+            return None
+        if thumbnail:
+            return self.urlpath + '/' + entry[1]
+        return self.urlpath + '/' + entry[0]
+
+    def fetch(self, uri):
+        # queues the uri for loading unless it is cached or already queued,
+        # returns an event that is set when the uri has been processed
+        self._lock.acquire()
+        try:
+            event = self._pending.get(uri, None)
+            if event != None:
+                return event
+            event = threading.Event()
+            if uri in self._index:
+                event.set()
+                return event
+            self._pending[uri] = event
+            if len(self._threads) < self.workers:
+                t = threading.Thread(target=self._worker, name='artcache')
+                t.setDaemon(True)
+                self._threads.append(t)
+                t.start()
+        finally:
+            self._lock.release()
+        self._queue.put(uri)
+        return event
+
+    def wait(self, uri, timeout=None):
+        # loads the uri (if needed) and returns the URL of the cached art,
+        # or None if it could not be loaded
+        self.fetch(uri).wait(timeout)
+        return self.get_url(uri)
+
+    def get_pending(self):
+        return len(self._pending)
+
+    def _worker(self):
+        while True:
+            uri = self._queue.get()
+            try:
+                try:
+                    self._load(uri)
+                except Exception, e:
+                    print "artcache: could not load %s: %s" % (uri, e)
+            finally:
+                self._lock.acquire()
+                try:
+                    event = self._pending.pop(uri, None)
+                finally:
+                    self._lock.release()
+                if event != None:
+                    event.set()
+
+    def _load(self, uri):
+        f = urllib2.urlopen(uri, timeout=self.timeout)
+        try:
+            ctype = f.info().gettype()
+            data = f.read()
+        finally:
+            f.close()
+        if ctype == 'text/html' or data == '':
+            return
+        digest = hashlib.sha1(data).hexdigest()
+        name = digest + art_types.get(ctype, '.jpg')
+        filename = os.path.join(self.path, name)
+        if not os.path.exists(filename):
+            self._write(filename, data)
+        thumbname = self._make_thumbnail(digest, data)
+        if thumbname == None:
+            thumbname = name
+        self._add_index(uri, name, thumbname)
+
+    def _make_thumbnail(self, digest, data):
+        # scales the art down to thumbsize, returns None if PIL is not
+        # available or the image can't be read
+        if Image == None or not self.thumbsize:
+            return None
+        thumbname = '%s_%d.jpg' % (digest, self.thumbsize)
+        filename = os.path.join(self.path, thumbname)
+        if os.path.exists(filename):
+            return thumbname
+        try:
+            image = Image.open(StringIO(data))
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
+            image.thumbnail((self.thumbsize, self.thumbsize), Image.ANTIALIAS)
+            out = StringIO()
+            image.save(out, 'JPEG', quality=85)
+        except Exception, e:
+            print "artcache: could not scale %s: %s" % (digest, e)
+            return None
+        self._write(filename, out.getvalue())
+        return thumbname
+
+    def _write(self, filename, data):
+        # write then rename so that a partial file is never served
+        tmpname = '%s.%d.tmp' % (filename, threading._get_ident())
+        f = open(tmpname, 'wb')
+        try:
+            f.write(data)
+        finally:
+            f.close()
+        if os.name == 'nt' and os.path.exists(filename):
+            os.remove(filename)
+        os.rename(tmpname, filename)
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+def get_cache(path, urlpath, workers=4, thumbsize=200):
+    # caches are shared by all requests of the application
+    _caches_lock.acquire()
+    try:
+        cache = _caches.get(path, None)
+        if cache == None:
+            cache = _caches[path] = ArtCache(path, urlpath, workers, thumbsize)
+        return cache
+    finally:
+        _caches_lock.release()
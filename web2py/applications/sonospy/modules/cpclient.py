@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+# Persistent HTTP client for the control point data resources.
+#
+# Each web2py worker thread keeps its own keep-alive connection to the
+# control point, and asks for the JSON form of the data (a list of entries
+# in the same 'ID::text' format the delimited response contains).
+# Responses of idempotent resources can be cached for a few seconds.
+
+import httplib
+import socket
+import threading
+import time
+import urllib
+from xml.sax.saxutils import escape
+
+try:
+    import json
+except ImportError:
+    from gluon.contrib import simplejson as json
+
+escape_entities_quotepos = {'"' : '&quot;', "'" : '&apos;'}
+data_delim = '_|_'
+
+
+class ControlPointClient(object):
+
+    def __init__(self, host, port=50101, timeout=15, cache_ttl=5):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl
+        self._local = threading.local()
+        self._cache = {}
+        self._cache_lock = threading.Lock()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn == None:
+            conn = httplib.HTTPConnection(self.host, self.port,
+                                          timeout=self.timeout)
+            self._local.conn = conn
+            self._local.used = False
+        return conn
+
+    def _close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn != None:
+            conn.close()
+        self._local.conn = None
+
+    def request(self, path, accept='application/json'):
+        # quote the path as urllib.urlopen does, httplib rejects spaces and
+        # non-ASCII bytes (already quoted parts are left as they are)
+        path = urllib.quote(path, safe="%/:=&?~#+!$,;'@()*[]|")
+        # a connection that was idle may have been closed by the control
+        # point, in which case the request is retried once on a new one
+        while True:
+            conn = self._connect()
+            reused = self._local.used
+            try:
+                conn.putrequest('GET', path, skip_accept_encoding=True)
+                conn.putheader('Accept', accept)
+                conn.endheaders()
+                resp = conn.getresponse()
+                body = resp.read()
+            except (httplib.HTTPException, socket.error), e:
+                self._close()
+                if reused:
+                    continue
+                # callers handle connection failures as for urllib
+                raise IOError(str(e))
+            self._local.used = True
+            if resp.will_close:
+                self._close()
+            return resp.getheader('content-type', ''), body
+
+    def fetch(self, name, data=None, cache=False):
+        # returns the entries of the resource as a list of strings
+        path = '/data/' + name
+        if data != None:
+            path += '?data=' + data
+        if cache:
+            self._cache_lock.acquire()
+            try:
+                entry = self._cache.get(path, None)
+                if entry != None and time.time() - entry[0] < self.cache_ttl:
+                    return list(entry[1])
+            finally:
+                self._cache_lock.release()
+        ctype, body = self.request(path)
+        if ctype.startswith('application/json'):
+            entries = [e.encode('utf-8') for e in json.loads(body)]
+        else:
+            # control point without JSON support
+            entries = body.split(data_delim)
+            if entries and entries[-1] == '':
+                entries.pop()
+        entries = [escape(e, escape_entities_quotepos) for e in entries]
+        if cache:
+            self._cache_lock.acquire()
+            try:
+                self._cache[path] = (time.time(), entries)
+            finally:
+                self._cache_lock.release()
+        return list(entries)
+
+    def call(self, name, data=None):
+        # calls a resource for its side effect, returns the raw body
+        path = '/data/' + name
+        if data != None:
+            path += '?data=' + data
+        return self.request(path, accept='*/*')[1]
+
+    def clear_cache(self):
+        self._cache_lock.acquire()
+        try:
+            self._cache.clear()
+        finally:
+            self._cache_lock.release()
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_client(host, port=50101):
+    # clients are shared by all requests of the application
+    _clients_lock.acquire()
+    try:
+        client = _clients.get((host, port), None)
+        if client == None:
+            client = _clients[(host, port)] = ControlPointClient(host, port)
+        return client
+    finally:
+        _clients_lock.release()